@@ -0,0 +1,22 @@
+import hmac
+from typing import Mapping, Optional
+
+from .config import settings
+
+# Token de administrador (ADMIN_TOKEN) para as rotas de diagnóstico.
+# Aceita `Authorization: Bearer <token>` ou `X-Admin-Token: <token>`.
+# Sem ADMIN_TOKEN configurado, nada é liberado.
+
+
+def admin_token_from(headers: Mapping[str, str]) -> Optional[str]:
+    auth = headers.get("authorization") or ""
+    if auth.lower().startswith("bearer "):
+        return auth[7:].strip()
+    return headers.get("x-admin-token")
+
+
+def is_admin(headers: Mapping[str, str]) -> bool:
+    token = admin_token_from(headers)
+    if not settings.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode())
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import math
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .config import settings
+from .metrics import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REJECTED,
+    ADMISSION_WAIT_SECONDS,
+)
+
+# Controle de admissão das rotas caras (por processo, no event loop):
+# - cada endpoint tem um limite de requests em execução, uma fila limitada
+#   e uma espera máxima na fila; fila cheia = 429 na hora, espera estourada
+#   = 503, ambos com Retry-After estimado pelo tempo médio de atendimento
+# - o chat tem prioridade: enquanto houver chat na fila, ingestão e análise
+#   não ocupam vagas novas (esperam ou são recusadas), e a fila é atendida
+#   chat primeiro
+# - aplicado num middleware ASGI antes de ler o corpo, então um upload
+#   recusado não é recebido
+# - profundidade de fila e vagas em uso em rag_admission_*{endpoint}
+
+Waiter = Tuple["Limiter", "asyncio.Future[None]"]
+
+_waiters: Deque[Waiter] = deque()
+
+
+class Overloaded(Exception):
+    def __init__(self, endpoint: str, reason: str, retry_after: int) -> None:
+        super().__init__(f"{endpoint}: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason  # "queue_full" | "timeout"
+        self.status_code = 429 if reason == "queue_full" else 503
+        self.retry_after = retry_after
+
+
+class Limiter:
+    def __init__(
+        self,
+        endpoint: str,
+        limit: int,
+        max_queue: int,
+        wait_seconds: float,
+        priority: bool = False,
+    ) -> None:
+        self.endpoint = endpoint
+        self.limit = max(limit, 1)
+        self.max_queue = max(max_queue, 0)
+        self.wait_seconds = wait_seconds
+        self.priority = priority
+        self.in_flight = 0
+        self.waiting = 0
+        # média móvel do tempo de atendimento, para o Retry-After
+        self.service_seconds = 1.0
+
+    def _can_start(self) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        if self.priority:
+            return True
+        return not any(l.priority and l.waiting for l in LIMITERS.values())
+
+    def _start(self) -> None:
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.labels(self.endpoint).inc()
+
+    def _set_waiting(self, delta: int) -> None:
+        self.waiting += delta
+        ADMISSION_QUEUE_DEPTH.labels(self.endpoint).inc(delta)
+
+    def retry_after(self) -> int:
+        # tempo para a fila atual andar, entre 1 s e 1 min
+        estimate = self.service_seconds * (self.waiting + 1) / self.limit
+        return min(max(math.ceil(estimate), 1), 60)
+
+    def _reject(self, reason: str) -> Overloaded:
+        ADMISSION_REJECTED.labels(self.endpoint, reason).inc()
+        return Overloaded(self.endpoint, reason, self.retry_after())
+
+    async def acquire(self) -> None:
+        start = time.perf_counter()
+        if self._can_start() and not self.waiting:
+            self._start()
+            ADMISSION_WAIT_SECONDS.labels(self.endpoint).observe(0)
+            return
+        if self.waiting >= self.max_queue or self.wait_seconds <= 0:
+            raise self._reject("queue_full")
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        entry: Waiter = (self, future)
+        _waiters.append(entry)
+        self._set_waiting(1)
+        try:
+            # _wake reserva a vaga (in_flight) antes de resolver o future
+            await asyncio.wait_for(future, self.wait_seconds)
+        except asyncio.TimeoutError:
+            # o prazo pode estourar depois de _wake já ter reservado a vaga
+            if future.done() and not future.cancelled():
+                self.release(0)
+            raise self._reject("timeout") from None
+        except BaseException:
+            # cancelado (cliente desconectou) depois de ganhar a vaga
+            if future.done() and not future.cancelled():
+                self.release(0)
+            raise
+        finally:
+            try:
+                _waiters.remove(entry)
+            except ValueError:
+                pass
+            self._set_waiting(-1)
+            # a fila do chat andou: ingestão/análise podem estar liberadas
+            _wake()
+        ADMISSION_WAIT_SECONDS.labels(self.endpoint).observe(time.perf_counter() - start)
+
+    def release(self, seconds: float) -> None:
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.labels(self.endpoint).dec()
+        if seconds > 0:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * seconds
+        _wake()
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "wait_seconds": self.wait_seconds,
+            "priority": self.priority,
+            "service_seconds": round(self.service_seconds, 3),
+        }
+
+
+def _wake() -> None:
+    # chat primeiro; dentro de cada grupo, ordem de chegada
+    for limiter, future in sorted(_waiters, key=lambda w: not w[0].priority):
+        if not future.done() and limiter._can_start():
+            limiter._start()
+            future.set_result(None)
+
+
+LIMITERS: Dict[str, Limiter] = {
+    "chat": Limiter(
+        "chat",
+        settings.CHAT_MAX_CONCURRENCY,
+        settings.CHAT_MAX_QUEUE,
+        settings.CHAT_QUEUE_TIMEOUT,
+        priority=True,
+    ),
+    "ingest": Limiter(
+        "ingest",
+        settings.INGEST_MAX_CONCURRENCY,
+        settings.INGEST_MAX_QUEUE,
+        settings.INGEST_QUEUE_TIMEOUT,
+    ),
+    "analyze": Limiter(
+        "analyze",
+        settings.ANALYZE_MAX_CONCURRENCY,
+        settings.ANALYZE_MAX_QUEUE,
+        settings.ANALYZE_QUEUE_TIMEOUT,
+    ),
+}
+
+ROUTES: List[Tuple[str, "re.Pattern[str]", str]] = [
+    ("POST", re.compile(r"^/api/conversation/chat$"), "chat"),
+    ("POST", re.compile(r"^/api/ingest$"), "ingest"),
+    (
+        "POST",
+        re.compile(r"^/api/conversation/[^/]+/analyze-and-generate$"),
+        "analyze",
+    ),
+]
+
+
+def limiter_for(method: str, path: str) -> Optional[Limiter]:
+    for route_method, pattern, endpoint in ROUTES:
+        if method == route_method and pattern.match(path):
+            return LIMITERS[endpoint]
+    return None
+
+
+def admission_state() -> Dict[str, Dict[str, Any]]:
+    return {endpoint: limiter.state() for endpoint, limiter in LIMITERS.items()}
+
+
+async def _send_overloaded(send: Any, error: Overloaded) -> None:
+    body = json.dumps(
+        {"detail": "Servidor ocupado, tente novamente em instantes."}
+    ).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": error.status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(error.retry_after).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+# ==========================
+# MIDDLEWARE (ASGI puro: recusa antes de ler o corpo)
+# ==========================
+class AdmissionMiddleware:
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        limiter = None
+        if scope["type"] == "http":
+            limiter = limiter_for(scope.get("method", ""), scope.get("path", ""))
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            await _send_overloaded(send, e)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - start)
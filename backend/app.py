@@ -1,22 +1,67 @@
+import asyncio
+import contextvars
+import json
 import os
 import shutil
 import tempfile
+import time
 from pathlib import Path
 from typing import Any, Dict, Optional
 
-from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from .admin import is_admin
+from .admission import AdmissionMiddleware, admission_state
+from .config import settings
 
-from .db import get_connection, init_db
+from .db import PoolTimeout, close_pool, pool_stats, pooled_connection
+from .db_async import close_async_pool
+from .jobs import FINISHED_STATUSES, JobQueueFull, job_backlog, submit_job
+from .metrics import HTTP_SECONDS, render_metrics
 from .orchestrator import (
-    analyze_and_generate,
+    get_analysis_job_progress,
     handle_chat_message,
     ingest_file,
+    load_conversation_contents,
+    load_conversation_history,
+    load_conversation_usage,
+    load_usage_summary,
+    start_analysis_job,
     start_conversation,
 )
+from .profiling import (
+    ProfiledRoute,
+    ProfilingMiddleware,
+    list_profiles,
+    profile_path,
+    profiling_enabled,
+)
+from .providers import close_async_client
+from .query_stats import statement_stats
+from .warmup import startup_state, warm_up
 
 app = FastAPI(title="RAG Learning Web")
+if profiling_enabled():
+    # antes de declarar as rotas: vale para todas as síncronas
+    app.router.route_class = ProfiledRoute
+    app.add_middleware(ProfilingMiddleware)
+# por fora do profiler: request recusada não é perfilada
+if settings.ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware)
 
 
 # ==========================
@@ -24,23 +69,104 @@ app = FastAPI(title="RAG Learning Web")
 # ==========================
 
 def get_db():
-    conn = get_connection()
-    try:
+    # conexão emprestada do pool do processo (devolvida ao fim da request)
+    with pooled_connection() as conn:
         yield conn
+
+
+def require_admin(request: Request) -> None:
+    # rotas de diagnóstico: 404 se não houver ADMIN_TOKEN, 403 se não bater
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(request.headers):
+        raise HTTPException(status_code=403, detail="Token de admin inválido.")
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc: PoolTimeout) -> JSONResponse:
+    # pool esgotado: falha rápida, cliente tenta de novo
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(JobQueueFull)
+async def job_queue_full_handler(request, exc: JobQueueFull) -> JSONResponse:
+    # um job leva dezenas de segundos; não adianta tentar logo em seguida
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "30"},
+    )
+
+
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    # rótulo = template da rota (/api/jobs/{job_id}), não o path cru
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
     finally:
-        conn.close()
+        route = request.scope.get("route")
+        HTTP_SECONDS.labels(
+            getattr(route, "path", "desconhecida"), request.method, str(status)
+        ).observe(time.perf_counter() - start)
 
 
 @app.on_event("startup")
-def on_startup() -> None:
+async def on_startup() -> None:
     """
-    Inicializa o schema do banco ao subir a API.
+    Não bloqueia o startup: migrações (sob advisory lock), pools e o
+    caminho de embedding aquecem em background. Ver /readyz.
     """
-    conn = get_connection()
-    try:
-        init_db(conn)
-    finally:
-        conn.close()
+    app.state.warm_up_task = asyncio.create_task(warm_up())
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    """
+    Fecha os pools de conexão e o cliente HTTP compartilhado.
+    """
+    close_pool()
+    await close_async_pool()
+    await close_async_client()
+
+
+# ==========================
+# SAÚDE
+# ==========================
+
+@app.get("/healthz")
+def healthz() -> Dict[str, str]:
+    """
+    Liveness: o processo está de pé (não toca no banco).
+    """
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    """
+    Métricas Prometheus: latência por etapa e por provedor/modelo,
+    retries, erros, chamadas em voo e estado dos pools.
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/readyz")
+def readyz() -> JSONResponse:
+    """
+    Readiness: schema migrado e pools abertos.
+    503 enquanto o aquecimento não terminou.
+    """
+    body = {**startup_state.as_dict(), "db_pool": pool_stats()}
+    return JSONResponse(status_code=200 if startup_state.ready else 503, content=body)
 
 
 # ==========================
@@ -53,10 +179,24 @@ class ChatRequest(BaseModel):
     conversation_id: Optional[int] = None
 
 
+class ChatTurn(BaseModel):
+    index: int
+    pergunta: str
+    resposta: str
+
+
 class ChatResponse(BaseModel):
     conversation_id: int
     answer: str
-    history: list[dict]
+    turn: ChatTurn
+    revision: int
+
+
+class HistoryPage(BaseModel):
+    conversation_id: int
+    revision: int
+    turns: list[ChatTurn]
+    next_after: Optional[int] = None
 
 
 class AnalyzeRequest(BaseModel):
@@ -67,24 +207,15 @@ class AnalyzeRequest(BaseModel):
 # ROTAS API
 # ==========================
 
-@app.post("/api/ingest")
-async def api_ingest(
-    file: UploadFile = File(...),
-    title: Optional[str] = Form(None),
-    conn=Depends(get_db),
-):
-    """
-    Recebe um arquivo (PDF, áudio, vídeo ou imagem), faz ingestão
-    e salva os chunks + embeddings na tabela 'documents'.
-    """
+def _ingest_upload(file: UploadFile, title: str) -> Dict[str, Any]:
     suffix = os.path.splitext(file.filename)[1]
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
         shutil.copyfileobj(file.file, tmp)
         tmp_path = tmp.name
 
     try:
-        result = ingest_file(conn, tmp_path, title or file.filename)
-        return result
+        with pooled_connection() as conn:
+            return ingest_file(conn, tmp_path, title)
     finally:
         try:
             os.remove(tmp_path)
@@ -92,6 +223,27 @@ async def api_ingest(
             pass
 
 
+@app.post("/api/ingest")
+async def api_ingest(
+    file: UploadFile = File(...),
+    title: Optional[str] = Form(None),
+):
+    """
+    Recebe um arquivo (PDF, áudio, vídeo ou imagem), faz ingestão
+    e salva os chunks + embeddings na tabela 'documents'.
+    Roda no executor de ingestão (INGEST_MAX_CONCURRENCY threads), fora do
+    event loop e do threadpool que atende o chat.
+    """
+    future = submit_job(
+        contextvars.copy_context().run,
+        _ingest_upload,
+        file,
+        title or file.filename,
+        kind="ingest",
+    )
+    return await asyncio.wrap_future(future)
+
+
 @app.post("/api/conversation/start")
 def api_start_conversation(conn=Depends(get_db)) -> Dict[str, int]:
     """
@@ -103,44 +255,279 @@ def api_start_conversation(conn=Depends(get_db)) -> Dict[str, int]:
 
 
 @app.post("/api/conversation/chat", response_model=ChatResponse)
-def api_chat(
+async def api_chat(
     body: ChatRequest,
-    conn=Depends(get_db),
+    background_tasks: BackgroundTasks,
 ):
     """
     Envia uma mensagem do usuário para o bot RAG.
     Se conversation_id for None, o orchestrator cria uma conversa nova.
+    Devolve só o turno novo + revisão (o histórico completo fica em /history).
+    O turno é gravado antes da resposta; trechos recuperados, uso e
+    memória são gravados depois que ela é enviada.
     """
-    result = handle_chat_message(
-        conn=conn,
+    result, persist = await handle_chat_message(
         conversation_id=body.conversation_id,
         message=body.message,
         top_k=body.top_k,
     )
+    background_tasks.add_task(persist)
     return ChatResponse(**result)
 
 
-@app.post("/api/conversation/{conversation_id}/analyze-and-generate")
+@app.get(
+    "/api/conversation/{conversation_id}/history",
+    response_model=HistoryPage,
+)
+def api_history(
+    conversation_id: int,
+    after: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    conn=Depends(get_db),
+):
+    """
+    Histórico paginado por cursor: turnos com índice > after.
+    Use next_after como próximo cursor (None = fim).
+    """
+    try:
+        result = load_conversation_history(
+            conn=conn,
+            conversation_id=conversation_id,
+            after=after,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return HistoryPage(**result)
+
+
+@app.get("/api/conversation/{conversation_id}/contents")
+def api_contents(
+    conversation_id: int,
+    request: Request,
+    conn=Depends(get_db),
+):
+    """
+    Conteúdos de estudo da análise mais recente (sem chamar o LLM).
+    analyzed_revision < revision indica turnos novos desde a análise.
+    Suporta ETag / If-None-Match (304 quando nada mudou).
+    """
+    try:
+        etag, body = load_conversation_contents(
+            conn=conn,
+            conversation_id=conversation_id,
+            if_none_match=request.headers.get("if-none-match"),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=body, headers=headers)
+
+
+@app.get(
+    "/api/conversation/{conversation_id}/usage",
+    dependencies=[Depends(require_admin)],
+)
+def api_conversation_usage(conversation_id: int, conn=Depends(get_db)):
+    """
+    Tokens e custo estimado da conversa: total, por tipo de chamada
+    (chat, análise, geração...), por turno e por análise.
+    """
+    try:
+        return load_conversation_usage(conn=conn, conversation_id=conversation_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/api/usage", dependencies=[Depends(require_admin)])
+def api_usage_summary(
+    group_by: str = Query("kind"),
+    days: int = Query(7, ge=1, le=365),
+    conn=Depends(get_db),
+):
+    """Uso agregado dos últimos `days` dias (group_by: kind, operation, day)."""
+    try:
+        return load_usage_summary(conn=conn, group_by=group_by, days=days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post(
+    "/api/conversation/{conversation_id}/analyze-and-generate",
+    status_code=202,
+)
 def api_analyze(
     conversation_id: int,
     body: AnalyzeRequest,
     conn=Depends(get_db),
 ):
     """
-    Dispara análise da conversa + geração de conteúdos personalizados
-    (usando modelo da Groq).
+    Enfileira análise da conversa + geração de conteúdos personalizados
+    (usando modelo da Groq). Devolve o job_id na hora; acompanhe em
+    /api/jobs/{job_id} (polling) ou /api/jobs/{job_id}/events (SSE).
     """
     try:
-        result = analyze_and_generate(
+        return start_analysis_job(
             conn=conn,
             conversation_id=conversation_id,
             preferred_format=body.preferred_format,
         )
-        return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def _load_job_progress(job_id: int, after: int) -> Dict[str, Any]:
+    with pooled_connection() as conn:
+        return get_analysis_job_progress(conn, job_id, after_content_id=after)
+
+
+@app.get("/api/jobs/{job_id}")
+def api_job(
+    job_id: int,
+    after: int = Query(0, ge=0),
+) -> Dict[str, Any]:
+    """
+    Polling do job: status + conteúdos salvos com id > after.
+    """
+    try:
+        return _load_job_progress(job_id, after)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def api_job_events(
+    job_id: int,
+    request: Request,
+    after: int = Query(0, ge=0),
+):
+    """
+    Server-Sent Events do job: "content" a cada conteúdo salvo (id = id do
+    conteúdo, então Last-Event-ID retoma de onde parou), "status" quando o
+    estágio muda e "end" quando termina.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after = max(after, int(last_event_id))
+
+    try:
+        progress = await run_in_threadpool(_load_job_progress, job_id, after)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def events():
+        nonlocal after, progress
+        last_state = None
+        while True:
+            for content in progress["contents"]:
+                yield _sse("content", content, event_id=content["id"])
+                after = content["id"]
+
+            state = (progress["status"], progress["stage"])
+            if state != last_state:
+                last_state = state
+                yield _sse(
+                    "status",
+                    {
+                        "status": progress["status"],
+                        "stage": progress["stage"],
+                        "failures": progress["failures"],
+                        "error": progress["error"],
+                    },
+                )
+
+            if progress["status"] in FINISHED_STATUSES:
+                yield _sse("end", {"status": progress["status"]})
+                return
+            if await request.is_disconnected():
+                return
+
+            await asyncio.sleep(settings.JOB_EVENTS_POLL_SECONDS)
+            progress = await run_in_threadpool(_load_job_progress, job_id, after)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ==========================
+# DIAGNÓSTICO (admin)
+# ==========================
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+def api_list_profiles() -> Dict[str, Any]:
+    """
+    Perfis salvos (mais recentes primeiro). Perfile uma request enviando
+    `X-Profile: 1` com o token de admin; o id volta em `X-Profile-Id`.
+    """
+    return {"profiles": list_profiles()}
+
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def api_download_profile(profile_id: str) -> FileResponse:
+    """
+    Pilhas no formato "folded" (speedscope / flamegraph.pl).
+    """
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado.")
+    return FileResponse(
+        str(path),
+        media_type="text/plain",
+        filename=f"profile-{profile_id}.folded",
+    )
+
+
+@app.get("/api/admin/admission", dependencies=[Depends(require_admin)])
+def api_admission() -> Dict[str, Any]:
+    """
+    Vagas, filas e tempo médio de atendimento por endpoint neste processo,
+    e jobs em background na fila ou rodando.
+    """
+    return {
+        "enabled": settings.ADMISSION_CONTROL,
+        "endpoints": admission_state(),
+        "jobs": {kind: job_backlog(kind) for kind in ("analysis", "ingest", "profile")},
+    }
+
+
+@app.get("/api/admin/db/statements", dependencies=[Depends(require_admin)])
+def api_db_statements(
+    order: str = Query("total"),
+    limit: int = Query(20, ge=1, le=200),
+) -> Dict[str, Any]:
+    """
+    Top statements deste processo (total, mean, max ou calls), com linhas
+    por chamada e o último plano capturado das queries lentas.
+    """
+    try:
+        return statement_stats.top(order=order, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete(
+    "/api/admin/db/statements",
+    status_code=204,
+    dependencies=[Depends(require_admin)],
+)
+def api_reset_db_statements() -> Response:
+    """
+    Zera as estatísticas (ex.: antes de um teste de carga).
+    """
+    statement_stats.reset()
+    return Response(status_code=204)
+
+
 # ==========================
 # SERVIR FRONTEND (pasta /frontend)
 # ==========================
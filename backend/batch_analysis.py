@@ -0,0 +1,289 @@
+import argparse
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from psycopg2.extensions import connection as PgConnection
+
+from .config import settings
+from .conversation import ConversationHistory
+from .conversation_analysis import (
+    ANALYSIS_FAILED,
+    analyze_conversation_with_groq,
+    save_profile_information_bulk,
+)
+from .usage import call_with_usage, save_usage
+
+# Reanálise em lote das conversas salvas (ex.: depois de mudar o prompt):
+#   python -m backend.batch_analysis --run prompt-v2
+# - ids lidos em páginas por keyset (id > último), nunca OFFSET
+# - pool limitado de threads; o ritmo real é o do token bucket de
+#   providers.py, então o gargalo é a cota do provedor, não o código
+# - resultados gravados em lote (um INSERT por flush) junto com o
+#   checkpoint, na mesma transação
+# - checkpoint = maior id até o qual tudo já foi gravado; um run
+#   interrompido (ou com falhas) recomeça dali, e as linhas marcadas com o
+#   nome do run (profile_information.batch_run) impedem duplicatas acima dele
+
+logger = logging.getLogger(__name__)
+
+Row = Tuple[int, ConversationHistory, List[Dict[str, Any]]]
+
+
+def get_checkpoint(conn: PgConnection, run: str) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO batch_analysis_runs (run)
+            VALUES (%s)
+            ON CONFLICT (run) DO NOTHING;
+            """,
+            (run,),
+        )
+        cur.execute(
+            """
+            SELECT last_conversation_id, processed, failed, finished_at
+            FROM batch_analysis_runs
+            WHERE run = %s;
+            """,
+            (run,),
+        )
+        row = cur.fetchone()
+    return {
+        "last_conversation_id": row[0],
+        "processed": row[1],
+        "failed": row[2],
+        "finished_at": row[3],
+    }
+
+
+def iter_conversations(
+    conn: PgConnection,
+    run: str,
+    after_id: int,
+    page_size: int,
+    min_turns: int,
+) -> Iterator[Tuple[int, ConversationHistory]]:
+    # keyset: cada página começa no último id visto
+    last_id = after_id
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.id, c.history
+                FROM conversation c
+                WHERE c.id > %s
+                  AND jsonb_array_length(c.history) >= %s
+                  AND NOT EXISTS (
+                      SELECT 1 FROM profile_information p
+                      WHERE p.conversation_id = c.id AND p.batch_run = %s
+                  )
+                ORDER BY c.id
+                LIMIT %s;
+                """,
+                (last_id, max(min_turns, 1), run, page_size),
+            )
+            rows = cur.fetchall()
+        if not rows:
+            return
+        for conversation_id, history in rows:
+            yield conversation_id, history or []
+        last_id = rows[-1][0]
+
+
+def _flush(
+    conn: PgConnection,
+    run: str,
+    rows: List[Row],
+    watermark: Optional[int],
+    failed: int,
+) -> None:
+    # análises + checkpoint na mesma transação
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        save_profile_information_bulk(conn, rows, batch_run=run)
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE batch_analysis_runs
+                SET last_conversation_id = GREATEST(
+                        last_conversation_id, COALESCE(%s, last_conversation_id)
+                    ),
+                    processed = processed + %s,
+                    failed = failed + %s,
+                    updated_at = NOW()
+                WHERE run = %s;
+                """,
+                (watermark, len(rows), failed, run),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+
+def run_batch(
+    conn: PgConnection,
+    run: str,
+    workers: Optional[int] = None,
+    page_size: int = 500,
+    flush_size: int = 50,
+    min_turns: int = 1,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    checkpoint = get_checkpoint(conn, run)
+    workers = max(1, workers or settings.BATCH_ANALYSIS_WORKERS)
+    max_in_flight = workers * 2
+
+    conversations = iter_conversations(
+        conn, run, checkpoint["last_conversation_id"], page_size, min_turns
+    )
+
+    in_flight: Dict[Future, Tuple[int, ConversationHistory]] = {}
+    submitted: Deque[int] = deque()  # ids em ordem de envio
+    finished: Set[int] = set()
+    buffer: List[Row] = []
+    failed_since_flush = 0
+    watermark: Optional[int] = None
+    stats = {"processed": 0, "failed": 0}
+    started = time.monotonic()
+    submitted_count = 0
+    exhausted = False
+
+    def advance_watermark() -> None:
+        nonlocal watermark
+        while submitted and submitted[0] in finished:
+            watermark = submitted.popleft()
+            finished.discard(watermark)
+
+    def flush() -> None:
+        nonlocal buffer, failed_since_flush
+        advance_watermark()
+        _flush(conn, run, buffer, watermark, failed_since_flush)
+        buffer = []
+        failed_since_flush = 0
+        elapsed = max(time.monotonic() - started, 1e-6)
+        logger.info(
+            "lote %s: %d analisadas, %d falhas, %.2f conversas/s, checkpoint=%s",
+            run,
+            stats["processed"],
+            stats["failed"],
+            stats["processed"] / elapsed,
+            watermark,
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # mantém a janela cheia sem carregar tudo em memória
+            while not exhausted and len(in_flight) < max_in_flight:
+                if limit is not None and submitted_count >= limit:
+                    exhausted = True
+                    break
+                item = next(conversations, None)
+                if item is None:
+                    exhausted = True
+                    break
+                conversation_id, history = item
+                future = executor.submit(
+                    call_with_usage, analyze_conversation_with_groq, history
+                )
+                in_flight[future] = (conversation_id, history)
+                submitted.append(conversation_id)
+                submitted_count += 1
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                conversation_id, history = in_flight.pop(future)
+                try:
+                    analysis, usage = future.result()
+                except Exception:
+                    # falha segura o checkpoint: o próximo run tenta de novo
+                    # (as já gravadas acima dela são puladas pelo batch_run)
+                    stats["failed"] += 1
+                    failed_since_flush += 1
+                    logger.warning(
+                        "lote %s: falha na conversa %s",
+                        run,
+                        conversation_id,
+                        exc_info=True,
+                    )
+                    continue
+                save_usage(
+                    conn, usage, kind="batch_analysis", conversation_id=conversation_id
+                )
+                if any(item.get("subtema") == ANALYSIS_FAILED for item in analysis):
+                    stats["failed"] += 1
+                    failed_since_flush += 1
+                    continue
+                finished.add(conversation_id)
+                buffer.append((conversation_id, history, analysis))
+                stats["processed"] += 1
+
+            if len(buffer) >= flush_size:
+                flush()
+
+    flush()
+    if limit is None:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE batch_analysis_runs SET finished_at = NOW() WHERE run = %s;",
+                (run,),
+            )
+    return {**stats, "checkpoint": watermark}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reanálise em lote das conversas.")
+    parser.add_argument(
+        "--run",
+        required=True,
+        help="nome do run (retoma do checkpoint se já existir)",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--flush-size", type=int, default=50)
+    parser.add_argument("--min-turns", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--status", action="store_true", help="só mostra o checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from .db import get_connection
+
+    conn = get_connection()
+    try:
+        if args.status:
+            checkpoint = get_checkpoint(conn, args.run)
+            print(
+                f"run {args.run}: checkpoint={checkpoint['last_conversation_id']} "
+                f"| analisadas={checkpoint['processed']} | falhas={checkpoint['failed']} "
+                f"| concluído={checkpoint['finished_at'] or 'não'}"
+            )
+            return
+        stats = run_batch(
+            conn,
+            args.run,
+            workers=args.workers,
+            page_size=args.page_size,
+            flush_size=args.flush_size,
+            min_turns=args.min_turns,
+            limit=args.limit,
+        )
+        print(
+            f"analisadas: {stats['processed']} | falhas: {stats['failed']} "
+            f"| checkpoint: {stats['checkpoint']}"
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
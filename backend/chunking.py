@@ -2,12 +2,15 @@ import json
 import re
 from typing import Any, Dict, List, Optional
 
-import requests
+import asyncpg
 from psycopg2.extensions import connection as PgConnection
 
 from .config import settings, build_openrouter_headers
+from .metrics import timed
+from .providers import post_json, post_json_async
 
 #Divide um texto em chunks, com overlap de parágrafos.
+@timed("chunking")
 def split_text_into_chunks(
     text: str,
     min_words: int = 200,
@@ -95,25 +98,42 @@ def _openrouter_embed_request(inputs: List[str]) -> List[List[float]]:
         "input": inputs,
     }
 
-    resp = requests.post(
-        "https://openrouter.ai/api/v1/embeddings",
+    data = post_json(
+        settings.OPENROUTER_EMBEDDINGS_ENDPOINT,
+        payload,
         headers=headers,
-        json=payload,
         timeout=60,
     )
-    resp.raise_for_status()
-    data = resp.json()
     return [item["embedding"] for item in data["data"]]
 
 
+@timed("embedding")
 def embed_texts(texts: List[str]) -> List[List[float]]:
     return _openrouter_embed_request(texts)
 
 
+@timed("embedding")
+async def embed_texts_async(texts: List[str]) -> List[List[float]]:
+    headers = build_openrouter_headers("rag-learning-web-embeddings")
+    payload = {
+        "model": settings.EMBEDDING_MODEL_NAME,
+        "input": texts,
+    }
+
+    data = await post_json_async(
+        settings.OPENROUTER_EMBEDDINGS_ENDPOINT,
+        payload,
+        headers=headers,
+        timeout=60,
+    )
+    return [item["embedding"] for item in data["data"]]
+
+
 def embedding_to_pgvector_str(embedding: List[float]) -> str:
     return "[" + ",".join(f"{x:.6f}" for x in embedding) + "]"
 
 #insert chunks
+@timed("insert_documents")
 def insert_documents(
     conn: PgConnection,
     chunks: List[str],
@@ -154,11 +174,39 @@ def is_already_ingested(conn: PgConnection, source: str, doc_type: str) -> bool:
         )
         return cur.fetchone() is not None
 
+# registro da ingestão (atribui o uso de tokens ao arquivo)
+def save_ingestion(
+    conn: PgConnection,
+    source: Optional[str],
+    doc_type: Optional[str],
+    title: Optional[str],
+    inserted_chunks: int,
+    skipped_reason: Optional[str] = None,
+) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO ingestions (source, doc_type, title, inserted_chunks, skipped_reason)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id;
+            """,
+            (source, doc_type, title, inserted_chunks, skipped_reason),
+        )
+        return cur.fetchone()[0]
+
 #busca vetorial
 def search_similar(
     conn: PgConnection, query: str, k: int = 5
 ) -> List[Dict[str, Any]]:
     query_emb = embed_texts([query])[0]
+    return search_similar_by_embedding(conn, query_emb, k=k)
+
+
+# busca vetorial com embedding já calculado (permite embeddar em lote)
+@timed("vector_search")
+def search_similar_by_embedding(
+    conn: PgConnection, query_emb: List[float], k: int = 5
+) -> List[Dict[str, Any]]:
     vector_str = embedding_to_pgvector_str(query_emb)
 
     with conn.cursor() as cur:
@@ -186,6 +234,68 @@ def search_similar(
         )
     return results
 
+# reordena um conjunto fixo de documentos pela distância ao embedding
+# (sem varrer o índice: só os ids informados)
+@timed("rerank")
+def rerank_documents_by_embedding(
+    conn: PgConnection,
+    document_ids: List[int],
+    query_emb: List[float],
+    k: int = 5,
+) -> List[Dict[str, Any]]:
+    if not document_ids:
+        return []
+    vector_str = embedding_to_pgvector_str(query_emb)
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT id, content, metadata, (embedding <-> %s::vector) AS distance
+            FROM documents
+            WHERE id = ANY(%s)
+            ORDER BY distance
+            LIMIT %s;
+            """,
+            (vector_str, list(document_ids), k),
+        )
+        rows = cur.fetchall()
+
+    return [
+        {
+            "id": doc_id,
+            "content": content,
+            "metadata": metadata,
+            "distance": float(distance),
+        }
+        for doc_id, content, metadata, distance in rows
+    ]
+
+# busca vetorial (asyncpg) com embedding já calculado
+@timed("vector_search")
+async def search_similar_by_embedding_async(
+    conn: asyncpg.Connection, query_emb: List[float], k: int = 5
+) -> List[Dict[str, Any]]:
+    vector_str = embedding_to_pgvector_str(query_emb)
+    rows = await conn.fetch(
+        """
+        SELECT id, content, metadata, (embedding <-> $1::vector) AS distance
+        FROM documents
+        ORDER BY embedding <-> $1::vector
+        LIMIT $2;
+        """,
+        vector_str,
+        k,
+    )
+    return [
+        {
+            "id": row["id"],
+            "content": row["content"],
+            "metadata": row["metadata"],
+            "distance": float(row["distance"]),
+        }
+        for row in rows
+    ]
+
 # contexto rag
 def build_context_from_results(results: List[Dict[str, Any]]) -> str:
 
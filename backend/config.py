@@ -1,5 +1,7 @@
+import json
 import os
-from typing import Set
+import tempfile
+from typing import Any, Dict, Set
 
 
 class Settings:
@@ -9,6 +11,42 @@ class Settings:
             "DATABASE_URL"
         )
 
+        # Aplica migrações pendentes ao subir a API (0 = só via
+        # `python -m backend.migrations` no deploy)
+        self.MIGRATE_ON_STARTUP: bool = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
+        # Aquecimento em background no startup
+        self.WARMUP_EMBEDDING: bool = os.getenv("WARMUP_EMBEDDING", "1") == "1"
+        self.WARMUP_RETRY_SECONDS: float = float(
+            os.getenv("WARMUP_RETRY_SECONDS", "3")
+        )
+
+        # Pool de conexões (por processo)
+        self.DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+        self.DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+        # espera máxima por uma conexão livre (s)
+        self.DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+        # conexões ociosas há mais que isso recebem SELECT 1 no checkout
+        self.DB_POOL_CHECK_IDLE_SECONDS: float = float(
+            os.getenv("DB_POOL_CHECK_IDLE_SECONDS", "30")
+        )
+        self.DB_STATEMENT_TIMEOUT_MS: int = int(
+            os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000")
+        )
+
+        # Instrumentação das queries (ver query_stats.py)
+        self.DB_QUERY_STATS: bool = os.getenv("DB_QUERY_STATS", "1") == "1"
+        # acima disso (ms) a query é lenta e tem o plano capturado (0 = nunca)
+        self.DB_SLOW_QUERY_MS: float = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+        self.DB_EXPLAIN_INTERVAL_SECONDS: float = float(
+            os.getenv("DB_EXPLAIN_INTERVAL_SECONDS", "300")
+        )
+        self.DB_QUERY_STATS_MAX: int = int(os.getenv("DB_QUERY_STATS_MAX", "500"))
+
+        # Pool asyncpg (caminho assíncrono do chat)
+        self.ASYNC_DB_POOL_MIN_SIZE: int = int(os.getenv("ASYNC_DB_POOL_MIN_SIZE", "1"))
+        self.ASYNC_DB_POOL_MAX_SIZE: int = int(os.getenv("ASYNC_DB_POOL_MAX_SIZE", "10"))
+
         # OpenRouter
         self.OPENROUTER_API_KEY: str = os.getenv("OPENROUTER_API_KEY", "")
         self.OPENROUTER_SITE_URL: str = os.getenv("OPENROUTER_SITE_URL", "")
@@ -17,6 +55,11 @@ class Settings:
             "rag-learning-web",
         )
 
+        self.OPENROUTER_EMBEDDINGS_ENDPOINT: str = os.getenv(
+            "OPENROUTER_EMBEDDINGS_ENDPOINT",
+            "https://openrouter.ai/api/v1/embeddings",
+        )
+
         # Modelos de embedding
         self.EMBEDDING_MODEL_NAME: str = os.getenv(
             "EMBEDDING_MODEL_NAME",
@@ -49,7 +92,164 @@ class Settings:
             "openai/gpt-oss-120b",
         )
 
-        self.LEARNING_CONTENT_MODEL: str = "llama-3.3-70b-versatile"
+        self.LEARNING_CONTENT_MODEL: str = os.getenv(
+            "LEARNING_CONTENT_MODEL",
+            "llama-3.3-70b-versatile",
+        )
+        # modelo pequeno/rápido: turnos rasos do chat e fallback de orçamento
+        self.FAST_CHAT_MODEL: str = os.getenv("FAST_CHAT_MODEL", "llama-3.1-8b-instant")
+        # roteamento por etapa (ver model_routing.py), JSON sobrescrevendo os
+        # padrões: {"chat": {"large_min_turns": 5, "budget_seconds": 15}, ...}
+        self.MODEL_ROUTES: Dict[str, Dict[str, Any]] = json.loads(
+            os.getenv("MODEL_ROUTES", "{}")
+        )
+        # cache de roteiros entre alunos: "always" | "probability" | "off"
+        self.SCRIPT_CACHE_POLICY: str = os.getenv("SCRIPT_CACHE_POLICY", "always")
+        # na política "probability": chance de reutilizar (senão gera e renova)
+        self.SCRIPT_CACHE_REUSE_PROBABILITY: float = float(
+            os.getenv("SCRIPT_CACHE_REUSE_PROBABILITY", "0.8")
+        )
+        # taxonomia de subtemas (k-means nos embeddings, ver taxonomy.py)
+        # clusters na reconstrução (0 = automático, ~sqrt(documentos / 2))
+        self.TAXONOMY_CLUSTERS: int = int(os.getenv("TAXONOMY_CLUSTERS", "0"))
+        # contexto da geração vem dos nós da taxonomia (senão busca vetorial)
+        self.TAXONOMY_RETRIEVAL: bool = os.getenv("TAXONOMY_RETRIEVAL", "1") == "1"
+        # distância máxima (L2) entre o subtema e o centróide para mapeá-lo a
+        # um nó; acima disso fica sem nó (busca vetorial) e sem alias (0 = sem limite)
+        self.TAXONOMY_MAX_CENTROID_DISTANCE: float = float(
+            os.getenv("TAXONOMY_MAX_CENTROID_DISTANCE", "1.0")
+        )
+        # mínimo de trechos já discutidos no chat para usá-los como contexto
+        # da geração (abaixo disso: nó da taxonomia / busca vetorial)
+        self.CONTENT_MIN_DISCUSSED_CHUNKS: int = int(
+            os.getenv("CONTENT_MIN_DISCUSSED_CHUNKS", "3")
+        )
+        # gera vídeo/áudio/texto do mesmo subtema em uma chamada só
+        self.CONTENT_MULTI_FORMAT: bool = os.getenv("CONTENT_MULTI_FORMAT", "1") == "1"
+        # gerações de roteiro simultâneas por análise
+        self.CONTENT_GENERATION_CONCURRENCY: int = int(
+            os.getenv("CONTENT_GENERATION_CONCURRENCY", "4")
+        )
+
+        # Cliente dos provedores (pool keep-alive, retry, rate limit)
+        self.PROVIDER_POOL_CONNECTIONS: int = int(
+            os.getenv("PROVIDER_POOL_CONNECTIONS", "4")
+        )
+        self.PROVIDER_POOL_MAXSIZE: int = int(os.getenv("PROVIDER_POOL_MAXSIZE", "20"))
+        self.PROVIDER_MAX_RETRIES: int = int(os.getenv("PROVIDER_MAX_RETRIES", "3"))
+        self.PROVIDER_BACKOFF_BASE: float = float(
+            os.getenv("PROVIDER_BACKOFF_BASE", "0.5")
+        )
+        self.PROVIDER_BACKOFF_MAX: float = float(os.getenv("PROVIDER_BACKOFF_MAX", "20"))
+        # token bucket inicial (req/s e rajada) até o provedor mandar os headers
+        self.PROVIDER_DEFAULT_RATE: float = float(
+            os.getenv("PROVIDER_DEFAULT_RATE", "5")
+        )
+        self.PROVIDER_DEFAULT_BURST: float = float(
+            os.getenv("PROVIDER_DEFAULT_BURST", "10")
+        )
+
+        # hedging (chamadas JSON): cópia após o quantil observado de latência
+        self.PROVIDER_HEDGING: bool = os.getenv("PROVIDER_HEDGING", "1") == "1"
+        self.PROVIDER_HEDGE_QUANTILE: float = float(
+            os.getenv("PROVIDER_HEDGE_QUANTILE", "0.95")
+        )
+        self.PROVIDER_HEDGE_MIN_DELAY: float = float(
+            os.getenv("PROVIDER_HEDGE_MIN_DELAY", "0.05")
+        )
+        self.PROVIDER_HEDGE_MIN_SAMPLES: int = int(
+            os.getenv("PROVIDER_HEDGE_MIN_SAMPLES", "20")
+        )
+        self.PROVIDER_HEDGE_WINDOW: int = int(os.getenv("PROVIDER_HEDGE_WINDOW", "200"))
+        # no máximo essa fração das chamadas vira cópia
+        self.PROVIDER_HEDGE_MAX_RATIO: float = float(
+            os.getenv("PROVIDER_HEDGE_MAX_RATIO", "0.1")
+        )
+        # threads só para as cópias do caminho síncrono (a original roda na
+        # thread de quem chamou)
+        self.PROVIDER_HEDGE_THREADS: int = int(os.getenv("PROVIDER_HEDGE_THREADS", "8"))
+        # com hedging ativo, cada tentativa das duas chamadas fica limitada a
+        # FACTOR x atraso da cópia (mínimo MIN_TIMEOUT s): a perdedora ou uma
+        # chamada travada não seguram uma thread pelo timeout inteiro
+        self.PROVIDER_HEDGE_TIMEOUT_FACTOR: float = float(
+            os.getenv("PROVIDER_HEDGE_TIMEOUT_FACTOR", "4")
+        )
+        self.PROVIDER_HEDGE_MIN_TIMEOUT: float = float(
+            os.getenv("PROVIDER_HEDGE_MIN_TIMEOUT", "10")
+        )
+        # circuit breaker por (provedor, modelo)
+        self.CIRCUIT_BREAKER: bool = os.getenv("CIRCUIT_BREAKER", "1") == "1"
+        self.CIRCUIT_WINDOW: int = int(os.getenv("CIRCUIT_WINDOW", "20"))
+        self.CIRCUIT_MIN_CALLS: int = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+        self.CIRCUIT_ERROR_RATE: float = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+        self.CIRCUIT_OPEN_SECONDS: float = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+        # preços para estimar custo (US$ por 1M tokens), JSON por modelo:
+        # {"openai/gpt-oss-120b": {"input": 0.15, "output": 0.75}, ...}
+        self.PROVIDER_PRICES: Dict[str, Dict[str, float]] = json.loads(
+            os.getenv("PROVIDER_PRICES", "{}")
+        )
+
+        # Jobs de análise + geração (threads por processo)
+        self.ANALYSIS_JOB_WORKERS: int = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+        # jobs na fila + rodando por processo; acima disso o POST devolve 429
+        self.ANALYSIS_JOB_MAX_PENDING: int = int(
+            os.getenv("ANALYSIS_JOB_MAX_PENDING", "20")
+        )
+        # job sem atualização há mais que isso veio de um worker que caiu:
+        # vira "failed" na leitura e não bloqueia um novo POST
+        self.ANALYSIS_JOB_STALE_MINUTES: float = float(
+            os.getenv("ANALYSIS_JOB_STALE_MINUTES", "15")
+        )
+        # análise incremental em background a cada N turnos novos (0 = desliga)
+        self.ANALYSIS_EVERY_N_TURNS: int = int(os.getenv("ANALYSIS_EVERY_N_TURNS", "4"))
+        self.PROFILE_REFRESH_WORKERS: int = int(
+            os.getenv("PROFILE_REFRESH_WORKERS", "1")
+        )
+        # reanálise em lote (python -m backend.batch_analysis)
+        self.BATCH_ANALYSIS_WORKERS: int = int(os.getenv("BATCH_ANALYSIS_WORKERS", "4"))
+        # intervalo de polling do stream SSE de progresso (s)
+        self.JOB_EVENTS_POLL_SECONDS: float = float(
+            os.getenv("JOB_EVENTS_POLL_SECONDS", "1")
+        )
+
+        # Memória da conversa (últimos turnos literais + resumo acumulado)
+        self.MEMORY_RECENT_TURNS: int = int(os.getenv("MEMORY_RECENT_TURNS", "6"))
+        self.MEMORY_SUMMARY_BATCH: int = int(os.getenv("MEMORY_SUMMARY_BATCH", "4"))
+        self.MEMORY_SUMMARY_MAX_WORDS: int = int(
+            os.getenv("MEMORY_SUMMARY_MAX_WORDS", "250")
+        )
+        self.MEMORY_SUMMARY_MODEL: str = os.getenv(
+            "MEMORY_SUMMARY_MODEL",
+            "llama-3.1-8b-instant",
+        )
+
+        # Diagnóstico (rotas /api/admin/* e profiler); vazio = desligado
+        self.ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+        # fração das requests perfiladas automaticamente (0 = só via header)
+        self.PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+        self.PROFILE_DIR: str = os.getenv(
+            "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "rag-profiles")
+        )
+        self.PROFILE_MAX_FILES: int = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+        # Controle de admissão por endpoint (por processo): requests em
+        # execução, fila de espera e espera máxima na fila (s); fila cheia
+        # devolve 429 e espera estourada 503, ambos com Retry-After
+        self.ADMISSION_CONTROL: bool = os.getenv("ADMISSION_CONTROL", "1") == "1"
+        self.CHAT_MAX_CONCURRENCY: int = int(os.getenv("CHAT_MAX_CONCURRENCY", "32"))
+        self.CHAT_MAX_QUEUE: int = int(os.getenv("CHAT_MAX_QUEUE", "64"))
+        self.CHAT_QUEUE_TIMEOUT: float = float(os.getenv("CHAT_QUEUE_TIMEOUT", "5"))
+        # a ingestão roda num executor próprio com INGEST_MAX_CONCURRENCY threads
+        self.INGEST_MAX_CONCURRENCY: int = int(os.getenv("INGEST_MAX_CONCURRENCY", "2"))
+        self.INGEST_MAX_QUEUE: int = int(os.getenv("INGEST_MAX_QUEUE", "4"))
+        self.INGEST_QUEUE_TIMEOUT: float = float(os.getenv("INGEST_QUEUE_TIMEOUT", "2"))
+        self.ANALYZE_MAX_CONCURRENCY: int = int(os.getenv("ANALYZE_MAX_CONCURRENCY", "4"))
+        self.ANALYZE_MAX_QUEUE: int = int(os.getenv("ANALYZE_MAX_QUEUE", "8"))
+        self.ANALYZE_QUEUE_TIMEOUT: float = float(
+            os.getenv("ANALYZE_QUEUE_TIMEOUT", "2")
+        )
 
 
 settings = Settings()
@@ -1,14 +1,60 @@
 import json
-from typing import Any, Dict, List, Optional
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
 from psycopg2.extensions import connection as PgConnection
 from psycopg2.extras import Json
 
 from .config import settings, build_groq_headers
-from .chunking import search_similar, build_context_from_results
+from .metrics import timed
+from .model_routing import post_json_routed, route_for, stage_config
+from .chunking import (
+    build_context_from_results,
+    embed_texts,
+    rerank_documents_by_embedding,
+    search_similar_by_embedding,
+)
+from .conversation import get_discussed_document_ids
+from .content_library import get_library_script
+from .script_cache import (
+    build_cache_key,
+    get_cached_script,
+    normalize_text,
+    should_reuse,
+    source_hash,
+    store_cached_script,
+)
+from .taxonomy import get_subtopic_documents, map_subtemas_to_nodes
+from .usage import call_with_usage, forward_usage
+
+# suba a versão ao mudar o prompt de geração (invalida o cache de roteiros)
+LEARNING_SCRIPT_PROMPT_VERSION = "v1"
+# idem para o prompt multi-formato: roteiros dele têm chave própria no cache
+MULTI_FORMAT_PROMPT_VERSION = "multi-v1"
+
+SCRIPT_PROMPT_VERSIONS = {
+    "single": LEARNING_SCRIPT_PROMPT_VERSION,
+    "multi": MULTI_FORMAT_PROMPT_VERSION,
+}
+
+# Mapeamento de tipo
+CONTENT_TYPE_LABELS = {
+    "video": "roteiro de vídeo curto explicativo",
+    "audio": "roteiro de áudio/podcast curto",
+    "texto": "texto explicativo curto",
+}
+
+
+def _strip_code_fence(raw: str) -> str:
+    # Caso venha em bloco ```json ... ```
+    if raw.startswith("```"):
+        raw = raw.strip("`")
+        if raw.lower().startswith("json"):
+            raw = raw[4:].strip()
+    return raw
 
 
+@timed("script_generation")
 def generate_learning_script_with_groq(
     subtema: str,
     nivel: str,
@@ -19,13 +65,7 @@ def generate_learning_script_with_groq(
     headers = build_groq_headers()
     headers["Content-Type"] = "application/json"
 
-    # Mapeamento de tipo
-    tipo_map = {
-        "video": "roteiro de vídeo curto explicativo",
-        "audio": "roteiro de áudio/podcast curto",
-        "texto": "texto explicativo curto",
-    }
-    tipo_legivel = tipo_map.get(content_type.lower(), "texto explicativo curto")
+    tipo_legivel = CONTENT_TYPE_LABELS.get(content_type.lower(), "texto explicativo curto")
 
     system_prompt = """
 Você é um especialista em educação e criação de conteúdos didáticos personalizados.
@@ -68,7 +108,6 @@ IMPORTANTE:
 """.strip()
 
     payload = {
-        "model": settings.LEARNING_CONTENT_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_content},
@@ -76,21 +115,14 @@ IMPORTANTE:
         "temperature": 0.5,
     }
 
-    resp = requests.post(
+    data, model = post_json_routed(
         settings.GROQ_CHAT_COMPLETIONS_ENDPOINT,
+        payload,
+        route_for("content_generation", context_chars=len(context)),
         headers=headers,
-        json=payload,
         timeout=120,
     )
-    resp.raise_for_status()
-    data = resp.json()
-    raw = data["choices"][0]["message"]["content"].strip()
-
-    # Caso venha em bloco ```json ... ```
-    if raw.startswith("```"):
-        raw = raw.strip("`")
-        if raw.lower().startswith("json"):
-            raw = raw[4:].strip()
+    raw = _strip_code_fence(data["choices"][0]["message"]["content"].strip())
 
     try:
         parsed = json.loads(raw)
@@ -99,12 +131,117 @@ IMPORTANTE:
         return {
             "title": f"Conteúdo sobre {subtema}",
             "script": raw,
+            "model": model,
         }
 
     title = parsed.get("title") or f"Conteúdo sobre {subtema}"
     script = parsed.get("script") or ""
 
-    return {"title": title, "script": script}
+    return {"title": title, "script": script, "model": model}
+
+
+# Vários formatos em uma chamada só: o contexto (trechos + justificativa)
+# é enviado uma vez. Devolve só os formatos que passaram na validação;
+# quem chama gera os que faltarem com generate_learning_script_with_groq.
+@timed("script_generation_multi")
+def generate_multi_format_scripts_with_groq(
+    subtema: str,
+    nivel: str,
+    content_types: List[str],
+    context: str,
+    justificativa: str = "",
+) -> Dict[str, Dict[str, str]]:
+    headers = build_groq_headers()
+    headers["Content-Type"] = "application/json"
+
+    formatos = "\n".join(
+        f'- "{ct}": {CONTENT_TYPE_LABELS.get(ct, "texto explicativo curto")}'
+        for ct in content_types
+    )
+    exemplo = ",\n".join(
+        f'    "{ct}": {{"title": "título curto e claro", "script": "roteiro ou texto completo"}}'
+        for ct in content_types
+    )
+
+    system_prompt = f"""
+Você é um especialista em educação e criação de conteúdos didáticos personalizados.
+
+Seu trabalho:
+- Criar conteúdos focados em sanar dificuldades do aluno em um subtema específico,
+  um para cada formato pedido, cada um adequado ao seu meio.
+- Usar APENAS o contexto fornecido (trechos da base de documentos).
+- NÃO inventar fatos fora desse contexto.
+- Ser claro, objetivo e em português do Brasil.
+
+Formato de saída:
+- Retorne ESTRITAMENTE um JSON válido com uma chave por formato:
+  {{
+{exemplo}
+  }}
+""".strip()
+
+    user_content = f"""
+Subtema: {subtema}
+Nível atual do aluno (segundo análise): {nivel}
+
+Formatos desejados:
+{formatos}
+
+Justificativa/resumo das dificuldades do aluno:
+{justificativa or "(sem justificativa detalhada fornecida)"}
+
+Contexto (trechos da base de conhecimento) – USE APENAS ESTA FONTE:
+{context}
+
+Tarefa:
+- Gere um conteúdo completo para CADA formato, explicando o subtema de forma acessível ao nível do aluno.
+- Ajude o aluno a avançar, mas sem ser superficial.
+- Use exemplos simples quando fizer sentido.
+- Adote um tom amigável e motivador.
+
+IMPORTANTE:
+- Saída ESTRITAMENTE em JSON com as chaves {", ".join(f'"{ct}"' for ct in content_types)}.
+- Não inclua comentários, markdown ou texto fora do JSON.
+""".strip()
+
+    payload = {
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ],
+        "temperature": 0.5,
+        "response_format": {"type": "json_object"},
+    }
+
+    data, model = post_json_routed(
+        settings.GROQ_CHAT_COMPLETIONS_ENDPOINT,
+        payload,
+        route_for("content_generation", context_chars=len(context)),
+        headers=headers,
+        timeout=180,
+    )
+    raw = _strip_code_fence(data["choices"][0]["message"]["content"].strip())
+
+    try:
+        parsed = json.loads(raw)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+
+    scripts: Dict[str, Dict[str, str]] = {}
+    for content_type in content_types:
+        item = parsed.get(content_type)
+        if not isinstance(item, dict):
+            continue
+        script = item.get("script")
+        if not isinstance(script, str) or not script.strip():
+            continue
+        title = item.get("title")
+        if not isinstance(title, str) or not title.strip():
+            title = f"Conteúdo sobre {subtema}"
+        scripts[content_type] = {"title": title, "script": script, "model": model}
+    return scripts
 
 
 def save_personalized_content(
@@ -160,6 +297,86 @@ def save_personalized_content(
     }
 
 
+# conteúdos já salvos de uma análise (id > after_content_id), sem LLM
+def get_analysis_contents(
+    conn: PgConnection,
+    conversation_id: int,
+    analysis_id: int,
+    after_content_id: int = 0,
+) -> List[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT id, subtema, nivel, content_type, title, script, extra_metadata
+            FROM personalized_learning_contents
+            WHERE analysis_id = %s
+              AND id > %s
+            ORDER BY id;
+            """,
+            (analysis_id, after_content_id),
+        )
+        rows = cur.fetchall()
+    return [
+        {
+            "id": content_id,
+            "conversation_id": conversation_id,
+            "analysis_id": analysis_id,
+            "subtema": subtema,
+            "nivel": nivel,
+            "content_type": content_type,
+            "title": title,
+            "script": script,
+            "extra_metadata": extra or {},
+        }
+        for content_id, subtema, nivel, content_type, title, script, extra in rows
+    ]
+
+
+# estado leve dos conteúdos da conversa (base do ETag): revisão atual,
+# última análise (fora dos lotes offline) e contagem/último id dos conteúdos
+def get_contents_state(conn: PgConnection, conversation_id: int) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT
+                jsonb_array_length(c.history),
+                p.id,
+                p.analyzed_revision,
+                COALESCE(pc.total, 0),
+                COALESCE(pc.last_id, 0)
+            FROM conversation c
+            LEFT JOIN LATERAL (
+                SELECT id, analyzed_revision
+                FROM profile_information
+                WHERE conversation_id = c.id
+                  AND batch_run IS NULL
+                ORDER BY created_at DESC
+                LIMIT 1
+            ) p ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT COUNT(*) AS total, MAX(id) AS last_id
+                FROM personalized_learning_contents
+                WHERE analysis_id = p.id
+            ) pc ON TRUE
+            WHERE c.id = %s;
+            """,
+            (conversation_id,),
+        )
+        row = cur.fetchone()
+    if not row:
+        raise ValueError(f"Conversa {conversation_id} não encontrada.")
+    revision, analysis_id, analyzed_revision, total, last_id = row
+    return {
+        "conversation_id": conversation_id,
+        "revision": revision or 0,
+        "analysis_id": analysis_id,
+        "analyzed_revision": analyzed_revision,
+        "content_count": total,
+        "last_content_id": last_id,
+    }
+
+
+@timed("content_generation")
 def generate_personalized_contents(
     conn: PgConnection,
     conversation_id: int,
@@ -167,7 +384,7 @@ def generate_personalized_contents(
     analysis: List[Dict[str, Any]],
     top_k_docs: int = 8,
     preferred_format: Optional[str] = None,
-) -> List[Dict[str, Any]]:
+) -> Dict[str, List[Dict[str, Any]]]:
     nivel_rank_map = {
         "básico": 1,
         "basico": 1,
@@ -186,12 +403,15 @@ def generate_personalized_contents(
             ranks.append(rank)
 
     if not ranks:
-        return []
+        return {"contents": [], "failures": []}
 
     min_rank = min(ranks)
+    # chaves de cache/biblioteca usam o modelo principal da etapa; roteiros
+    # de fallback (orçamento estourado) são servidos mas não cacheados
+    content_model = stage_config("content_generation")["model"]
 
-    generated: List[Dict[str, Any]] = []
-
+    # só subtemas de maior dificuldade
+    targets: List[Dict[str, Any]] = []
     for item in analysis:
         subtema = (item.get("subtema") or "").strip()
         nivel_raw = (item.get("nivel") or "").strip()
@@ -200,53 +420,300 @@ def generate_personalized_contents(
 
         if not subtema or not nivel_raw:
             continue
-        
-        # só níveis de maior dificuldade
+
         rank = nivel_rank_map.get(nivel_key)
         if rank is None or rank != min_rank:
-            continue 
+            continue
+
+        targets.append(
+            {
+                "subtema": subtema,
+                "nivel": nivel_raw,
+                "justificativa": justificativa,
+                "rank": rank,
+            }
+        )
 
-        # Busca vetorial pelos docs mais relevantes do subtema
-        results = search_similar(conn, query=subtema, k=top_k_docs)
+    if not targets:
+        return {"contents": [], "failures": []}
+
+    if preferred_format in {"video", "audio", "texto"}:
+        content_types = [preferred_format]
+    else:
+        content_types = ["video", "audio", "texto"]
+
+    # Contexto de cada subtema, em ordem de preferência:
+    # 1) trechos que o aluno já discutiu no chat (conversation_retrievals),
+    #    reordenados contra o subtema: membros do nó da taxonomia pela
+    #    distância ao centróide, ou pela distância ao embedding do subtema
+    # 2) nó da taxonomia (consulta pronta)
+    # 3) busca vetorial nova (só como último recurso)
+    # Embeddings só para subtemas sem nó, todos em um lote só.
+    discussed_ids = get_discussed_document_ids(conn, conversation_id)
+    min_discussed = max(settings.CONTENT_MIN_DISCUSSED_CHUNKS, 1)
+
+    node_by_subtema: Dict[str, int] = {}
+    if settings.TAXONOMY_RETRIEVAL:
+        node_by_subtema = map_subtemas_to_nodes(conn, [t["subtema"] for t in targets])
+
+    retrieved: List[Dict[str, Any]] = []
+    for target in targets:
+        subtopic_id = node_by_subtema.get(normalize_text(target["subtema"]))
+        node_results: List[Dict[str, Any]] = []
+        if subtopic_id is not None:
+            node_results = get_subtopic_documents(conn, subtopic_id, k=top_k_docs)
+        if not node_results:
+            retrieved.append({"results": [], "subtopic_id": None})
+            continue
+
+        discussed: List[Dict[str, Any]] = []
+        if discussed_ids:
+            discussed = get_subtopic_documents(
+                conn, subtopic_id, k=top_k_docs, document_ids=discussed_ids
+            )
+        use_discussed = len(discussed) >= min_discussed
+        retrieved.append(
+            {
+                "results": discussed if use_discussed else node_results,
+                "subtopic_id": subtopic_id,
+                # a biblioteca é gerada com o contexto padrão do nó
+                "library_hash": source_hash(node_results),
+                "recuperacao": "conversa" if use_discussed else "taxonomia",
+            }
+        )
+
+    pending_search = [i for i, r in enumerate(retrieved) if not r["results"]]
+    if pending_search:
+        embeddings = embed_texts([targets[i]["subtema"] for i in pending_search])
+        for i, query_emb in zip(pending_search, embeddings):
+            results = rerank_documents_by_embedding(
+                conn, discussed_ids, query_emb, k=top_k_docs
+            )
+            recuperacao = "conversa"
+            if len(results) < min_discussed:
+                results = search_similar_by_embedding(conn, query_emb, k=top_k_docs)
+                recuperacao = "busca_vetorial"
+            retrieved[i] = {
+                "results": results,
+                "subtopic_id": None,
+                "recuperacao": recuperacao,
+            }
+
+    jobs: List[Dict[str, Any]] = []
+    for target_index, (target, retrieval) in enumerate(zip(targets, retrieved)):
+        results = retrieval["results"]
         if not results:
             continue
+        subtopic_id = retrieval["subtopic_id"]
 
         context = build_context_from_results(results)
         source_doc_ids = [r["id"] for r in results]
-
-        if preferred_format in {"video", "audio", "texto"}:
-            content_types = [preferred_format]
-        else:
-            content_types = ["video", "audio", "texto"]
+        chunks_hash = source_hash(results)
+        extra_metadata = {
+            "justificativa": target["justificativa"],
+            "source_doc_ids": source_doc_ids,
+            "num_trechos_contexto": len(results),
+            "nivel_rank_usado": target["rank"],
+            "criterio_geracao": "apenas níveis de maior dificuldade na análise",
+            "recuperacao": retrieval["recuperacao"],
+        }
+        if subtopic_id is not None:
+            extra_metadata["subtopic_id"] = subtopic_id
 
         for content_type in content_types:
-            gen = generate_learning_script_with_groq(
-                subtema=subtema,
-                nivel=nivel_raw,
-                content_type=content_type,
-                context=context,
-                justificativa=justificativa,
+            jobs.append(
+                {
+                    **target,
+                    "target_index": target_index,
+                    "content_type": content_type,
+                    "context": context,
+                    "source_doc_ids": source_doc_ids,
+                    "chunks_hash": chunks_hash,
+                    "library_hash": retrieval.get("library_hash"),
+                    # uma chave por prompt (single / multi)
+                    "cache_keys": {
+                        mode: build_cache_key(
+                            subtema=target["subtema"],
+                            nivel=target["nivel"],
+                            content_type=content_type,
+                            source_doc_ids=source_doc_ids,
+                            chunks_hash=chunks_hash,
+                            model=content_model,
+                            prompt_version=version,
+                        )
+                        for mode, version in SCRIPT_PROMPT_VERSIONS.items()
+                    },
+                    "extra_metadata": extra_metadata,
+                }
             )
 
-            extra_metadata = {
-                "justificativa": justificativa,
-                "source_doc_ids": source_doc_ids,
-                "num_trechos_contexto": len(results),
-                "nivel_rank_usado": rank,
-                "criterio_geracao": "apenas níveis de maior dificuldade na análise",
-            }
-
-            saved = save_personalized_content(
-                conn=conn,
-                conversation_id=conversation_id,
-                analysis_id=analysis_id,
-                subtema=subtema,
-                nivel=nivel_raw,
-                content_type=content_type,
-                title=gen["title"],
-                script=gen["script"],
-                extra_metadata=extra_metadata,
+    generated: List[Tuple[int, Dict[str, Any]]] = []
+    failures: List[Dict[str, Any]] = []
+
+    def save(
+        index: int,
+        gen: Dict[str, str],
+        script_cache: str,
+        generation_mode: Optional[str] = None,
+    ) -> int:
+        job = jobs[index]
+        extra_metadata = {**job["extra_metadata"], "script_cache": script_cache}
+        if gen.get("model"):
+            extra_metadata["model"] = gen["model"]
+        if generation_mode:
+            extra_metadata["generation_mode"] = generation_mode
+        saved = save_personalized_content(
+            conn=conn,
+            conversation_id=conversation_id,
+            analysis_id=analysis_id,
+            subtema=job["subtema"],
+            nivel=job["nivel"],
+            content_type=job["content_type"],
+            title=gen["title"],
+            script=gen["script"],
+            extra_metadata=extra_metadata,
+        )
+        generated.append((index, saved))
+        return saved["id"]
+
+    # 1) biblioteca pré-gerada (nó da taxonomia + nível + formato, trechos
+    #    do nó iguais aos atuais), só quando o contexto é o padrão do nó: com
+    #    trechos da conversa o roteiro tem que sair deles; 2) cache entre
+    #    alunos (mesmo subtema/nível/formato/trechos -> mesmo roteiro, de
+    #    qualquer um dos prompts); 3) só então o LLM
+    to_generate: List[int] = []
+    for index, job in enumerate(jobs):
+        subtopic_id = job["extra_metadata"].get("subtopic_id")
+        if subtopic_id is not None and job["extra_metadata"]["recuperacao"] == "taxonomia":
+            library = get_library_script(
+                conn,
+                subtopic_id=subtopic_id,
+                nivel=job["nivel"],
+                content_type=job["content_type"],
+                chunks_hash=job["library_hash"],
+                model=content_model,
+                prompt_versions=list(SCRIPT_PROMPT_VERSIONS.values()),
             )
-            generated.append(saved)
-
-    return generated
+            if library is not None:
+                save(index, library, "library")
+                continue
+        cached = None
+        if should_reuse():
+            for cache_key in job["cache_keys"].values():
+                cached = get_cached_script(conn, cache_key)
+                if cached is not None:
+                    break
+        if cached is not None:
+            save(index, cached, "hit")
+        else:
+            to_generate.append(index)
+
+    def finish(index: int, gen: Dict[str, str], generation_mode: str) -> int:
+        job = jobs[index]
+        if gen.get("model", content_model) != content_model:
+            return save(index, gen, "fallback", generation_mode)
+        store_cached_script(
+            conn,
+            cache_key=job["cache_keys"][generation_mode],
+            subtema=job["subtema"],
+            nivel=job["nivel"],
+            content_type=job["content_type"],
+            source_doc_ids=job["source_doc_ids"],
+            chunks_hash=job["chunks_hash"],
+            model=content_model,
+            prompt_version=SCRIPT_PROMPT_VERSIONS[generation_mode],
+            title=gen["title"],
+            script=gen["script"],
+        )
+        return save(index, gen, "miss", generation_mode)
+
+    # Agrupa por subtema: com 2+ formatos faltando, uma chamada só gera
+    # todos (contexto enviado uma vez); formatos que falharem na validação
+    # voltam como chamadas separadas.
+    groups: Dict[int, List[int]] = {}
+    for index in to_generate:
+        groups.setdefault(jobs[index]["target_index"], []).append(index)
+
+    # Geração concorrente (limite CONTENT_GENERATION_CONCURRENCY).
+    # Cada roteiro é salvo assim que fica pronto (na thread atual, dona
+    # da conexão); falhas são reportadas por item sem derrubar o lote.
+    max_workers = max(1, min(settings.CONTENT_GENERATION_CONCURRENCY, len(to_generate)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: Dict[Future, Tuple[str, List[int]]] = {}
+
+        def submit_single(index: int) -> None:
+            job = jobs[index]
+            future = executor.submit(
+                call_with_usage,
+                generate_learning_script_with_groq,
+                subtema=job["subtema"],
+                nivel=job["nivel"],
+                content_type=job["content_type"],
+                context=job["context"],
+                justificativa=job["justificativa"],
+            )
+            pending[future] = ("single", [index])
+
+        def submit_multi(indices: List[int]) -> None:
+            job = jobs[indices[0]]
+            future = executor.submit(
+                call_with_usage,
+                generate_multi_format_scripts_with_groq,
+                subtema=job["subtema"],
+                nivel=job["nivel"],
+                content_types=[jobs[i]["content_type"] for i in indices],
+                context=job["context"],
+                justificativa=job["justificativa"],
+            )
+            pending[future] = ("multi", indices)
+
+        for indices in groups.values():
+            if settings.CONTENT_MULTI_FORMAT and len(indices) > 1:
+                submit_multi(indices)
+            else:
+                for index in indices:
+                    submit_single(index)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                mode, indices = pending.pop(future)
+                try:
+                    result, usage = future.result()
+                except Exception as e:
+                    if mode == "multi":
+                        for index in indices:
+                            submit_single(index)
+                        continue
+                    job = jobs[indices[0]]
+                    failures.append(
+                        {
+                            "subtema": job["subtema"],
+                            "nivel": job["nivel"],
+                            "content_type": job["content_type"],
+                            "error": f"{type(e).__name__}: {e}",
+                        }
+                    )
+                    continue
+
+                if mode == "single":
+                    content_id = finish(indices[0], result, "single")
+                    forward_usage(usage, kind="content_generation", content_ids=[content_id])
+                    continue
+
+                # uma chamada gerou vários conteúdos: o uso fica com todos eles
+                content_ids: List[int] = []
+                for index in indices:
+                    gen = result.get(jobs[index]["content_type"])
+                    if gen is not None:
+                        content_ids.append(finish(index, gen, "multi"))
+                    else:
+                        submit_single(index)
+                forward_usage(usage, kind="content_generation", content_ids=content_ids)
+
+    # devolve na ordem do plano (subtema, formato), não na de término
+    generated.sort(key=lambda pair: pair[0])
+    return {
+        "contents": [saved for _, saved in generated],
+        "failures": failures,
+    }
@@ -0,0 +1,340 @@
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg2.extensions import connection as PgConnection
+
+from .config import settings
+from .model_routing import stage_config
+from .script_cache import normalize_text, source_hash
+from .taxonomy import get_subtopic_documents
+from .usage import call_with_usage, save_usage
+
+# Biblioteca de conteúdos pré-gerados:
+# - um roteiro por (nó da taxonomia, nível, formato), gerado em lote fora do
+#   caminho do aluno (`python -m backend.content_library`)
+# - cada entrada guarda o hash dos trechos de origem, modelo e versão do
+#   prompt que a gerou (um formato ou multi-formato); só é servida se os
+#   três ainda baterem com o estado atual
+# - o lote é retomável: entradas em dia são puladas e cada roteiro é
+#   gravado assim que fica pronto, então um run interrompido continua de
+#   onde parou; entradas desatualizadas (trechos do nó mudaram) são refeitas
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_LEVELS = ["básico", "intermediário", "avançado"]
+LIBRARY_FORMATS = ["video", "audio", "texto"]
+
+
+def get_library_script(
+    conn: PgConnection,
+    subtopic_id: int,
+    nivel: str,
+    content_type: str,
+    chunks_hash: str,
+    model: str,
+    prompt_versions: List[str],
+) -> Optional[Dict[str, str]]:
+    # prompt_versions: versões atuais de cada modo de geração (um/multi)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE content_library
+            SET hits = hits + 1,
+                last_hit_at = NOW()
+            WHERE subtopic_id = %s
+              AND nivel_norm = %s
+              AND content_type = %s
+              AND source_hash = %s
+              AND model = %s
+              AND prompt_version = ANY(%s)
+            RETURNING title, script;
+            """,
+            (
+                subtopic_id,
+                normalize_text(nivel),
+                content_type,
+                chunks_hash,
+                model,
+                list(prompt_versions),
+            ),
+        )
+        row = cur.fetchone()
+    if not row:
+        return None
+    return {"title": row[0], "script": row[1]}
+
+
+def store_library_script(
+    conn: PgConnection,
+    subtopic_id: int,
+    nivel: str,
+    content_type: str,
+    source_doc_ids: List[int],
+    chunks_hash: str,
+    model: str,
+    prompt_version: str,
+    title: str,
+    script: str,
+) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO content_library (
+                subtopic_id,
+                nivel_norm,
+                content_type,
+                nivel,
+                source_doc_ids,
+                source_hash,
+                model,
+                prompt_version,
+                title,
+                script
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (subtopic_id, nivel_norm, content_type) DO UPDATE
+            SET nivel = EXCLUDED.nivel,
+                source_doc_ids = EXCLUDED.source_doc_ids,
+                source_hash = EXCLUDED.source_hash,
+                model = EXCLUDED.model,
+                prompt_version = EXCLUDED.prompt_version,
+                title = EXCLUDED.title,
+                script = EXCLUDED.script,
+                generated_at = NOW();
+            """,
+            (
+                subtopic_id,
+                normalize_text(nivel),
+                content_type,
+                nivel,
+                sorted(source_doc_ids),
+                chunks_hash,
+                model,
+                prompt_version,
+                title,
+                script,
+            ),
+        )
+
+
+def _fresh_entries(
+    conn: PgConnection, model: str, prompt_versions: List[str]
+) -> Dict[Tuple[int, str, str], str]:
+    # (nó, nível, formato) -> hash dos trechos das entradas do modelo/prompt atuais
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT subtopic_id, nivel_norm, content_type, source_hash
+            FROM content_library
+            WHERE model = %s AND prompt_version = ANY(%s);
+            """,
+            (model, list(prompt_versions)),
+        )
+        return {(r[0], r[1], r[2]): r[3] for r in cur.fetchall()}
+
+
+def plan_library(
+    conn: PgConnection,
+    top_k_docs: int = 8,
+    levels: Optional[List[str]] = None,
+    content_types: Optional[List[str]] = None,
+    force: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Lista o que falta gerar: um item por (nó, nível) com os formatos
+    ausentes ou desatualizados e o contexto atual do nó.
+    """
+    from .chunking import build_context_from_results
+    from .content_generation import SCRIPT_PROMPT_VERSIONS
+
+    levels = levels or LIBRARY_LEVELS
+    content_types = content_types or LIBRARY_FORMATS
+    model = stage_config("content_generation")["model"]
+    versions = list(SCRIPT_PROMPT_VERSIONS.values())
+    fresh = {} if force else _fresh_entries(conn, model, versions)
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, label FROM subtopic_taxonomy ORDER BY id;")
+        nodes = cur.fetchall()
+
+    plan: List[Dict[str, Any]] = []
+    for subtopic_id, label in nodes:
+        results = get_subtopic_documents(conn, subtopic_id, k=top_k_docs)
+        if not results:
+            continue
+        chunks_hash = source_hash(results)
+        for nivel in levels:
+            missing = [
+                ct
+                for ct in content_types
+                if fresh.get((subtopic_id, normalize_text(nivel), ct)) != chunks_hash
+            ]
+            if not missing:
+                continue
+            plan.append(
+                {
+                    "subtopic_id": subtopic_id,
+                    "subtema": label,
+                    "nivel": nivel,
+                    "content_types": missing,
+                    "context": build_context_from_results(results),
+                    "source_doc_ids": [r["id"] for r in results],
+                    "chunks_hash": chunks_hash,
+                }
+            )
+    return plan
+
+
+def _generate_item(
+    item: Dict[str, Any],
+) -> Tuple[Dict[str, Dict[str, str]], Dict[str, str]]:
+    # roda na thread do pool: só chama o LLM, não toca no banco;
+    # devolve os roteiros e o modo de geração ("single"/"multi") de cada um
+    from .content_generation import (
+        generate_learning_script_with_groq,
+        generate_multi_format_scripts_with_groq,
+    )
+
+    justificativa = (
+        f"Conteúdo de biblioteca para alunos no nível {item['nivel']} "
+        "(sem dificuldades individuais registradas)."
+    )
+    content_types = item["content_types"]
+    scripts: Dict[str, Dict[str, str]] = {}
+    modes: Dict[str, str] = {}
+    if settings.CONTENT_MULTI_FORMAT and len(content_types) > 1:
+        try:
+            scripts = generate_multi_format_scripts_with_groq(
+                subtema=item["subtema"],
+                nivel=item["nivel"],
+                content_types=content_types,
+                context=item["context"],
+                justificativa=justificativa,
+            )
+        except Exception:
+            logger.warning(
+                "biblioteca: chamada multi-formato falhou (nó %s, %s); gerando um a um",
+                item["subtopic_id"],
+                item["nivel"],
+                exc_info=True,
+            )
+    modes.update({content_type: "multi" for content_type in scripts})
+    for content_type in content_types:
+        if content_type in scripts:
+            continue
+        modes[content_type] = "single"
+        scripts[content_type] = generate_learning_script_with_groq(
+            subtema=item["subtema"],
+            nivel=item["nivel"],
+            content_type=content_type,
+            context=item["context"],
+            justificativa=justificativa,
+        )
+    return scripts, modes
+
+
+def build_library(
+    conn: PgConnection,
+    top_k_docs: int = 8,
+    workers: Optional[int] = None,
+    force: bool = False,
+    limit: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Gera as entradas ausentes/desatualizadas. O ritmo das chamadas fica a
+    cargo do token bucket de providers.py (compartilhado entre as threads);
+    `workers` só limita quantas ficam em voo.
+    """
+    from .content_generation import SCRIPT_PROMPT_VERSIONS
+
+    model = stage_config("content_generation")["model"]
+    plan = plan_library(conn, top_k_docs=top_k_docs, force=force)
+    if limit is not None:
+        plan = plan[:limit]
+
+    stats = {"planned": len(plan), "stored": 0, "failed": 0}
+    if not plan:
+        return stats
+
+    max_workers = max(1, min(workers or settings.CONTENT_GENERATION_CONCURRENCY, len(plan)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(call_with_usage, _generate_item, item): item for item in plan
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                (scripts, modes), usage = future.result()
+            except Exception:
+                # fica pendente; o próximo run tenta de novo
+                stats["failed"] += 1
+                logger.warning(
+                    "biblioteca: falha no nó %s (%s)",
+                    item["subtopic_id"],
+                    item["nivel"],
+                    exc_info=True,
+                )
+                continue
+
+            # grava na thread principal (dona da conexão), item a item
+            save_usage(conn, usage, kind="content_library")
+            for content_type, gen in scripts.items():
+                if gen.get("model", model) != model:
+                    # veio do fallback: fica pendente para o próximo run
+                    continue
+                store_library_script(
+                    conn,
+                    subtopic_id=item["subtopic_id"],
+                    nivel=item["nivel"],
+                    content_type=content_type,
+                    source_doc_ids=item["source_doc_ids"],
+                    chunks_hash=item["chunks_hash"],
+                    model=model,
+                    prompt_version=SCRIPT_PROMPT_VERSIONS[modes[content_type]],
+                    title=gen["title"],
+                    script=gen["script"],
+                )
+                stats["stored"] += 1
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Biblioteca de conteúdos pré-gerados.")
+    parser.add_argument("--top-k", type=int, default=8, help="trechos por nó")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--force", action="store_true", help="regera tudo, mesmo o que está em dia"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="máximo de (nó, nível)")
+    parser.add_argument("--plan", action="store_true", help="só mostra o que falta")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from .db import get_connection
+
+    conn = get_connection()
+    try:
+        if args.plan:
+            plan = plan_library(conn, top_k_docs=args.top_k, force=args.force)
+            total = sum(len(item["content_types"]) for item in plan)
+            print(f"pendentes: {len(plan)} (nó, nível), {total} roteiros")
+            return
+        stats = build_library(
+            conn,
+            top_k_docs=args.top_k,
+            workers=args.workers,
+            force=args.force,
+            limit=args.limit,
+        )
+        print(
+            f"planejados: {stats['planned']} | gravados: {stats['stored']} "
+            f"| falhas: {stats['failed']}"
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,22 @@
+import asyncio
 import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-import requests
+import asyncpg
 from psycopg2.extensions import connection as PgConnection
 from psycopg2.extras import Json
 
 from .config import settings, build_groq_headers
-from .chunking import search_similar, build_context_from_results
+from .metrics import timed
+from .chunking import (
+    build_context_from_results,
+    embed_texts_async,
+    search_similar_by_embedding_async,
+)
+from .conversation_memory import build_history_text, update_conversation_memory
+from .db_async import get_async_pool
+from .model_routing import post_json_routed_async, route_for
+from .usage import UsageRecorder, recording, save_usage_async
 
 ConversationTurn = Dict[str, str]
 ConversationHistory = List[ConversationTurn]
@@ -26,6 +36,16 @@ def create_conversation(conn: PgConnection) -> int:
     return conversation_id
 
 
+async def create_conversation_async(conn: asyncpg.Connection) -> int:
+    return await conn.fetchval(
+        """
+        INSERT INTO conversation (history)
+        VALUES ('[]'::jsonb)
+        RETURNING id;
+        """
+    )
+
+
 def get_conversation_history(
     conn: PgConnection, conversation_id: int
 ) -> ConversationHistory:
@@ -41,6 +61,172 @@ def get_conversation_history(
     return history
 
 
+# estado para o prompt: só os turnos ainda não resumidos + resumo + revisão
+@timed("chat_load_state")
+async def get_conversation_state(
+    conn: asyncpg.Connection, conversation_id: int
+) -> Tuple[ConversationHistory, str, int, int]:
+    row = await conn.fetchrow(
+        """
+        SELECT
+            COALESCE(
+                (
+                    SELECT jsonb_agg(t.turn ORDER BY t.idx)
+                    FROM jsonb_array_elements(c.history)
+                        WITH ORDINALITY AS t(turn, idx)
+                    WHERE t.idx > c.summarized_turns
+                ),
+                '[]'::jsonb
+            ) AS recent_turns,
+            c.summary,
+            c.summarized_turns,
+            jsonb_array_length(c.history) AS revision
+        FROM conversation c
+        WHERE c.id = $1;
+        """,
+        conversation_id,
+    )
+    if not row:
+        raise ValueError(f"Conversa {conversation_id} não encontrada.")
+    return (
+        row["recent_turns"] or [],
+        row["summary"] or "",
+        row["summarized_turns"] or 0,
+        row["revision"] or 0,
+    )
+
+
+# paginação por cursor: turnos com índice (1-based) > after
+def get_conversation_history_page(
+    conn: PgConnection,
+    conversation_id: int,
+    after: int = 0,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT jsonb_array_length(history)
+            FROM conversation
+            WHERE id = %s;
+            """,
+            (conversation_id,),
+        )
+        row = cur.fetchone()
+        if not row:
+            raise ValueError(f"Conversa {conversation_id} não encontrada.")
+        revision = row[0] or 0
+
+        cur.execute(
+            """
+            SELECT t.idx, t.turn
+            FROM conversation c,
+                 jsonb_array_elements(c.history) WITH ORDINALITY AS t(turn, idx)
+            WHERE c.id = %s
+              AND t.idx > %s
+            ORDER BY t.idx
+            LIMIT %s;
+            """,
+            (conversation_id, after, limit),
+        )
+        rows = cur.fetchall()
+
+    turns = [{"index": idx, **turn} for idx, turn in rows]
+    last_index = turns[-1]["index"] if turns else after
+    return {
+        "conversation_id": conversation_id,
+        "revision": revision,
+        "turns": turns,
+        "next_after": last_index if last_index < revision else None,
+    }
+
+
+# turnos com índice > after (sem paginação) + revisão atual
+def get_conversation_turns_after(
+    conn: PgConnection, conversation_id: int, after: int = 0
+) -> Tuple[ConversationHistory, int]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT
+                COALESCE(
+                    (
+                        SELECT jsonb_agg(t.turn ORDER BY t.idx)
+                        FROM jsonb_array_elements(c.history)
+                            WITH ORDINALITY AS t(turn, idx)
+                        WHERE t.idx > %s
+                    ),
+                    '[]'::jsonb
+                ),
+                jsonb_array_length(c.history)
+            FROM conversation c
+            WHERE c.id = %s;
+            """,
+            (after, conversation_id),
+        )
+        row = cur.fetchone()
+    if not row:
+        raise ValueError(f"Conversa {conversation_id} não encontrada.")
+    return row[0] or [], row[1] or 0
+
+
+# append atômico: não reescreve o histórico inteiro a cada turno
+async def append_conversation_turn(
+    conn: asyncpg.Connection, conversation_id: int, turn: ConversationTurn
+) -> int:
+    revision = await conn.fetchval(
+        """
+        UPDATE conversation
+        SET history = history || $1::jsonb
+        WHERE id = $2
+        RETURNING jsonb_array_length(history);
+        """,
+        [turn],
+        conversation_id,
+    )
+    if revision is None:
+        raise ValueError(f"Conversa {conversation_id} não encontrada.")
+    return revision
+
+
+# trechos recuperados no turno (reaproveitados na geração de conteúdos)
+async def save_turn_retrievals(
+    conn: asyncpg.Connection,
+    conversation_id: int,
+    turn_index: int,
+    results: List[Dict[str, Any]],
+) -> None:
+    if not results:
+        return
+    await conn.executemany(
+        """
+        INSERT INTO conversation_retrievals (
+            conversation_id, turn_index, document_id, rank, distance
+        )
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT DO NOTHING;
+        """,
+        [
+            (conversation_id, turn_index, r["id"], rank, r["distance"])
+            for rank, r in enumerate(results, start=1)
+        ],
+    )
+
+
+# documentos já discutidos na conversa (recuperados em algum turno)
+def get_discussed_document_ids(conn: PgConnection, conversation_id: int) -> List[int]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT DISTINCT document_id
+            FROM conversation_retrievals
+            WHERE conversation_id = %s;
+            """,
+            (conversation_id,),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
 def save_conversation_history(
     conn: PgConnection, conversation_id: int, history: ConversationHistory
 ) -> None:
@@ -55,11 +241,14 @@ def save_conversation_history(
         )
 
 
-def answer_with_groq(
+@timed("chat_completion")
+async def answer_with_groq(
     question: str,
     context: str,
     conversation_history: Optional[ConversationHistory] = None,
     temperature: float = 0.2,
+    conversation_summary: str = "",
+    summarized_turns: int = 0,
 ) -> str:
     headers = build_groq_headers()
     headers["Content-Type"] = "application/json"
@@ -76,15 +265,12 @@ Não dê aulas completas; seu foco é identificar lacunas, não ensinar tudo.
 Responda em português do Brasil.
 """.strip()
 
-    if conversation_history:
-        partes = []
-        for i, turno in enumerate(conversation_history, start=1):
-            partes.append(
-                f"Turno {i}:\nUsuário: {turno['pergunta']}\nAssistente: {turno['resposta']}"
-            )
-        history_text = "\n\n".join(partes)
-    else:
-        history_text = "Nenhum histórico anterior. Esta é a primeira interação."
+    # conversation_history traz só os turnos ainda não resumidos
+    history_text = build_history_text(
+        summary=conversation_summary,
+        recent_turns=conversation_history or [],
+        summarized_turns=summarized_turns,
+    )
 
     user_content = (
         f"Histórico da conversa até agora:\n{history_text}\n\n"
@@ -93,7 +279,6 @@ Responda em português do Brasil.
     )
 
     payload = {
-        "model": settings.GROQ_CHAT_MODEL,
         "temperature": temperature,
         "messages": [
             {"role": "system", "content": system_prompt},
@@ -101,51 +286,112 @@ Responda em português do Brasil.
         ],
     }
 
-    resp = requests.post(
+    # primeiros turnos / pouco contexto -> modelo rápido
+    route = route_for(
+        "chat",
+        turns=summarized_turns + len(conversation_history or []),
+        context_chars=len(context),
+        question_chars=len(question),
+    )
+    data, _ = await post_json_routed_async(
         settings.GROQ_CHAT_COMPLETIONS_ENDPOINT,
+        payload,
+        route,
         headers=headers,
-        json=payload,
         timeout=120,
     )
-    resp.raise_for_status()
-    data = resp.json()
     return data["choices"][0]["message"]["content"].strip()
 
 # cria conversa se não existir
+# carrega estado + embedda a pergunta (em paralelo)
 # busca contexto RAG
-# chama LLM
-# atualiza histórico no banco
-def chat_step(
-    conn: PgConnection,
+# chama LLM (resumo + últimos turnos)
+# grava o turno antes de responder: o UPDATE atômico devolve o índice real,
+# e o próximo turno (em qualquer worker) já lê o histórico com ele
+# devolve a resposta + uma corrotina que grava trechos, uso e memória
+# (executada depois que a resposta HTTP sai) e avisa on_persisted
+@timed("chat_turn")
+async def chat_step(
     conversation_id: Optional[int],
     question: str,
     top_k: int = 5,
-) -> Dict[str, Any]:
-    if conversation_id is None:
-        conversation_id = create_conversation(conn)
-        history: ConversationHistory = []
-    else:
-        history = get_conversation_history(conn, conversation_id)
+    on_persisted: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[Dict[str, Any], Callable[[], Awaitable[None]]]:
+    pool = await get_async_pool()
 
-    results = search_similar(conn, question, k=top_k)
+    async def load_state() -> Tuple[int, ConversationHistory, str, int, int]:
+        if conversation_id is None:
+            async with pool.acquire() as conn:
+                new_id = await create_conversation_async(conn)
+            return new_id, [], "", 0, 0
+        async with pool.acquire() as conn:
+            state = await get_conversation_state(conn, conversation_id)
+        return (conversation_id, *state)
 
-    if not results:
-        answer = (
-            "Não encontrei nada relevante na base de conhecimento para responder à sua pergunta."
-        )
-    else:
-        context = build_context_from_results(results)
-        answer = answer_with_groq(
-            question=question,
-            context=context,
-            conversation_history=history,
-        )
+    # tokens do turno (embedding + resposta), gravados junto com o turno
+    usage = UsageRecorder()
+    with recording(usage, kind="chat"):
+        (
+            (conversation_id, recent_turns, summary, summarized_turns, _revision),
+            (query_emb,),
+        ) = await asyncio.gather(load_state(), embed_texts_async([question]))
 
-    history.append({"pergunta": question, "resposta": answer})
-    save_conversation_history(conn, conversation_id, history)
+        async with pool.acquire() as conn:
+            results = await search_similar_by_embedding_async(conn, query_emb, k=top_k)
 
-    return {
+        if not results:
+            answer = (
+                "Não encontrei nada relevante na base de conhecimento para responder à sua pergunta."
+            )
+        else:
+            context = build_context_from_results(results)
+            answer = await answer_with_groq(
+                question=question,
+                context=context,
+                conversation_history=recent_turns,
+                conversation_summary=summary,
+                summarized_turns=summarized_turns,
+            )
+
+    turn = {"pergunta": question, "resposta": answer}
+    # índice reservado no banco (requests concorrentes na mesma conversa
+    # serializam no lock da linha e recebem índices distintos)
+    async with pool.acquire() as conn:
+        stored_revision = await append_conversation_turn(conn, conversation_id, turn)
+
+    @timed("chat_persist")
+    async def persist() -> None:
+        async with pool.acquire() as conn:
+            await save_turn_retrievals(conn, conversation_id, stored_revision, results)
+            await save_usage_async(
+                conn,
+                usage.drain(),
+                conversation_id=conversation_id,
+                turn_index=stored_revision,
+            )
+
+        if on_persisted is not None:
+            on_persisted(conversation_id, stored_revision)
+
+        with recording(usage, kind="memory_summary"):
+            await update_conversation_memory(
+                pool, conversation_id, recent_turns + [turn], summary, summarized_turns
+            )
+        summary_usage = usage.drain()
+        if summary_usage:
+            async with pool.acquire() as conn:
+                await save_usage_async(
+                    conn,
+                    summary_usage,
+                    conversation_id=conversation_id,
+                    turn_index=stored_revision,
+                )
+
+    # resposta delta: só o turno novo + contador de revisão
+    result = {
         "conversation_id": conversation_id,
         "answer": answer,
-        "history": history,
+        "turn": {"index": stored_revision, **turn},
+        "revision": stored_revision,
     }
+    return result, persist
@@ -1,22 +1,15 @@
 import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
 from psycopg2.extensions import connection as PgConnection
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_values
 
 from .config import settings, build_groq_headers
-from .conversation import ConversationHistory
+from .metrics import timed
+from .model_routing import post_json_routed, route_for
+from .conversation import ConversationHistory, get_conversation_turns_after
 
-
-def analyze_conversation_with_groq(
-    conversation_history: ConversationHistory,
-    temperature: float = 0.1,
-) -> List[Dict[str, Any]]:
-    headers = build_groq_headers()
-    headers["Content-Type"] = "application/json"
-
-    system_prompt = '''
+ANALYSIS_SYSTEM_PROMPT = '''
 Você é um avaliador pedagógico.
 
 Receberá o histórico de uma conversa entre um assistente e um aluno.
@@ -41,6 +34,12 @@ Definição resumida:
 Retorne ESTRITAMENTE um JSON válido.
 '''.strip()
 
+
+def analyze_conversation_with_groq(
+    conversation_history: ConversationHistory,
+    temperature: float = 0.1,
+) -> List[Dict[str, Any]]:
+
     conversation_json = json.dumps(
         conversation_history,
         ensure_ascii=False,
@@ -65,23 +64,29 @@ Agora, produza um JSON no formato:
 Retorne APENAS o JSON.
 """.strip()
 
+    return _request_analysis(user_content, temperature)
+
+
+@timed("analysis_completion")
+def _request_analysis(user_content: str, temperature: float) -> List[Dict[str, Any]]:
+    headers = build_groq_headers()
+    headers["Content-Type"] = "application/json"
+
     payload = {
-        "model": settings.GROQ_CHAT_MODEL,
         "temperature": temperature,
         "messages": [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
             {"role": "user", "content": user_content},
         ],
     }
 
-    resp = requests.post(
+    data, _ = post_json_routed(
         settings.GROQ_CHAT_COMPLETIONS_ENDPOINT,
+        payload,
+        route_for("analysis", context_chars=len(user_content)),
         headers=headers,
-        json=payload,
         timeout=120,
     )
-    resp.raise_for_status()
-    data = resp.json()
     raw = data["choices"][0]["message"]["content"].strip()
 
     if raw.startswith("```"):
@@ -94,7 +99,7 @@ Retorne APENAS o JSON.
     except json.JSONDecodeError:
         parsed = [
             {
-                "subtema": "ANÁLISE_FALHOU",
+                "subtema": ANALYSIS_FAILED,
                 "nivel": "básico",
                 "justificativa": (
                     "Não foi possível interpretar o JSON retornado pelo modelo. "
@@ -109,6 +114,128 @@ Retorne APENAS o JSON.
     return parsed
 
 
+ANALYSIS_FAILED = "ANÁLISE_FALHOU"
+
+
+# análise incremental: só os turnos novos + níveis anteriores por subtema
+def analyze_new_turns_with_groq(
+    new_turns: ConversationHistory,
+    previous_analysis: List[Dict[str, Any]],
+    start_index: int,
+    temperature: float = 0.1,
+) -> List[Dict[str, Any]]:
+
+    previous_json = json.dumps(previous_analysis, ensure_ascii=False)
+    turns_json = json.dumps(
+        [
+            {"turno": i, "pergunta": t["pergunta"], "resposta": t["resposta"]}
+            for i, t in enumerate(new_turns, start=start_index)
+        ],
+        ensure_ascii=False,
+    )
+
+    user_content = f"""
+Avaliação anterior do aluno (turnos 1 a {start_index - 1}), por subtema:
+
+{previous_json}
+
+Novos turnos da conversa (campos "pergunta" e "resposta"):
+
+{turns_json}
+
+Atualize a avaliação considerando os novos turnos:
+- mantenha os subtemas anteriores que não aparecem nos novos turnos;
+- ajuste o nível dos subtemas em que o aluno mostrou evolução ou novas lacunas;
+- inclua subtemas novos.
+
+Produza a lista COMPLETA atualizada no formato:
+
+[
+  {{
+    "subtema": "nome do subtema",
+    "nivel": "básico|intermediário|avançado|domina",
+    "justificativa": "texto curto explicando por que você atribuiu esse nível"
+  }}
+]
+
+Retorne APENAS o JSON.
+""".strip()
+
+    return _request_analysis(user_content, temperature)
+
+
+def get_conversation_profile(
+    conn: PgConnection, conversation_id: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT analysis, analyzed_turns
+            FROM conversation_profile
+            WHERE conversation_id = %s;
+            """,
+            (conversation_id,),
+        )
+        row = cur.fetchone()
+    if not row:
+        return [], 0
+    return row[0] or [], row[1] or 0
+
+
+def save_conversation_profile(
+    conn: PgConnection,
+    conversation_id: int,
+    analysis: List[Dict[str, Any]],
+    analyzed_turns: int,
+) -> None:
+    # nunca volta para um perfil mais antigo (refresh concorrente)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO conversation_profile (conversation_id, analysis, analyzed_turns)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (conversation_id) DO UPDATE
+            SET analysis = EXCLUDED.analysis,
+                analyzed_turns = EXCLUDED.analyzed_turns,
+                updated_at = NOW()
+            WHERE conversation_profile.analyzed_turns < EXCLUDED.analyzed_turns;
+            """,
+            (conversation_id, Json(analysis), analyzed_turns),
+        )
+
+
+# atualiza o perfil com os turnos ainda não analisados
+@timed("profile_refresh")
+def refresh_conversation_profile(
+    conn: PgConnection, conversation_id: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    analysis, analyzed_turns = get_conversation_profile(conn, conversation_id)
+    new_turns, revision = get_conversation_turns_after(
+        conn, conversation_id, after=analyzed_turns
+    )
+    if not new_turns:
+        return analysis, analyzed_turns
+
+    if analysis:
+        updated = analyze_new_turns_with_groq(
+            new_turns=new_turns,
+            previous_analysis=analysis,
+            start_index=analyzed_turns + 1,
+        )
+    else:
+        updated = analyze_conversation_with_groq(new_turns)
+
+    # JSON inválido: mantém o perfil anterior, tenta de novo depois
+    if any(item.get("subtema") == ANALYSIS_FAILED for item in updated):
+        if analysis:
+            return analysis, analyzed_turns
+        return updated, analyzed_turns
+
+    analyzed_turns += len(new_turns)
+    save_conversation_profile(conn, conversation_id, updated, analyzed_turns)
+    return updated, analyzed_turns
+
+
 def save_profile_information(
     conn: PgConnection,
     conversation_id: int,
@@ -123,9 +250,10 @@ def save_profile_information(
                 conversation_id,
                 prefered_format,
                 raw_conversation,
-                analysis
+                analysis,
+                analyzed_revision
             )
-            VALUES (%s, %s, %s, %s)
+            VALUES (%s, %s, %s, %s, %s)
             RETURNING id;
             """,
             (
@@ -133,8 +261,49 @@ def save_profile_information(
                 preferred_format,
                 Json(conversation_history),
                 Json(analysis),
+                len(conversation_history),
             ),
         )
         profile_id = cur.fetchone()[0]
 
     return profile_id
+
+
+# várias análises em um único INSERT (lote offline, ver batch_analysis.py)
+def save_profile_information_bulk(
+    conn: PgConnection,
+    rows: List[Tuple[int, ConversationHistory, List[Dict[str, Any]]]],
+    batch_run: Optional[str] = None,
+    preferred_format: Optional[str] = None,
+) -> List[int]:
+    if not rows:
+        return []
+    with conn.cursor() as cur:
+        ids = execute_values(
+            cur,
+            """
+            INSERT INTO profile_information (
+                conversation_id,
+                prefered_format,
+                raw_conversation,
+                analysis,
+                analyzed_revision,
+                batch_run
+            )
+            VALUES %s
+            RETURNING id;
+            """,
+            [
+                (
+                    conversation_id,
+                    preferred_format,
+                    Json(history),
+                    Json(analysis),
+                    len(history),
+                    batch_run,
+                )
+                for conversation_id, history, analysis in rows
+            ],
+            fetch=True,
+        )
+    return [row[0] for row in ids]
@@ -0,0 +1,157 @@
+from typing import Dict, List, Tuple
+
+import asyncpg
+import httpx
+
+from .config import settings, build_groq_headers
+from .metrics import timed
+from .model_routing import post_json_routed_async, route_for
+from .providers import ProviderError
+
+# Memória da conversa:
+# - os últimos MEMORY_RECENT_TURNS turnos vão literais para o prompt
+# - turnos mais antigos são "dobrados" em um resumo acumulado, salvo junto da conversa
+# Assim o tamanho do prompt fica limitado, independente do tamanho da conversa.
+
+Turn = Dict[str, str]
+
+
+def format_turns(turns: List[Turn], start_index: int = 1) -> str:
+    partes = []
+    for i, turno in enumerate(turns, start=start_index):
+        partes.append(
+            f"Turno {i}:\nUsuário: {turno['pergunta']}\nAssistente: {turno['resposta']}"
+        )
+    return "\n\n".join(partes)
+
+
+def build_history_text(
+    summary: str,
+    recent_turns: List[Turn],
+    summarized_turns: int = 0,
+) -> str:
+    if not summary and not recent_turns:
+        return "Nenhum histórico anterior. Esta é a primeira interação."
+
+    partes = []
+    if summary:
+        partes.append(
+            f"Resumo dos turnos 1 a {summarized_turns}:\n{summary}"
+        )
+    if recent_turns:
+        partes.append(format_turns(recent_turns, start_index=summarized_turns + 1))
+    return "\n\n".join(partes)
+
+
+# grava só se ninguém dobrou turnos desde a leitura (summarized_turns lido
+# antes do resumo): dois turnos próximos podem resumir faixas sobrepostas e
+# o mais lento voltaria o resumo para trás
+async def save_conversation_memory(
+    conn: asyncpg.Connection,
+    conversation_id: int,
+    summary: str,
+    summarized_turns: int,
+    previous_summarized_turns: int,
+) -> bool:
+    status = await conn.execute(
+        """
+        UPDATE conversation
+        SET summary = $1,
+            summarized_turns = $2
+        WHERE id = $3
+          AND summarized_turns = $4;
+        """,
+        summary,
+        summarized_turns,
+        conversation_id,
+        previous_summarized_turns,
+    )
+    return status == "UPDATE 1"
+
+
+@timed("memory_summary")
+async def summarize_turns_with_groq(
+    previous_summary: str,
+    turns: List[Turn],
+    start_index: int,
+    temperature: float = 0.1,
+) -> str:
+    headers = build_groq_headers()
+    headers["Content-Type"] = "application/json"
+
+    system_prompt = f"""
+Você mantém o resumo de uma conversa entre um assistente e um aluno.
+Atualize o resumo anterior incorporando os novos turnos.
+Preserve: temas e subtemas discutidos, perguntas feitas pelo assistente,
+acertos, erros e lacunas demonstradas pelo aluno e o nível de dificuldade atual.
+Descarte cumprimentos e repetições.
+Use no máximo {settings.MEMORY_SUMMARY_MAX_WORDS} palavras, em português do Brasil.
+Retorne APENAS o texto do resumo.
+""".strip()
+
+    user_content = (
+        f"Resumo anterior:\n{previous_summary or '(vazio)'}\n\n"
+        f"Novos turnos:\n{format_turns(turns, start_index=start_index)}"
+    )
+
+    payload = {
+        "temperature": temperature,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ],
+    }
+
+    data, _ = await post_json_routed_async(
+        settings.GROQ_CHAT_COMPLETIONS_ENDPOINT,
+        payload,
+        route_for("memory_summary"),
+        headers=headers,
+        timeout=60,
+    )
+    return data["choices"][0]["message"]["content"].strip()
+
+
+def pending_turns_to_fold(unsummarized_turns: List[Turn]) -> List[Turn]:
+    # Turnos fora da janela recente que ainda não entraram no resumo.
+    # Só dobra em lotes de MEMORY_SUMMARY_BATCH para não chamar o LLM a cada turno.
+    keep = max(settings.MEMORY_RECENT_TURNS, 0)
+    pending = unsummarized_turns[: max(len(unsummarized_turns) - keep, 0)]
+    if len(pending) < max(settings.MEMORY_SUMMARY_BATCH, 1):
+        return []
+    return pending
+
+
+# atualiza o resumo incrementalmente (só com os turnos novos)
+async def update_conversation_memory(
+    pool: asyncpg.Pool,
+    conversation_id: int,
+    unsummarized_turns: List[Turn],
+    summary: str,
+    summarized_turns: int,
+) -> Tuple[str, int]:
+    # unsummarized_turns = turnos após summarized_turns (já com o turno atual)
+    pending = pending_turns_to_fold(unsummarized_turns)
+    if not pending:
+        return summary, summarized_turns
+
+    try:
+        new_summary = await summarize_turns_with_groq(
+            previous_summary=summary,
+            turns=pending,
+            start_index=summarized_turns + 1,
+        )
+    except (httpx.HTTPError, ProviderError):
+        # falha no resumo não derruba o turno; tenta de novo no próximo
+        return summary, summarized_turns
+    new_summarized_turns = summarized_turns + len(pending)
+
+    # só pega conexão do pool depois da chamada ao LLM
+    async with pool.acquire() as conn:
+        saved = await save_conversation_memory(
+            conn, conversation_id, new_summary, new_summarized_turns, summarized_turns
+        )
+    if not saved:
+        # outro turno gravou primeiro; o resumo dele vale
+        return summary, summarized_turns
+    return new_summary, new_summarized_turns
@@ -1,93 +1,222 @@
-from typing import Optional
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
 
 import psycopg2
 from psycopg2.extensions import connection as PgConnection
+from psycopg2.pool import ThreadedConnectionPool
 
 from .config import settings
+from .query_stats import InstrumentedCursor
 
-# conexao postgres
-def get_connection() -> PgConnection:
-    conn = psycopg2.connect(settings.DATABASE_URL)
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _connect_options() -> str:
+    return f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+
+
+# conexao postgres (avulsa, fora do pool: scripts, migrações)
+# migrações usam instrumented=False: a espera pelo advisory lock não deve
+# virar "query lenta" nem passar pela captura de plano
+def get_connection(instrumented: bool = True) -> PgConnection:
+    conn = psycopg2.connect(
+        settings.DATABASE_URL,
+        options=_connect_options(),
+        cursor_factory=InstrumentedCursor if instrumented else None,
+    )
     conn.autocommit = True
     return conn
 
-# config banco
-def init_db(conn: Optional[PgConnection] = None) -> None:
-    close_after = False
-    if conn is None:
-        conn = get_connection()
-        close_after = True
 
-    try:
-        with conn.cursor() as cur:
-            # Extensão para vetores
-            cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-
-            # Tabela de documentos embeddados
-            cur.execute(
-                f"""
-                CREATE TABLE IF NOT EXISTS documents (
-                    id BIGSERIAL PRIMARY KEY,
-                    content TEXT,
-                    metadata JSONB,
-                    embedding VECTOR({settings.EMBEDDING_DIM})
-                );
-                """
-            )
+class _TrackedPool(ThreadedConnectionPool):
+    # avisa cada conexão nova, para o health check saber a idade dela
+    def __init__(self, on_connect: Any, *args: Any, **kwargs: Any) -> None:
+        self._on_connect = on_connect
+        super().__init__(*args, **kwargs)
 
-            # Índice vetorial (opcional, mas recomendado)
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS idx_documents_embedding
-                ON documents
-                USING ivfflat (embedding vector_l2_ops)
-                WITH (lists = 100);
-                """
-            )
+    def _connect(self, key: Any = None) -> PgConnection:
+        conn = super()._connect(key)
+        self._on_connect(conn)
+        return conn
 
-            # Histórico de conversa
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS conversation (
-                    id BIGSERIAL PRIMARY KEY,
-                    history JSONB NOT NULL DEFAULT '[]'::jsonb,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
-            )
+    def _putconn(self, conn: PgConnection, key: Any = None, close: bool = False) -> None:
+        # o psycopg2 fecha toda conexão devolvida acima de minconn, e cada
+        # checkout seguinte abriria outra (handshake TLS); aqui ficam até
+        # maxconn ociosas. Roda sob o lock do ThreadedConnectionPool.
+        minconn = self.minconn
+        self.minconn = self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
 
-            # Análise de perfil / lacunas (uma linha por conversa analisada)
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS profile_information (
-                    id BIGSERIAL PRIMARY KEY,
-                    conversation_id BIGINT REFERENCES conversation(id) ON DELETE CASCADE,
-                    prefered_format TEXT,
-                    raw_conversation JSONB,
-                    analysis JSONB,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
-            )
 
-            # Conteúdos personalizados gerados
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS personalized_learning_contents (
-                    id BIGSERIAL PRIMARY KEY,
-                    conversation_id BIGINT REFERENCES conversation(id) ON DELETE CASCADE,
-                    analysis_id BIGINT REFERENCES profile_information(id) ON DELETE CASCADE,
-                    subtema TEXT,
-                    nivel TEXT,
-                    content_type TEXT,
-                    title TEXT,
-                    script TEXT,
-                    extra_metadata JSONB,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                );
-                """
+# pool de conexões do processo
+# - ThreadedConnectionPool não espera quando esgota; o semáforo faz a fila
+# - health check no checkout (conexão fechada ou ociosa há muito tempo)
+# - conexões devolvidas ficam abertas (até maxconn), não só minconn
+# - um pool por PID: em uvicorn/gunicorn com vários workers cada processo
+#   cria o seu (total de conexões = workers x DB_POOL_MAX_SIZE)
+class ConnectionPool:
+    def __init__(self, minconn: int, maxconn: int) -> None:
+        self.pid = os.getpid()
+        self.maxconn = maxconn
+        self._last_used: Dict[int, float] = {}
+        self._pool = _TrackedPool(
+            self._seed,
+            minconn,
+            maxconn,
+            settings.DATABASE_URL,
+            options=_connect_options(),
+            cursor_factory=InstrumentedCursor,
+        )
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "exhausted": 0,
+            "broken_replaced": 0,
+            "in_use": 0,
+        }
+
+    def _seed(self, conn: PgConnection) -> None:
+        # conexão recém-aberta conta como usada agora: não leva ping
+        self._last_used[id(conn)] = time.monotonic()
+
+    def _healthy(self, conn: PgConnection) -> bool:
+        if conn.closed:
+            return False
+        idle_for = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle_for < settings.DB_POOL_CHECK_IDLE_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self) -> PgConnection:
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=settings.DB_POOL_TIMEOUT):
+            with self._lock:
+                self._stats["exhausted"] += 1
+            raise PoolTimeout(
+                f"Pool de conexões esgotado ({self.maxconn}) após "
+                f"{settings.DB_POOL_TIMEOUT}s de espera."
             )
+        waited = time.monotonic() - started
+
+        try:
+            conn = self._pool.getconn()
+            # a substituta também passa pelo check: pode ser outra ociosa
+            # quebrada (ex.: o banco reiniciou e derrubou todas)
+            while not self._healthy(conn):
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+                with self._lock:
+                    self._stats["broken_replaced"] += 1
+            conn.autocommit = True
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+            if waited > 0.001:
+                self._stats["waits"] += 1
+        return conn
+
+    def putconn(self, conn: PgConnection) -> None:
+        try:
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=bool(conn.closed))
+            # fechada (quebrada) ou descartada pelo pool
+            if conn.closed:
+                self._last_used.pop(id(conn), None)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["pid"] = self.pid
+        stats["max_size"] = self.maxconn
+        stats["open"] = len(self._pool._used) + len(self._pool._pool)
+        return stats
 
+    def closeall(self) -> None:
+        self._pool.closeall()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    pid = os.getpid()
+    if _pool is None or _pool.pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool.pid != pid:
+                # pool herdado via fork (ex.: gunicorn --preload): descarta
+                # sem fechar, os sockets pertencem ao processo pai
+                _pool = ConnectionPool(
+                    settings.DB_POOL_MIN_SIZE,
+                    settings.DB_POOL_MAX_SIZE,
+                )
+    return _pool
+
+
+@contextmanager
+def pooled_connection() -> Iterator[PgConnection]:
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def pool_stats() -> Dict[str, Any]:
+    if _pool is None or _pool.pid != os.getpid():
+        return {"pid": os.getpid(), "open": 0, "in_use": 0}
+    return _pool.stats()
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+# config banco: aplica as migrações pendentes (ver migrations.py).
+# Só deve rodar no deploy/startup, nunca no caminho de uma request.
+def init_db(conn: Optional[PgConnection] = None) -> None:
+    from .migrations import migrate
+
+    close_after = False
+    if conn is None:
+        conn = get_connection(instrumented=False)
+        close_after = True
+
+    try:
+        migrate(conn)
     finally:
         if close_after:
             conn.close()
@@ -0,0 +1,62 @@
+import asyncio
+import json
+from typing import Dict, Optional
+
+import asyncpg
+
+from .config import settings
+from .query_stats import InstrumentedConnection
+
+# Pool asyncpg usado pelo caminho assíncrono do chat.
+# jsonb é (de)codificado automaticamente para objetos Python.
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=json.dumps,
+        decoder=json.loads,
+        schema="pg_catalog",
+    )
+
+
+async def get_async_pool() -> asyncpg.Pool:
+    global _pool
+    if _pool is not None:
+        return _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                settings.DATABASE_URL,
+                min_size=settings.ASYNC_DB_POOL_MIN_SIZE,
+                max_size=settings.ASYNC_DB_POOL_MAX_SIZE,
+                init=_init_connection,
+                connection_class=InstrumentedConnection,
+                server_settings={
+                    "statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS),
+                },
+            )
+    return _pool
+
+
+async def close_async_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def async_pool_stats() -> Dict[str, int]:
+    if _pool is None:
+        return {"size": 0, "idle": 0, "in_use": 0}
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "max_size": _pool.get_max_size(),
+    }
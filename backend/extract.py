@@ -2,9 +2,6 @@ import base64
 import os
 from typing import Dict, Optional, Tuple
 
-import pdfplumber
-import requests
-
 from .config import (
     AUDIO_EXTS,
     IMAGE_EXTS,
@@ -12,9 +9,16 @@ from .config import (
     settings,
     build_groq_headers,
 )
+from .metrics import timed
+from .providers import post, post_json
+from .usage import record_usage
 
 
+@timed("extract_pdf")
 def extract_text_from_pdf(pdf_path: str) -> str:
+    # import tardio: pdfplumber (pdfminer + Pillow) pesa no cold start da API
+    import pdfplumber
+
     all_text: list[str] = []
     with pdfplumber.open(pdf_path) as pdf:
         for page in pdf.pages:
@@ -40,29 +44,38 @@ def _guess_image_mime_type(ext: str) -> str:
     return "image/jpeg"
 
 #transcrição de audio e video
+@timed("transcription")
 def _transcribe_with_groq(file_path: str, language: str = "pt") -> str:
     headers = build_groq_headers()
 
+    # lê os bytes para o corpo poder ser reenviado em caso de retry
     with open(file_path, "rb") as f:
-        files = {
-            "file": (os.path.basename(file_path), f),
-        }
-        data = {
-            "model": settings.TRANSCRIPTION_MODEL_NAME,
-            "temperature": 0,
-            "response_format": "json",
-            "language": language,
-        }
-        resp = requests.post(
-            settings.GROQ_TRANSCRIPTION_ENDPOINT,
-            headers=headers,
-            files=files,
-            data=data,
-            timeout=600,
-        )
-
-    resp.raise_for_status()
+        file_bytes = f.read()
+
+    files = {
+        "file": (os.path.basename(file_path), file_bytes),
+    }
+    data = {
+        "model": settings.TRANSCRIPTION_MODEL_NAME,
+        "temperature": 0,
+        "response_format": "json",
+        "language": language,
+    }
+    resp = post(
+        settings.GROQ_TRANSCRIPTION_ENDPOINT,
+        model=settings.TRANSCRIPTION_MODEL_NAME,
+        headers=headers,
+        files=files,
+        data=data,
+        timeout=600,
+    )
+
     out = resp.json()
+    record_usage(
+        settings.GROQ_TRANSCRIPTION_ENDPOINT,
+        settings.TRANSCRIPTION_MODEL_NAME,
+        out.get("usage"),
+    )
     text = out.get("text", "") or ""
     return text.strip()
 
@@ -75,6 +88,7 @@ def transcribe_video_file(file_path: str) -> str:
     return _transcribe_with_groq(file_path, language="pt")
 
 
+@timed("vision")
 def describe_image_with_groq(file_path: str, language: str = "pt") -> str:
     ext = os.path.splitext(file_path)[1].lower()
     mime_type = _guess_image_mime_type(ext)
@@ -120,14 +134,12 @@ def describe_image_with_groq(file_path: str, language: str = "pt") -> str:
         "max_tokens": 2048,
     }
 
-    resp = requests.post(
+    data = post_json(
         settings.GROQ_CHAT_COMPLETIONS_ENDPOINT,
+        payload,
         headers=headers,
-        json=payload,
         timeout=600,
     )
-    resp.raise_for_status()
-    data = resp.json()
     return data["choices"][0]["message"]["content"].strip()
 
 
@@ -0,0 +1,90 @@
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Perfil de tempo de import da API (python -X importtime).
+#
+#   python -m backend.import_profile           # imprime os imports mais caros
+#   python -m backend.import_profile --write   # atualiza import_profile.txt (versionado)
+#   python -m backend.import_profile --check   # falha se estourar import_budget.json
+#
+# Rode --write no ambiente de deploy sempre que mudar dependências e
+# versione o resultado: o diff mostra regressões de cold start.
+
+BASE_DIR = Path(__file__).resolve().parent
+BUDGET_FILE = BASE_DIR / "import_budget.json"
+PROFILE_FILE = BASE_DIR / "import_profile.txt"
+
+ImportRow = Tuple[int, int, str]  # self_us, cumulative_us, módulo
+
+
+def measure(module: str) -> List[ImportRow]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BASE_DIR.parent,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr)
+
+    rows: List[ImportRow] = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+def format_profile(rows: List[ImportRow], top: int) -> str:
+    ordered = sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+    lines = [f"{'cumulativo ms':>14} {'próprio ms':>11}  módulo"]
+    for self_us, cumulative_us, name in ordered:
+        lines.append(f"{cumulative_us / 1000:14.1f} {self_us / 1000:11.1f}  {name}")
+    return "\n".join(lines) + "\n"
+
+
+def check(rows: List[ImportRow], budget: Dict) -> List[str]:
+    problems: List[str] = []
+    total_ms = max((r[1] for r in rows if r[2].strip() == budget["module"]), default=0) / 1000
+    if total_ms > budget["max_cumulative_ms"]:
+        problems.append(
+            f"import de {budget['module']} levou {total_ms:.0f} ms "
+            f"(orçamento: {budget['max_cumulative_ms']} ms)"
+        )
+    imported = {r[2].strip().split(".")[0] for r in rows}
+    for name in budget.get("forbidden_at_import", []):
+        if name in imported:
+            problems.append(f"{name} não deveria ser importado no startup")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Perfil de import da API.")
+    parser.add_argument("--top", type=int, default=40)
+    parser.add_argument("--write", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    budget = json.loads(BUDGET_FILE.read_text(encoding="utf-8"))
+    rows = measure(budget["module"])
+    profile = format_profile(rows, args.top)
+
+    if args.write:
+        PROFILE_FILE.write_text(profile, encoding="utf-8")
+    print(profile, end="")
+
+    if args.check:
+        problems = check(rows, budget)
+        for problem in problems:
+            print(f"ERRO: {problem}", file=sys.stderr)
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.extras import Json
+
+from .config import settings
+from .content_generation import get_analysis_contents
+from .metrics import JOB_BACKLOG
+
+# Jobs de análise + geração de conteúdos.
+# O estado fica no banco (analysis_jobs), então qualquer worker responde
+# ao polling/SSE; a execução roda num executor dedicado do processo que
+# recebeu o POST, fora do threadpool das requests.
+# Cada tipo de trabalho ("analysis", "profile") tem o seu executor, para
+# o refresh de perfil em background não disputar com jobs do usuário.
+# A ingestão ("ingest") também roda aqui, fora do event loop e do threadpool
+# do chat. job_backlog conta o que foi submetido e ainda não terminou, para
+# recusar jobs novos em vez de deixar a fila crescer sem limite.
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = {JOB_DONE, JOB_FAILED}
+STALE_JOB_ERROR = "Job interrompido: o processo que o executava parou."
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+_backlog: Dict[str, int] = {}
+
+
+class JobQueueFull(RuntimeError):
+    pass
+
+
+def _executor_size(kind: str) -> int:
+    if kind == "profile":
+        return settings.PROFILE_REFRESH_WORKERS
+    if kind == "ingest":
+        return settings.INGEST_MAX_CONCURRENCY
+    return settings.ANALYSIS_JOB_WORKERS
+
+
+def job_backlog(kind: str = "analysis") -> int:
+    return _backlog.get(kind, 0)
+
+
+def _track_backlog(kind: str, delta: int) -> None:
+    with _executors_lock:
+        _backlog[kind] = _backlog.get(kind, 0) + delta
+    JOB_BACKLOG.labels(kind).inc(delta)
+
+
+def submit_job(fn: Callable[..., Any], *args: Any, kind: str = "analysis") -> Future:
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=_executor_size(kind),
+                    thread_name_prefix=f"{kind}-job",
+                )
+                _executors[kind] = executor
+    _track_backlog(kind, 1)
+    future = executor.submit(fn, *args)
+    future.add_done_callback(lambda _: _track_backlog(kind, -1))
+    return future
+
+
+def create_analysis_job(
+    conn: PgConnection,
+    conversation_id: int,
+    preferred_format: Optional[str] = None,
+) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO analysis_jobs (conversation_id, preferred_format)
+            VALUES (%s, %s)
+            RETURNING id;
+            """,
+            (conversation_id, preferred_format),
+        )
+        job_id = cur.fetchone()[0]
+    return job_id
+
+
+def update_analysis_job(
+    conn: PgConnection,
+    job_id: int,
+    status: Optional[str] = None,
+    stage: Optional[str] = None,
+    analysis_id: Optional[int] = None,
+    failures: Optional[List[Dict[str, Any]]] = None,
+    error: Optional[str] = None,
+) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE analysis_jobs
+            SET status = COALESCE(%s, status),
+                stage = COALESCE(%s, stage),
+                analysis_id = COALESCE(%s, analysis_id),
+                failures = COALESCE(%s, failures),
+                error = COALESCE(%s, error),
+                updated_at = NOW()
+            WHERE id = %s;
+            """,
+            (
+                status,
+                stage,
+                analysis_id,
+                Json(failures) if failures is not None else None,
+                error,
+                job_id,
+            ),
+        )
+
+
+def _stale_seconds() -> float:
+    return settings.ANALYSIS_JOB_STALE_MINUTES * 60
+
+
+# marca como falho um job parado há mais de ANALYSIS_JOB_STALE_MINUTES;
+# o WHERE repete a condição: se o job andou nesse meio-tempo, nada muda
+def expire_stale_analysis_job(conn: PgConnection, job_id: int) -> bool:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE analysis_jobs
+            SET status = %s,
+                error = COALESCE(error, %s),
+                updated_at = NOW()
+            WHERE id = %s
+              AND status NOT IN %s
+              AND updated_at < NOW() - make_interval(secs => %s);
+            """,
+            (
+                JOB_FAILED,
+                STALE_JOB_ERROR,
+                job_id,
+                tuple(FINISHED_STATUSES),
+                _stale_seconds(),
+            ),
+        )
+        return cur.rowcount > 0
+
+
+# estado do job + conteúdos já salvos com id > after_content_id
+def get_analysis_job(
+    conn: PgConnection,
+    job_id: int,
+    after_content_id: int = 0,
+) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT conversation_id, status, stage, analysis_id, failures, error,
+                   status NOT IN %s
+                   AND updated_at < NOW() - make_interval(secs => %s) AS stale
+            FROM analysis_jobs
+            WHERE id = %s;
+            """,
+            (tuple(FINISHED_STATUSES), _stale_seconds(), job_id),
+        )
+        row = cur.fetchone()
+        if not row:
+            raise ValueError(f"Job {job_id} não encontrado.")
+        conversation_id, status, stage, analysis_id, failures, error, stale = row
+
+    # worker caiu no meio: encerra o job para o polling/SSE terminar
+    if stale and expire_stale_analysis_job(conn, job_id):
+        status = JOB_FAILED
+        error = error or STALE_JOB_ERROR
+
+    contents: List[Dict[str, Any]] = []
+    if analysis_id is not None:
+        contents = get_analysis_contents(
+            conn, conversation_id, analysis_id, after_content_id=after_content_id
+        )
+
+    return {
+        "job_id": job_id,
+        "conversation_id": conversation_id,
+        "status": status,
+        "stage": stage,
+        "analysis_id": analysis_id,
+        "failures": failures or [],
+        "error": error,
+        "contents": contents,
+    }
+
+
+# job ainda em andamento da conversa (o front acompanha em vez de gerar outro);
+# ignora jobs parados há muito tempo (processo que caiu no meio)
+def get_active_analysis_job(
+    conn: PgConnection, conversation_id: int
+) -> Optional[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT id, status, stage
+            FROM analysis_jobs
+            WHERE conversation_id = %s
+              AND status NOT IN %s
+              AND updated_at > NOW() - make_interval(secs => %s)
+            ORDER BY created_at DESC
+            LIMIT 1;
+            """,
+            (conversation_id, tuple(FINISHED_STATUSES), _stale_seconds()),
+        )
+        row = cur.fetchone()
+    if not row:
+        return None
+    return {"job_id": row[0], "status": row[1], "stage": row[2]}
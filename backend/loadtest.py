@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import time
+import uuid
+import wave
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .mock_providers import sample_text
+
+# Gerador de carga ponta a ponta contra uma API local (Postgres com pgvector
+# + provedores de backend/mock_providers.py):
+#   python -m backend.loadtest --base-url http://127.0.0.1:8000 \
+#       --duration 120 --chat 16 --ingest 2 --analyze 2 --json resultado.json
+# Cada cenário roda N usuários virtuais em laço fechado (uma requisição por
+# vez, sem pausa) até o fim do tempo:
+# - chat: cria a conversa e manda --turns perguntas seguidas
+# - ingest: envia .txt (ou .wav, em --audio-ratio dos envios) com nome único
+# - analyze: enfileira análise + geração e acompanha o job até terminar
+#   (latência do job = ponta a ponta, do POST ao status final)
+# O relatório sai por rota: vazão, percentis de latência e taxa de erro.
+# 429/503 contam como rejeitados (admissão/pool), separados dos demais erros.
+
+REJECTED_STATUS = {429, 503}
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+        self.rejected = 0
+
+    def record(self, seconds: float, status: str, ok: bool) -> None:
+        self.latencies.append(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if ok:
+            return
+        if status.isdigit() and int(status) in REJECTED_STATUS:
+            self.rejected += 1
+        else:
+            self.errors += 1
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    # nearest-rank
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.stats: Dict[str, EndpointStats] = {}
+        self.conversations: List[int] = []  # conversas com turnos, para o analyze
+        self.deadline = 0.0
+        self.rng = random.Random(args.seed)
+
+    def _stats(self, name: str) -> EndpointStats:
+        if name not in self.stats:
+            self.stats[name] = EndpointStats()
+        return self.stats[name]
+
+    async def call(
+        self,
+        client: httpx.AsyncClient,
+        name: str,
+        method: str,
+        path: str,
+        **kwargs: Any,
+    ) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self._stats(name).record(time.perf_counter() - start, type(e).__name__, False)
+            return None
+        self._stats(name).record(time.perf_counter() - start, str(resp.status_code), resp.is_success)
+        return resp if resp.is_success else None
+
+    def running(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    # ==========================
+    # CENÁRIOS
+    # ==========================
+    async def chat_user(self, client: httpx.AsyncClient) -> None:
+        while self.running():
+            resp = await self.call(client, "conversation_start", "POST", "/api/conversation/start")
+            if resp is None:
+                await asyncio.sleep(0.5)
+                continue
+            conversation_id = resp.json()["conversation_id"]
+            turns = 0
+            for _ in range(self.args.turns):
+                if not self.running():
+                    break
+                resp = await self.call(
+                    client,
+                    "chat",
+                    "POST",
+                    "/api/conversation/chat",
+                    json={
+                        "conversation_id": conversation_id,
+                        "message": sample_text(self.rng, 1).rstrip(".") + "?",
+                    },
+                )
+                if resp is not None:
+                    turns += 1
+            if turns:
+                self.conversations.append(conversation_id)
+
+    def _ingest_file(self) -> Dict[str, Any]:
+        name = f"loadtest-{uuid.uuid4().hex}"
+        if self.rng.random() < self.args.audio_ratio:
+            # wav curto de ruído: o mock transcreve proporcional ao tamanho
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(16000)
+                w.writeframes(self.rng.randbytes(16000 * 2 * self.args.audio_seconds))
+            return {"file": (f"{name}.wav", buffer.getvalue(), "audio/wav")}
+        text = "\n\n".join(
+            sample_text(self.rng, 10) for _ in range(self.args.doc_paragraphs)
+        )
+        return {"file": (f"{name}.txt", text.encode("utf-8"), "text/plain")}
+
+    async def ingest_user(self, client: httpx.AsyncClient) -> None:
+        while self.running():
+            await self.call(
+                client,
+                "ingest",
+                "POST",
+                "/api/ingest",
+                files=self._ingest_file(),
+                data={"title": "teste de carga"},
+            )
+
+    async def _seed_conversation(self, client: httpx.AsyncClient) -> Optional[int]:
+        # fora das métricas: só garante uma conversa com turnos para analisar
+        resp = await client.post("/api/conversation/start")
+        if not resp.is_success:
+            return None
+        conversation_id = resp.json()["conversation_id"]
+        for _ in range(2):
+            await client.post(
+                "/api/conversation/chat",
+                json={"conversation_id": conversation_id, "message": sample_text(self.rng, 1)},
+            )
+        return conversation_id
+
+    async def analyze_user(self, client: httpx.AsyncClient) -> None:
+        while self.running():
+            if self.conversations:
+                conversation_id: Optional[int] = self.rng.choice(self.conversations)
+            else:
+                conversation_id = await self._seed_conversation(client)
+            if conversation_id is None:
+                await asyncio.sleep(1)
+                continue
+
+            start = time.perf_counter()
+            resp = await self.call(
+                client,
+                "analyze_and_generate",
+                "POST",
+                f"/api/conversation/{conversation_id}/analyze-and-generate",
+                json={"preferred_format": self.rng.choice([None, "video", "audio", "texto"])},
+            )
+            if resp is None:
+                await asyncio.sleep(0.5)
+                continue
+            job_id = resp.json()["job_id"]
+
+            status = "timeout"
+            while time.perf_counter() - start < self.args.job_timeout:
+                await asyncio.sleep(self.args.poll_interval)
+                poll = await self.call(client, "job_poll", "GET", f"/api/jobs/{job_id}")
+                if poll is None:
+                    continue
+                status = poll.json()["status"]
+                if status in ("done", "failed"):
+                    break
+            self._stats("analysis_job").record(
+                time.perf_counter() - start, status, status == "done"
+            )
+
+    # ==========================
+    # EXECUÇÃO
+    # ==========================
+    async def wait_ready(self, client: httpx.AsyncClient) -> None:
+        for _ in range(120):
+            try:
+                resp = await client.get("/readyz")
+                if resp.is_success:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(1)
+        raise SystemExit("API não ficou pronta (/readyz) em 120 s.")
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(
+            max_connections=self.args.chat + self.args.ingest + self.args.analyze + 4
+        )
+        timeout = httpx.Timeout(self.args.request_timeout)
+        async with httpx.AsyncClient(
+            base_url=self.args.base_url, limits=limits, timeout=timeout
+        ) as client:
+            await self.wait_ready(client)
+            started = time.monotonic()
+            self.deadline = started + self.args.duration
+            users = (
+                [self.chat_user(client) for _ in range(self.args.chat)]
+                + [self.ingest_user(client) for _ in range(self.args.ingest)]
+                + [self.analyze_user(client) for _ in range(self.args.analyze)]
+            )
+            await asyncio.gather(*users)
+            elapsed = time.monotonic() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints: Dict[str, Any] = {}
+        for name, stats in sorted(self.stats.items()):
+            values = sorted(stats.latencies)
+            count = len(values)
+            endpoints[name] = {
+                "count": count,
+                "throughput_rps": round(count / elapsed, 3) if elapsed else 0.0,
+                "error_rate": round(stats.errors / count, 4) if count else 0.0,
+                "rejected_rate": round(stats.rejected / count, 4) if count else 0.0,
+                "p50": percentile(values, 0.50),
+                "p90": percentile(values, 0.90),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+                "max": values[-1] if values else None,
+                "statuses": stats.statuses,
+            }
+        return {
+            "duration_seconds": round(elapsed, 3),
+            "concurrency": {
+                "chat": self.args.chat,
+                "ingest": self.args.ingest,
+                "analyze": self.args.analyze,
+            },
+            "endpoints": endpoints,
+        }
+
+
+def format_report(result: Dict[str, Any]) -> str:
+    def ms(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    lines = [
+        f"duração: {result['duration_seconds']} s | concorrência: "
+        + ", ".join(f"{k}={v}" for k, v in result["concurrency"].items()),
+        f"{'rota':<22}{'n':>7}{'req/s':>9}{'erro%':>8}{'rej%':>7}"
+        f"{'p50':>8}{'p90':>8}{'p95':>8}{'p99':>8}{'max':>8}  (ms)",
+    ]
+    for name, e in result["endpoints"].items():
+        lines.append(
+            f"{name:<22}{e['count']:>7}{e['throughput_rps']:>9.2f}"
+            f"{e['error_rate'] * 100:>8.2f}{e['rejected_rate'] * 100:>7.2f}"
+            f"{ms(e['p50']):>8}{ms(e['p90']):>8}{ms(e['p95']):>8}"
+            f"{ms(e['p99']):>8}{ms(e['max']):>8}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Teste de carga ponta a ponta da API.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--duration", type=float, default=60, help="segundos de carga")
+    parser.add_argument("--chat", type=int, default=8, help="usuários de chat")
+    parser.add_argument("--ingest", type=int, default=1, help="usuários de ingestão")
+    parser.add_argument("--analyze", type=int, default=1, help="usuários de análise")
+    parser.add_argument("--turns", type=int, default=4, help="turnos por conversa")
+    parser.add_argument("--audio-ratio", type=float, default=0.2)
+    parser.add_argument("--audio-seconds", type=int, default=5)
+    parser.add_argument("--doc-paragraphs", type=int, default=6)
+    parser.add_argument("--job-timeout", type=float, default=300)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", default=None, help="grava o relatório em JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(LoadTest(args).run())
+    print(format_report(result))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
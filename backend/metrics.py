@@ -0,0 +1,236 @@
+import functools
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Tuple, TypeVar
+from urllib.parse import urlparse
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+from .profiling import current_profile
+
+# Métricas Prometheus (expostas em /metrics):
+# - rag_stage_seconds{stage}: duração de cada etapa (embedding, busca
+#   vetorial, completions, ingestão...), com erros e chamadas em voo
+# - rag_provider_request_seconds{provider,model,outcome}: cada tentativa HTTP
+#   aos provedores, com retries, erros e chamadas em voo
+# - rag_http_request_seconds{route,method,status}: requests da API
+# - rag_admission_*{endpoint}: fila, em execução e recusas do controle de
+#   admissão (admission.py); rag_job_backlog{kind}: jobs em background
+# - pool de conexões (coletado na hora do scrape, sem custo no caminho quente)
+# Custo por medição: um perf_counter e um observe (O(buckets)), então fica
+# ligado sempre. Com vários workers, defina PROMETHEUS_MULTIPROC_DIR.
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# latências de ms (busca vetorial) a minutos (geração/transcrição)
+_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160,
+)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Duração por etapa do pipeline.", ["stage"], buckets=_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    "rag_stage_errors_total", "Etapas que terminaram com exceção.", ["stage", "error"]
+)
+STAGE_IN_FLIGHT = Gauge(
+    "rag_stage_in_flight",
+    "Etapas em execução.",
+    ["stage"],
+    multiprocess_mode="livesum",
+)
+
+PROVIDER_SECONDS = Histogram(
+    "rag_provider_request_seconds",
+    "Duração de cada tentativa HTTP aos provedores.",
+    ["provider", "model", "outcome"],
+    buckets=_BUCKETS,
+)
+PROVIDER_RETRIES = Counter(
+    "rag_provider_retries_total",
+    "Tentativas refeitas (status transitório ou erro de conexão).",
+    ["provider", "model", "reason"],
+)
+PROVIDER_ERRORS = Counter(
+    "rag_provider_errors_total",
+    "Chamadas aos provedores que falharam de vez.",
+    ["provider", "model", "reason"],
+)
+PROVIDER_IN_FLIGHT = Gauge(
+    "rag_provider_in_flight",
+    "Requisições aos provedores em voo.",
+    ["provider"],
+    multiprocess_mode="livesum",
+)
+PROVIDER_HEDGES = Counter(
+    "rag_provider_hedges_total",
+    "Cópias de requisição (sent) e qual resposta chegou primeiro (won/lost).",
+    ["provider", "model", "outcome"],
+)
+PROVIDER_CIRCUIT_STATE = Gauge(
+    "rag_provider_circuit_state",
+    "Circuit breaker: 0 fechado, 1 meio-aberto, 2 aberto.",
+    ["provider", "model"],
+    multiprocess_mode="max",
+)
+PROVIDER_RATE_LIMIT_WAIT = Histogram(
+    "rag_provider_rate_limit_wait_seconds",
+    "Espera imposta pelo token bucket antes de cada tentativa.",
+    ["provider", "model"],
+    buckets=(0, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+DB_SLOW_QUERIES = Counter(
+    "rag_db_slow_queries_total",
+    "Queries acima de DB_SLOW_QUERY_MS com plano capturado.",
+    ["driver"],
+)
+
+MODEL_ROUTES = Counter(
+    "rag_model_route_total",
+    "Chamadas por etapa e modelo (tier: fast, primary ou fallback por orçamento).",
+    ["stage", "model", "tier"],
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "rag_admission_in_flight",
+    "Requests admitidas em execução por endpoint.",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "rag_admission_queue_depth",
+    "Requests esperando vaga por endpoint.",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "rag_admission_wait_seconds",
+    "Espera na fila de admissão das requests admitidas.",
+    ["endpoint"],
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+ADMISSION_REJECTED = Counter(
+    "rag_admission_rejected_total",
+    "Requests recusadas (queue_full = 429, timeout = 503).",
+    ["endpoint", "reason"],
+)
+JOB_BACKLOG = Gauge(
+    "rag_job_backlog",
+    "Jobs em background na fila ou rodando, por tipo.",
+    ["kind"],
+    multiprocess_mode="livesum",
+)
+
+HTTP_SECONDS = Histogram(
+    "rag_http_request_seconds",
+    "Duração das requests da API.",
+    ["route", "method", "status"],
+    buckets=_BUCKETS,
+)
+
+_PROVIDERS = {
+    "api.groq.com": "groq",
+    "openrouter.ai": "openrouter",
+}
+
+
+def provider_name(url: str) -> str:
+    host = urlparse(url).hostname or ""
+    return _PROVIDERS.get(host, host or "desconhecido")
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    # request perfilada (profiling.py): a etapa entra na amostragem
+    profile = current_profile()
+    profile_key = profile.enter() if profile is not None else None
+    STAGE_IN_FLIGHT.labels(stage).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        STAGE_ERRORS.labels(stage, type(e).__name__).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+        STAGE_IN_FLIGHT.labels(stage).dec()
+        if profile_key is not None:
+            profile.exit(profile_key)
+
+
+def timed(stage: str) -> Callable[[F], F]:
+    """Decorator de track_stage; funciona em funções síncronas e async."""
+
+    def decorator(fn: F) -> F:
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with track_stage(stage):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with track_stage(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+class _PoolCollector:
+    # lido só no scrape: estado atual dos pools deste processo
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        return iter(())
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        from .db import pool_stats
+
+        stats = pool_stats()
+        family = GaugeMetricFamily(
+            "rag_db_pool", "Estado do pool de conexões psycopg2.", labels=["field"]
+        )
+        for field, value in stats.items():
+            if field != "pid" and isinstance(value, (int, float)):
+                family.add_metric([field], float(value))
+        yield family
+
+        from .db_async import async_pool_stats
+
+        async_stats = async_pool_stats()
+        family = GaugeMetricFamily(
+            "rag_db_async_pool", "Estado do pool asyncpg.", labels=["field"]
+        )
+        for field, value in async_stats.items():
+            family.add_metric([field], float(value))
+        yield family
+
+
+_pool_collector = _PoolCollector()
+REGISTRY.register(_pool_collector)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    registry: Optional[CollectorRegistry] = None
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        # agrega os arquivos de todos os workers; pools = deste processo
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_pool_collector)
+    return generate_latest(registry or REGISTRY), CONTENT_TYPE_LATEST
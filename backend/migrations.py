@@ -0,0 +1,449 @@
+import argparse
+from typing import List, Optional, Tuple
+
+from psycopg2.extensions import connection as PgConnection
+
+from .config import settings
+
+# Migrações versionadas do schema.
+# - cada migração tem número, nome e lista de statements
+# - aplicadas uma única vez (tabela schema_version), em ordem, cada uma
+#   na sua transação
+# - pg_advisory_lock garante que só um processo migra por vez
+#   (vários workers subindo juntos, deploy em paralelo)
+# As migrações 1 e 2 usam IF NOT EXISTS porque bancos criados pelo antigo
+# init_db já têm essas tabelas.
+#
+# Para evoluir o schema: adicione uma nova tupla no fim de MIGRATIONS.
+# Nunca altere uma migração já aplicada.
+
+MIGRATION_LOCK_ID = 727_310_031
+
+Migration = Tuple[int, str, List[str]]
+
+MIGRATIONS: List[Migration] = [
+    (
+        1,
+        "schema inicial",
+        [
+            "CREATE EXTENSION IF NOT EXISTS vector;",
+            f"""
+            CREATE TABLE IF NOT EXISTS documents (
+                id BIGSERIAL PRIMARY KEY,
+                content TEXT,
+                metadata JSONB,
+                embedding VECTOR({settings.EMBEDDING_DIM})
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_documents_embedding
+            ON documents
+            USING ivfflat (embedding vector_l2_ops)
+            WITH (lists = 100);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS conversation (
+                id BIGSERIAL PRIMARY KEY,
+                history JSONB NOT NULL DEFAULT '[]'::jsonb,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS profile_information (
+                id BIGSERIAL PRIMARY KEY,
+                conversation_id BIGINT REFERENCES conversation(id) ON DELETE CASCADE,
+                prefered_format TEXT,
+                raw_conversation JSONB,
+                analysis JSONB,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS personalized_learning_contents (
+                id BIGSERIAL PRIMARY KEY,
+                conversation_id BIGINT REFERENCES conversation(id) ON DELETE CASCADE,
+                analysis_id BIGINT REFERENCES profile_information(id) ON DELETE CASCADE,
+                subtema TEXT,
+                nivel TEXT,
+                content_type TEXT,
+                title TEXT,
+                script TEXT,
+                extra_metadata JSONB,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+        ],
+    ),
+    (
+        2,
+        "memória da conversa",
+        [
+            """
+            ALTER TABLE conversation
+                ADD COLUMN IF NOT EXISTS summary TEXT NOT NULL DEFAULT '',
+                ADD COLUMN IF NOT EXISTS summarized_turns INTEGER NOT NULL DEFAULT 0;
+            """,
+        ],
+    ),
+    (
+        3,
+        "índices de consulta",
+        [
+            # is_already_ingested filtra por metadata->>'source' e ->>'type'
+            """
+            CREATE INDEX IF NOT EXISTS idx_documents_source_type
+            ON documents ((metadata->>'source'), (metadata->>'type'));
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_profile_information_conversation
+            ON profile_information (conversation_id, created_at DESC);
+            """,
+        ],
+    ),
+    (
+        4,
+        "jobs de análise e geração",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS analysis_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                conversation_id BIGINT REFERENCES conversation(id) ON DELETE CASCADE,
+                preferred_format TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                stage TEXT,
+                analysis_id BIGINT REFERENCES profile_information(id) ON DELETE SET NULL,
+                failures JSONB NOT NULL DEFAULT '[]'::jsonb,
+                error TEXT,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_analysis_jobs_conversation
+            ON analysis_jobs (conversation_id, created_at DESC);
+            """,
+        ],
+    ),
+    (
+        5,
+        "cache de roteiros entre alunos",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS learning_script_cache (
+                cache_key TEXT PRIMARY KEY,
+                subtema_norm TEXT NOT NULL,
+                nivel TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                source_doc_ids BIGINT[] NOT NULL,
+                source_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                title TEXT,
+                script TEXT,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                last_hit_at TIMESTAMPTZ
+            );
+            """,
+        ],
+    ),
+    (
+        6,
+        "perfil incremental da conversa",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS conversation_profile (
+                conversation_id BIGINT PRIMARY KEY
+                    REFERENCES conversation(id) ON DELETE CASCADE,
+                analysis JSONB NOT NULL DEFAULT '[]'::jsonb,
+                analyzed_turns INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+        ],
+    ),
+    (
+        7,
+        "taxonomia de subtemas",
+        [
+            f"""
+            CREATE TABLE IF NOT EXISTS subtopic_taxonomy (
+                id BIGSERIAL PRIMARY KEY,
+                label TEXT NOT NULL,
+                label_norm TEXT NOT NULL,
+                centroid VECTOR({settings.EMBEDDING_DIM}) NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_subtopic_taxonomy_label
+            ON subtopic_taxonomy (label_norm);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS subtopic_members (
+                document_id BIGINT PRIMARY KEY
+                    REFERENCES documents(id) ON DELETE CASCADE,
+                subtopic_id BIGINT NOT NULL
+                    REFERENCES subtopic_taxonomy(id) ON DELETE CASCADE,
+                distance REAL NOT NULL
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_subtopic_members_subtopic
+            ON subtopic_members (subtopic_id, distance);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS subtopic_aliases (
+                subtema_norm TEXT PRIMARY KEY,
+                subtopic_id BIGINT NOT NULL
+                    REFERENCES subtopic_taxonomy(id) ON DELETE CASCADE,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+        ],
+    ),
+    (
+        8,
+        "biblioteca de conteúdos pré-gerados",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS content_library (
+                subtopic_id BIGINT NOT NULL
+                    REFERENCES subtopic_taxonomy(id) ON DELETE CASCADE,
+                nivel_norm TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                nivel TEXT NOT NULL,
+                source_doc_ids BIGINT[] NOT NULL,
+                source_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                title TEXT,
+                script TEXT,
+                hits INTEGER NOT NULL DEFAULT 0,
+                generated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                last_hit_at TIMESTAMPTZ,
+                PRIMARY KEY (subtopic_id, nivel_norm, content_type)
+            );
+            """,
+        ],
+    ),
+    (
+        9,
+        "reanálise em lote",
+        [
+            """
+            ALTER TABLE profile_information
+                ADD COLUMN IF NOT EXISTS batch_run TEXT;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_profile_information_batch_run
+            ON profile_information (batch_run, conversation_id)
+            WHERE batch_run IS NOT NULL;
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS batch_analysis_runs (
+                run TEXT PRIMARY KEY,
+                last_conversation_id BIGINT NOT NULL DEFAULT 0,
+                processed INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                finished_at TIMESTAMPTZ
+            );
+            """,
+        ],
+    ),
+    (
+        10,
+        "leitura dos conteúdos de estudo",
+        [
+            # revisão (nº de turnos) que a análise cobriu
+            """
+            ALTER TABLE profile_information
+                ADD COLUMN IF NOT EXISTS analyzed_revision INTEGER;
+            """,
+            """
+            UPDATE profile_information
+            SET analyzed_revision = jsonb_array_length(raw_conversation)
+            WHERE analyzed_revision IS NULL
+              AND jsonb_typeof(raw_conversation) = 'array';
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_learning_contents_conversation
+            ON personalized_learning_contents (conversation_id, created_at DESC);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_learning_contents_analysis
+            ON personalized_learning_contents (analysis_id, id);
+            """,
+        ],
+    ),
+    (
+        11,
+        "trechos recuperados por turno",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS conversation_retrievals (
+                conversation_id BIGINT NOT NULL
+                    REFERENCES conversation(id) ON DELETE CASCADE,
+                turn_index INTEGER NOT NULL,
+                document_id BIGINT NOT NULL
+                    REFERENCES documents(id) ON DELETE CASCADE,
+                rank SMALLINT NOT NULL,
+                distance REAL NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (conversation_id, turn_index, document_id)
+            );
+            """,
+        ],
+    ),
+    (
+        12,
+        "contabilidade de tokens",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ingestions (
+                id BIGSERIAL PRIMARY KEY,
+                source TEXT,
+                doc_type TEXT,
+                title TEXT,
+                inserted_chunks INTEGER NOT NULL DEFAULT 0,
+                skipped_reason TEXT,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS provider_usage (
+                id BIGSERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                conversation_id BIGINT
+                    REFERENCES conversation(id) ON DELETE CASCADE,
+                turn_index INTEGER,
+                analysis_id BIGINT
+                    REFERENCES profile_information(id) ON DELETE SET NULL,
+                content_ids BIGINT[],
+                ingestion_id BIGINT
+                    REFERENCES ingestions(id) ON DELETE SET NULL,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                total_tokens INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_provider_usage_conversation
+            ON provider_usage (conversation_id, created_at)
+            WHERE conversation_id IS NOT NULL;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_provider_usage_created_at
+            ON provider_usage (created_at);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_provider_usage_ingestion
+            ON provider_usage (ingestion_id)
+            WHERE ingestion_id IS NOT NULL;
+            """,
+        ],
+    ),
+]
+
+
+def _ensure_version_table(conn: PgConnection) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+
+
+def current_version(conn: PgConnection) -> int:
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_version');")
+        if cur.fetchone()[0] is None:
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+        return cur.fetchone()[0]
+
+
+def pending_migrations(conn: PgConnection) -> List[Migration]:
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def migrate(conn: PgConnection, target: Optional[int] = None) -> List[int]:
+    """
+    Aplica as migrações pendentes (até target, se informado).
+    Devolve os números aplicados nesta chamada.
+    """
+    applied: List[int] = []
+    autocommit = conn.autocommit
+    conn.autocommit = True
+
+    with conn.cursor() as cur:
+        # DDL e espera pelo lock não devem cair no statement_timeout
+        cur.execute("SET statement_timeout = 0;")
+        cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+    try:
+        _ensure_version_table(conn)
+        # relê a versão depois do lock: outro processo pode ter migrado
+        for version, name, statements in pending_migrations(conn):
+            if target is not None and version > target:
+                break
+            conn.autocommit = False
+            try:
+                with conn.cursor() as cur:
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.execute(
+                        "INSERT INTO schema_version (version, name) VALUES (%s, %s);",
+                        (version, name),
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+            applied.append(version)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+            cur.execute("RESET statement_timeout;")
+        conn.autocommit = autocommit
+
+    return applied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrações do schema.")
+    parser.add_argument("--status", action="store_true", help="só mostra a versão")
+    parser.add_argument("--target", type=int, default=None)
+    args = parser.parse_args()
+
+    from .db import get_connection
+
+    conn = get_connection(instrumented=False)
+    try:
+        if args.status:
+            pending = [m[0] for m in pending_migrations(conn)]
+            print(f"versão atual: {current_version(conn)} | pendentes: {pending}")
+            return
+        applied = migrate(conn, target=args.target)
+        print(f"migrações aplicadas: {applied or 'nenhuma'}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from .config import settings
+
+# Provedores falsos para teste de carga offline (sem chaves da Groq/OpenRouter):
+#   python -m backend.mock_providers --port 9000 --latency chat=0.8:4 --error-rate chat=0.02
+# Fala os mesmos caminhos das APIs reais; aponte a API para ele com
+#   OPENROUTER_EMBEDDINGS_ENDPOINT=http://127.0.0.1:9000/api/v1/embeddings
+#   GROQ_CHAT_COMPLETIONS_ENDPOINT=http://127.0.0.1:9000/openai/v1/chat/completions
+#   GROQ_TRANSCRIPTION_ENDPOINT=http://127.0.0.1:9000/openai/v1/audio/transcriptions
+# - latência log-normal por rota (mediana e p99)
+# - erros 5xx aleatórios e 429 de duas formas: cota por minuto (com os
+#   headers x-ratelimit-* que o token bucket de providers.py lê) e 429
+#   aleatório com Retry-After
+# - embeddings determinísticos por palavras (hashing trick): perguntas que
+#   repetem termos dos documentos recuperam esses documentos
+# - respostas de chat no formato que cada prompt espera (análise em JSON,
+#   roteiros em JSON, texto livre no resto), com o campo usage preenchido
+# - chamadas "travadas" (--stall) para exercitar hedging, e POST /config
+#   para mudar o perfil com o teste rodando (ex.: pico de erros que abre o
+#   circuit breaker)
+
+ROUTES = ("chat", "embeddings", "transcription")
+
+_WORDS = (
+    "fotossíntese clorofila energia luz glicose célula mitocôndria respiração "
+    "equação variável função derivada integral limite gráfico vetor matriz "
+    "revolução império república constituição economia mercado inflação "
+    "átomo molécula ligação reação ácido base oxidação elétron próton "
+    "algoritmo recursão lista árvore grafo complexidade memória processo "
+    "gramática verbo sujeito predicado oração crase concordância regência"
+).split()
+
+_FILLER = (
+    "o aluno estuda como porque quando então exemplo conceito importante "
+    "ideia principal processo resultado relação entre forma uso prática"
+).split()
+
+
+def sample_text(rng: random.Random, sentences: int = 8) -> str:
+    # texto com vocabulário de matérias escolares (documentos, perguntas, respostas)
+    out = []
+    for _ in range(sentences):
+        words = [
+            rng.choice(_WORDS) if rng.random() < 0.4 else rng.choice(_FILLER)
+            for _ in range(rng.randint(8, 18))
+        ]
+        out.append(" ".join(words).capitalize() + ".")
+    return " ".join(out)
+
+
+class RouteProfile:
+    def __init__(self) -> None:
+        self.median = 0.05
+        self.p99 = 0.2
+        self.error_rate = 0.0
+        self.throttle_rate = 0.0
+        self.rpm = 0  # 0 = sem cota
+        self.stall_rate = 0.0
+        self.stall_seconds = 0.0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self._lock = threading.Lock()
+
+    def latency(self, rng: random.Random) -> float:
+        if self.p99 <= self.median:
+            return self.median
+        # p99 de uma log-normal = mediana * exp(2.326 * sigma)
+        sigma = math.log(self.p99 / self.median) / 2.326
+        return rng.lognormvariate(math.log(self.median), sigma)
+
+    def take_quota(self) -> Tuple[bool, Dict[str, str]]:
+        if self.rpm <= 0:
+            return True, {}
+        with self._lock:
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start = now
+                self.window_count = 0
+            reset = 60 - (now - self.window_start)
+            allowed = self.window_count < self.rpm
+            if allowed:
+                self.window_count += 1
+            remaining = max(self.rpm - self.window_count, 0)
+        headers = {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.2f}s",
+        }
+        if not allowed:
+            headers["retry-after"] = f"{reset:.2f}"
+        return allowed, headers
+
+
+PROFILES: Dict[str, RouteProfile] = {route: RouteProfile() for route in ROUTES}
+# padrões próximos do que se vê em produção
+PROFILES["chat"].median, PROFILES["chat"].p99 = 0.8, 4.0
+PROFILES["embeddings"].median, PROFILES["embeddings"].p99 = 0.12, 0.6
+PROFILES["transcription"].median, PROFILES["transcription"].p99 = 2.0, 8.0
+
+_rng = random.Random()
+_stats: Dict[str, Dict[str, int]] = {route: {} for route in ROUTES}
+
+app = FastAPI(title="Mock providers")
+
+
+def _count(route: str, status: int) -> None:
+    key = str(status)
+    _stats[route][key] = _stats[route].get(key, 0) + 1
+
+
+async def _gate(route: str) -> Optional[JSONResponse]:
+    # cota, 429 aleatório e 5xx, nessa ordem; None = segue com a resposta
+    profile = PROFILES[route]
+    allowed, headers = profile.take_quota()
+    if not allowed:
+        _count(route, 429)
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests"}},
+            headers=headers,
+        )
+    delay = profile.latency(_rng)
+    if _rng.random() < profile.stall_rate:
+        delay += profile.stall_seconds
+    await asyncio.sleep(delay)
+    if _rng.random() < profile.throttle_rate:
+        _count(route, 429)
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Too many requests", "type": "requests"}},
+            headers={**headers, "retry-after": "1"},
+        )
+    if _rng.random() < profile.error_rate:
+        status = _rng.choice((500, 502, 503))
+        _count(route, status)
+        return JSONResponse(
+            status_code=status, content={"error": {"message": "mock upstream error"}}
+        )
+    _count(route, 200)
+    return None
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+# ==========================
+# EMBEDDINGS
+# ==========================
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def embed(text: str, dim: int) -> List[float]:
+    vec = [0.0] * dim
+    for word in _TOKEN_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        h = int.from_bytes(digest, "little")
+        vec[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec))
+    if norm == 0:
+        vec[0] = 1.0
+        return vec
+    return [v / norm for v in vec]
+
+
+@app.post("/api/v1/embeddings")
+async def embeddings(request: Request):
+    rejected = await _gate("embeddings")
+    if rejected is not None:
+        return rejected
+    body = await request.json()
+    inputs = body.get("input") or []
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dim = int(body.get("dimensions") or settings.EMBEDDING_DIM)
+    data = [
+        {"object": "embedding", "index": i, "embedding": embed(text, dim)}
+        for i, text in enumerate(inputs)
+    ]
+    prompt_tokens = sum(_tokens(t) for t in inputs)
+    return {
+        "object": "list",
+        "model": body.get("model"),
+        "data": data,
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+    }
+
+
+# ==========================
+# CHAT COMPLETIONS
+# ==========================
+_FORMAT_RE = re.compile(r'^- "([^"]+)":', re.MULTILINE)
+_SUBTEMA_RE = re.compile(r"^Subtema: (.+)$", re.MULTILINE)
+
+
+def _message_text(messages: List[Dict[str, Any]]) -> Tuple[str, str, bool]:
+    system, user, has_image = [], [], False
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    has_image = True
+                elif part.get("type") == "text":
+                    user.append(part.get("text", ""))
+            continue
+        (system if message.get("role") == "system" else user).append(content or "")
+    return "\n".join(system), "\n".join(user), has_image
+
+
+def _script(subtema: str) -> Dict[str, str]:
+    return {"title": f"Entendendo {subtema}", "script": sample_text(_rng, 12)}
+
+
+def _reply(system: str, user: str, has_image: bool) -> str:
+    # identifica o prompt pelo formato de saída que ele pede
+    prompt = f"{system}\n{user}"
+    subtema_match = _SUBTEMA_RE.search(user)
+    subtema = subtema_match.group(1).strip() if subtema_match else "o tema"
+    if has_image:
+        return "Imagem didática. " + sample_text(_rng, 4)
+    if "uma chave por formato" in prompt:
+        formats = _FORMAT_RE.findall(user) or ["texto"]
+        return json.dumps({ct: _script(subtema) for ct in formats}, ensure_ascii=False)
+    if '"title"' in prompt and '"script"' in prompt:
+        return json.dumps(_script(subtema), ensure_ascii=False)
+    if '"subtema"' in prompt and '"nivel"' in prompt:
+        analysis = [
+            {
+                "subtema": word,
+                "nivel": _rng.choice(["básico", "intermediário", "avançado", "domina"]),
+                "justificativa": sample_text(_rng, 1),
+            }
+            for word in _rng.sample(_WORDS, _rng.randint(1, 3))
+        ]
+        return json.dumps(analysis, ensure_ascii=False)
+    return sample_text(_rng, _rng.randint(3, 8))
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    rejected = await _gate("chat")
+    if rejected is not None:
+        return rejected
+    body = await request.json()
+    system, user, has_image = _message_text(body.get("messages") or [])
+    content = _reply(system, user, has_image)
+    prompt_tokens = _tokens(system) + _tokens(user)
+    completion_tokens = _tokens(content)
+    return {
+        "id": f"mock-{time.time_ns()}",
+        "object": "chat.completion",
+        "model": body.get("model"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+# ==========================
+# TRANSCRIÇÃO
+# ==========================
+@app.post("/openai/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    rejected = await _gate("transcription")
+    if rejected is not None:
+        return rejected
+    form = await request.form()
+    upload = form.get("file")
+    size = len(await upload.read()) if upload is not None else 0
+    # duração "falsa" proporcional ao arquivo: áudios maiores, textos maiores
+    sentences = min(max(size // 4000, 4), 200)
+    return {"text": sample_text(_rng, sentences)}
+
+
+PROFILE_FIELDS = (
+    "median",
+    "p99",
+    "error_rate",
+    "throttle_rate",
+    "rpm",
+    "stall_rate",
+    "stall_seconds",
+)
+
+
+def _profiles() -> Dict[str, Dict[str, Any]]:
+    return {
+        route: {field: getattr(p, field) for field in PROFILE_FIELDS}
+        for route, p in PROFILES.items()
+    }
+
+
+@app.get("/stats")
+def stats() -> Dict[str, Any]:
+    return {"responses": _stats, "profiles": _profiles()}
+
+
+@app.post("/config")
+async def update_config(request: Request):
+    # {"chat": {"error_rate": 0.6}, "all": {"stall_rate": 0.05}}
+    body = await request.json()
+    for route, fields in body.items():
+        if route not in ROUTES and route != "all":
+            return JSONResponse(status_code=400, content={"detail": f"rota inválida: {route}"})
+        for r in ROUTES if route == "all" else (route,):
+            for field, value in fields.items():
+                if field in PROFILE_FIELDS:
+                    setattr(PROFILES[r], field, type(getattr(PROFILES[r], field))(value))
+    return {"profiles": _profiles()}
+
+
+def _parse_route_values(items: List[str], flag: str) -> Dict[str, str]:
+    # "chat=0.8:4" -> {"chat": "0.8:4"}; rota "all" vale para todas
+    out: Dict[str, str] = {}
+    for item in items:
+        route, sep, value = item.partition("=")
+        if not sep or (route not in ROUTES and route != "all"):
+            raise SystemExit(f"{flag}: use ROTA=VALOR com ROTA em {', '.join(ROUTES)} ou all")
+        for r in ROUTES if route == "all" else (route,):
+            out[r] = value
+    return out
+
+
+def configure(args: argparse.Namespace) -> None:
+    for route, value in _parse_route_values(args.latency, "--latency").items():
+        median, _, p99 = value.partition(":")
+        PROFILES[route].median = float(median)
+        PROFILES[route].p99 = float(p99 or median)
+    for route, value in _parse_route_values(args.error_rate, "--error-rate").items():
+        PROFILES[route].error_rate = float(value)
+    for route, value in _parse_route_values(args.throttle_rate, "--throttle-rate").items():
+        PROFILES[route].throttle_rate = float(value)
+    for route, value in _parse_route_values(args.rpm, "--rpm").items():
+        PROFILES[route].rpm = int(value)
+    for route, value in _parse_route_values(args.stall, "--stall").items():
+        rate, _, seconds = value.partition(":")
+        PROFILES[route].stall_rate = float(rate)
+        PROFILES[route].stall_seconds = float(seconds or 60)
+    if args.seed is not None:
+        _rng.seed(args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Provedores falsos para teste de carga.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        help="ROTA=MEDIANA[:P99] em segundos (ex.: chat=0.8:4)",
+    )
+    parser.add_argument(
+        "--error-rate", action="append", default=[], help="ROTA=FRAÇÃO de 5xx"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        action="append",
+        default=[],
+        help="ROTA=FRAÇÃO de 429 aleatórios (Retry-After: 1)",
+    )
+    parser.add_argument(
+        "--rpm", action="append", default=[], help="ROTA=cota de requisições por minuto"
+    )
+    parser.add_argument(
+        "--stall",
+        action="append",
+        default=[],
+        help="ROTA=FRAÇÃO[:SEGUNDOS] de chamadas travadas (ex.: chat=0.02:60)",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    configure(args)
+
+    base = f"http://{args.host}:{args.port}"
+    print(
+        "Aponte a API para os mocks:\n"
+        f"  export OPENROUTER_EMBEDDINGS_ENDPOINT={base}/api/v1/embeddings\n"
+        f"  export GROQ_CHAT_COMPLETIONS_ENDPOINT={base}/openai/v1/chat/completions\n"
+        f"  export GROQ_TRANSCRIPTION_ENDPOINT={base}/openai/v1/audio/transcriptions"
+    )
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
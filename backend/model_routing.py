@@ -0,0 +1,166 @@
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import requests
+
+from .config import settings
+from .metrics import MODEL_ROUTES
+from .providers import BudgetExceeded, CircuitOpen, post_json, post_json_async
+
+# Roteamento de modelo por etapa do pipeline:
+# - cada etapa tem um modelo principal e, opcionalmente, um modelo rápido;
+#   o rápido atende enquanto o pedido é "raso" (poucos turnos, pouco
+#   contexto, pergunta curta) e o principal assume a partir dos limites
+#   large_min_* (qualquer um atingido basta)
+# - budget_seconds é o orçamento de latência do modelo escolhido: estourou
+#   (espera de rate limit, retries ou resposta lenta), a mesma chamada vai
+#   para fallback_model, sem orçamento; o mesmo vale para circuito aberto
+#   (provedor/modelo com muitos erros recentes, ver providers.py)
+# Padrões abaixo; MODEL_ROUTES (JSON) sobrescreve por etapa e por chave, ex.:
+#   {"chat": {"large_min_turns": 5, "budget_seconds": 15}}
+
+ROUTE_KEYS = (
+    "model",
+    "fast_model",
+    "fallback_model",
+    "budget_seconds",
+    "large_min_turns",
+    "large_min_context_chars",
+    "large_min_question_chars",
+)
+
+
+def _default_routes() -> Dict[str, Dict[str, Any]]:
+    fast = settings.FAST_CHAT_MODEL
+    return {
+        "chat": {
+            "model": settings.GROQ_CHAT_MODEL,
+            "fast_model": fast,
+            "fallback_model": fast,
+            "budget_seconds": 20,
+            "large_min_turns": 3,
+            "large_min_context_chars": 6000,
+            "large_min_question_chars": 280,
+        },
+        "analysis": {
+            "model": settings.GROQ_CHAT_MODEL,
+            "fallback_model": fast,
+            "budget_seconds": 60,
+        },
+        "content_generation": {
+            "model": settings.LEARNING_CONTENT_MODEL,
+            "fallback_model": fast,
+            "budget_seconds": 90,
+        },
+        "memory_summary": {
+            "model": settings.MEMORY_SUMMARY_MODEL,
+            "budget_seconds": 30,
+        },
+    }
+
+
+def stage_config(stage: str) -> Dict[str, Any]:
+    config = dict(_default_routes().get(stage, {}))
+    config.update(
+        {k: v for k, v in settings.MODEL_ROUTES.get(stage, {}).items() if k in ROUTE_KEYS}
+    )
+    if not config.get("model"):
+        raise ValueError(f"Etapa sem modelo configurado: {stage}")
+    return config
+
+
+class Route:
+    def __init__(
+        self,
+        stage: str,
+        model: str,
+        tier: str,
+        fallback_model: Optional[str],
+        budget_seconds: Optional[float],
+    ) -> None:
+        self.stage = stage
+        self.model = model
+        self.tier = tier  # "fast" | "primary"
+        # sem fallback distinto, o orçamento não tem para onde desviar
+        if not fallback_model or fallback_model == model:
+            fallback_model, budget_seconds = None, None
+        self.fallback_model = fallback_model
+        self.budget_seconds = budget_seconds
+
+
+def route_for(
+    stage: str,
+    turns: int = 0,
+    context_chars: int = 0,
+    question_chars: int = 0,
+) -> Route:
+    config = stage_config(stage)
+    signals = {
+        "large_min_turns": turns,
+        "large_min_context_chars": context_chars,
+        "large_min_question_chars": question_chars,
+    }
+    thresholds = {k: config.get(k) for k in signals if config.get(k)}
+    shallow = bool(thresholds) and all(
+        signals[k] < limit for k, limit in thresholds.items()
+    )
+    if config.get("fast_model") and shallow:
+        model, tier = config["fast_model"], "fast"
+    else:
+        model, tier = config["model"], "primary"
+    return Route(
+        stage,
+        model,
+        tier,
+        config.get("fallback_model"),
+        config.get("budget_seconds"),
+    )
+
+
+_FALLBACK_ERRORS = (
+    BudgetExceeded,
+    CircuitOpen,
+    requests.Timeout,
+    httpx.TimeoutException,
+)
+
+
+def post_json_routed(
+    url: str, payload: Dict[str, Any], route: Route, **kwargs: Any
+) -> Tuple[Dict[str, Any], str]:
+    """Chama o modelo da rota; devolve (resposta, modelo que respondeu)."""
+    try:
+        data = post_json(
+            url,
+            {**payload, "model": route.model},
+            budget=route.budget_seconds,
+            **kwargs,
+        )
+        MODEL_ROUTES.labels(route.stage, route.model, route.tier).inc()
+        return data, route.model
+    except _FALLBACK_ERRORS:
+        if route.fallback_model is None:
+            raise
+    data = post_json(url, {**payload, "model": route.fallback_model}, **kwargs)
+    MODEL_ROUTES.labels(route.stage, route.fallback_model, "fallback").inc()
+    return data, route.fallback_model
+
+
+async def post_json_routed_async(
+    url: str, payload: Dict[str, Any], route: Route, **kwargs: Any
+) -> Tuple[Dict[str, Any], str]:
+    try:
+        data = await post_json_async(
+            url,
+            {**payload, "model": route.model},
+            budget=route.budget_seconds,
+            **kwargs,
+        )
+        MODEL_ROUTES.labels(route.stage, route.model, route.tier).inc()
+        return data, route.model
+    except _FALLBACK_ERRORS:
+        if route.fallback_model is None:
+            raise
+    data = await post_json_async(url, {**payload, "model": route.fallback_model}, **kwargs)
+    MODEL_ROUTES.labels(route.stage, route.fallback_model, "fallback").inc()
+    return data, route.fallback_model
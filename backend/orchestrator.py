@@ -1,47 +1,103 @@
+import logging
 import os
 import json
-from typing import Any, Dict, List, Optional
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
 from psycopg2.extensions import connection as PgConnection
 
-from .db import init_db
-from .extract import (
-    AUDIO_EXTS,
-    VIDEO_EXTS,
-    IMAGE_EXTS,
-    extract_text_from_pdf,
-    transcribe_audio_file,
-    transcribe_video_file,
-    describe_image_with_groq,
-)
+from .config import AUDIO_EXTS, VIDEO_EXTS, IMAGE_EXTS
+from .metrics import timed
 from .chunking import (
     split_text_into_chunks,
     embed_texts,
     insert_documents,
     is_already_ingested,
+    save_ingestion,
 )
 from .conversation import (
     chat_step,
     create_conversation,
     get_conversation_history,
+    get_conversation_history_page,
 )
 from .conversation_analysis import (
-    analyze_conversation_with_groq,
+    refresh_conversation_profile,
     save_profile_information,
 )
-from .content_generation import generate_personalized_contents
+from .config import settings
+from .content_generation import (
+    generate_personalized_contents,
+    get_analysis_contents,
+    get_contents_state,
+)
+from .db import pooled_connection
+from .jobs import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
+    JobQueueFull,
+    create_analysis_job,
+    get_active_analysis_job,
+    get_analysis_job,
+    job_backlog,
+    submit_job,
+    update_analysis_job,
+)
+from .taxonomy import assign_new_documents
+from .usage import (
+    UsageRecorder,
+    get_conversation_usage,
+    get_usage_summary,
+    recording,
+    save_usage,
+)
 
 
 # ==========================
 # INGESTÃO DE ARQUIVOS
 # ==========================
+@timed("ingest")
 def ingest_file(
     conn: PgConnection,
     file_path: str,
     title: Optional[str] = None,
 ) -> Dict[str, Any]:
 
-    init_db(conn)
+    # tokens de transcrição/visão/embeddings ficam ligados à ingestão
+    usage = UsageRecorder()
+    with recording(usage, kind="ingest"):
+        result = _ingest_file(conn, file_path, title)
+
+    records = usage.drain()
+    if records or not result["skipped"]:
+        metadata = result["metadata"]
+        result["ingestion_id"] = save_ingestion(
+            conn,
+            source=metadata.get("source"),
+            doc_type=metadata.get("type"),
+            title=metadata.get("title"),
+            inserted_chunks=result["inserted_chunks"],
+            skipped_reason=result["reason"],
+        )
+        save_usage(conn, records, ingestion_id=result["ingestion_id"])
+    return result
+
+
+def _ingest_file(
+    conn: PgConnection,
+    file_path: str,
+    title: Optional[str] = None,
+) -> Dict[str, Any]:
+
+    # extratores carregados só na primeira ingestão (cold start da API)
+    from .extract import (
+        extract_text_from_pdf,
+        transcribe_audio_file,
+        transcribe_video_file,
+        describe_image_with_groq,
+    )
 
     ext = os.path.splitext(file_path)[1].lower()
     base_name = os.path.basename(file_path)
@@ -227,6 +283,8 @@ def ingest_file(
         embeddings,
         base_metadata=media_metadata,
     )
+    # novos chunks entram no nó mais próximo da taxonomia (se já existir)
+    assign_new_documents(conn)
 
     return {
         "skipped": False,
@@ -240,47 +298,95 @@ def ingest_file(
 # CONVERSATION
 # ==========================
 def start_conversation(conn: PgConnection) -> int:
-    
-    init_db(conn)
+
     conversation_id = create_conversation(conn)
     return conversation_id
 
 
-def handle_chat_message(
-    conn: PgConnection,
+async def handle_chat_message(
     conversation_id: Optional[int],
     message: str,
     top_k: int = 5,
-) -> Dict[str, Any]:
-    
-    init_db(conn)
+) -> Tuple[Dict[str, Any], Callable[[], Awaitable[None]]]:
 
-    result = chat_step(
-        conn=conn,
+    # caminho assíncrono (asyncpg + httpx)
+    result, persist = await chat_step(
         conversation_id=conversation_id,
         question=message,
         top_k=top_k,
+        on_persisted=maybe_schedule_profile_refresh,
+    )
+    return result, persist
+
+
+# ==========================
+# PERFIL INCREMENTAL (background)
+# ==========================
+logger = logging.getLogger(__name__)
+
+_profile_refresh_in_flight: Set[int] = set()
+_profile_refresh_lock = threading.Lock()
+
+
+def maybe_schedule_profile_refresh(conversation_id: int, revision: int) -> None:
+    every = settings.ANALYSIS_EVERY_N_TURNS
+    if every <= 0 or revision % every != 0:
+        return
+    with _profile_refresh_lock:
+        if conversation_id in _profile_refresh_in_flight:
+            return
+        _profile_refresh_in_flight.add(conversation_id)
+    submit_job(_run_profile_refresh, conversation_id, kind="profile")
+
+
+def _run_profile_refresh(conversation_id: int) -> None:
+    usage = UsageRecorder()
+    try:
+        with pooled_connection() as conn:
+            with recording(usage, kind="profile_refresh"):
+                refresh_conversation_profile(conn, conversation_id)
+            save_usage(conn, usage.drain(), conversation_id=conversation_id)
+    except Exception:
+        # o passo final de análise completa o que faltar
+        logger.exception("Falha no refresh do perfil da conversa %s", conversation_id)
+    finally:
+        with _profile_refresh_lock:
+            _profile_refresh_in_flight.discard(conversation_id)
+
+
+def load_conversation_history(
+    conn: PgConnection,
+    conversation_id: int,
+    after: int = 0,
+    limit: int = 50,
+) -> Dict[str, Any]:
+
+    return get_conversation_history_page(
+        conn=conn,
+        conversation_id=conversation_id,
+        after=after,
+        limit=limit,
     )
-    return result
 
 
 # ==========================
 # ANÁLISE E CRIAÇÃO DE CONTEÚDOS
 # ==========================
+@timed("analyze_and_generate")
 def analyze_and_generate(
     conn: PgConnection,
     conversation_id: int,
     preferred_format: Optional[str] = None,
+    on_analysis_saved: Optional[Callable[[int], None]] = None,
 ) -> Dict[str, Any]:
-    
-    init_db(conn)
 
     history = get_conversation_history(conn, conversation_id)
     if not history:
         raise ValueError("Nenhum histórico encontrado para esta conversa.")
 
-    # 2) Análise pedagógica (Groq)
-    analysis = analyze_conversation_with_groq(history)
+    # 2) Análise pedagógica (Groq): normalmente o perfil já está pronto
+    # (atualizado em background a cada N turnos); só analisa o que faltar
+    analysis, _ = refresh_conversation_profile(conn, conversation_id)
 
     # 3) Salvar análise em profile_information
     analysis_id = save_profile_information(
@@ -290,9 +396,11 @@ def analyze_and_generate(
         analysis=analysis,
         preferred_format=preferred_format,
     )
+    if on_analysis_saved is not None:
+        on_analysis_saved(analysis_id)
 
-    # 4) Geração de conteúdos personalizados
-    contents = generate_personalized_contents(
+    # 4) Geração de conteúdos personalizados (concorrente, falhas por item)
+    generation = generate_personalized_contents(
         conn=conn,
         conversation_id=conversation_id,
         analysis_id=analysis_id,
@@ -302,5 +410,131 @@ def analyze_and_generate(
 
     return {
         "analysis": analysis,
+        "contents": generation["contents"],
+        "failures": generation["failures"],
+    }
+
+
+# conteúdos de estudo já salvos (revisitas não regeram nada).
+# Devolve (etag, corpo); corpo None quando o etag bate com if_none_match.
+def load_conversation_contents(
+    conn: PgConnection,
+    conversation_id: int,
+    if_none_match: Optional[str] = None,
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+
+    state = get_contents_state(conn, conversation_id)
+    active_job = get_active_analysis_job(conn, conversation_id)
+    job_tag = f"{active_job['job_id']}:{active_job['stage']}" if active_job else "-"
+    etag = (
+        f'"{state["revision"]}-{state["analysis_id"] or 0}-'
+        f'{state["content_count"]}-{state["last_content_id"]}-{job_tag}"'
+    )
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return etag, None
+
+    contents: List[Dict[str, Any]] = []
+    if state["analysis_id"] is not None:
+        contents = get_analysis_contents(conn, conversation_id, state["analysis_id"])
+
+    return etag, {
+        "conversation_id": conversation_id,
+        "revision": state["revision"],
+        "analysis_id": state["analysis_id"],
+        "analyzed_revision": state["analyzed_revision"],
         "contents": contents,
+        "active_job": active_job,
     }
+
+
+# ==========================
+# USO DE TOKENS
+# ==========================
+def load_conversation_usage(conn: PgConnection, conversation_id: int) -> Dict[str, Any]:
+    # valida a conversa (404 no app) antes de agregar
+    get_conversation_history_page(conn, conversation_id, after=0, limit=1)
+    return get_conversation_usage(conn, conversation_id)
+
+
+def load_usage_summary(
+    conn: PgConnection, group_by: str = "kind", days: int = 7
+) -> Dict[str, Any]:
+    return get_usage_summary(conn, group_by=group_by, days=days)
+
+
+# ==========================
+# JOBS (análise + geração em background)
+# ==========================
+def start_analysis_job(
+    conn: PgConnection,
+    conversation_id: int,
+    preferred_format: Optional[str] = None,
+) -> Dict[str, Any]:
+
+    # valida antes de enfileirar (só a contagem de turnos, sem o histórico)
+    page = get_conversation_history_page(conn, conversation_id, after=0, limit=1)
+    if not page["revision"]:
+        raise ValueError("Nenhum histórico encontrado para esta conversa.")
+    # fila limitada: melhor recusar agora do que entregar o job daqui a minutos
+    if job_backlog("analysis") >= settings.ANALYSIS_JOB_MAX_PENDING:
+        raise JobQueueFull("Fila de análises cheia, tente novamente em instantes.")
+
+    job_id = create_analysis_job(conn, conversation_id, preferred_format)
+    submit_job(run_analysis_job, job_id, conversation_id, preferred_format)
+    return {"job_id": job_id, "status": JOB_PENDING}
+
+
+def run_analysis_job(
+    job_id: int,
+    conversation_id: int,
+    preferred_format: Optional[str] = None,
+) -> None:
+
+    with pooled_connection() as conn:
+        update_analysis_job(conn, job_id, status=JOB_RUNNING, stage="analyzing")
+        usage = UsageRecorder()
+        saved_analysis_id: Optional[int] = None
+
+        # cada conteúdo já fica visível em personalized_learning_contents
+        # assim que é salvo; o job só precisa expor o analysis_id
+        def on_analysis_saved(analysis_id: int) -> None:
+            nonlocal saved_analysis_id
+            saved_analysis_id = analysis_id
+            update_analysis_job(
+                conn, job_id, stage="generating", analysis_id=analysis_id
+            )
+
+        try:
+            with recording(usage, kind="analysis"):
+                result = analyze_and_generate(
+                    conn=conn,
+                    conversation_id=conversation_id,
+                    preferred_format=preferred_format,
+                    on_analysis_saved=on_analysis_saved,
+                )
+        except Exception as e:
+            update_analysis_job(
+                conn, job_id, status=JOB_FAILED, error=f"{type(e).__name__}: {e}"
+            )
+            return
+        finally:
+            # tokens gastos contam mesmo se o job falhou no meio
+            save_usage(
+                conn,
+                usage.drain(),
+                conversation_id=conversation_id,
+                analysis_id=saved_analysis_id,
+            )
+
+        update_analysis_job(
+            conn, job_id, status=JOB_DONE, stage="done", failures=result["failures"]
+        )
+
+
+def get_analysis_job_progress(
+    conn: PgConnection,
+    job_id: int,
+    after_content_id: int = 0,
+) -> Dict[str, Any]:
+
+    return get_analysis_job(conn, job_id, after_content_id=after_content_id)
@@ -0,0 +1,274 @@
+import asyncio
+import contextvars
+import functools
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+
+from .config import settings
+
+# Profiler por request, opt-in (staging / investigação de lentidão):
+# - ativado pelo header `X-Profile: 1` com token de admin, ou por amostragem
+#   (PROFILE_SAMPLE_RATE); desligado, o middleware nem é instalado
+# - amostrador em thread própria (sys._current_frames a cada
+#   PROFILE_INTERVAL_MS) que só conta as pilhas da request perfilada:
+#   a task da request no event loop e as threads do threadpool enquanto
+#   executam o handler síncrono (ProfiledRoute) ou etapas @timed dela (o
+#   perfil viaja em um contextvar, que o run_in_threadpool copia)
+# - saída em "folded stacks" (uma linha por pilha + contagem), aberta
+#   direto no speedscope ou no flamegraph.pl; baixe em /api/admin/profiles
+
+PROFILE_HEADER = b"x-profile"
+
+_active: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "request_profile", default=None
+)
+
+
+def profiling_enabled() -> bool:
+    return bool(settings.ADMIN_TOKEN) or settings.PROFILE_SAMPLE_RATE > 0
+
+
+def current_profile() -> Optional["RequestProfile"]:
+    return _active.get()
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{name}:{frame.f_lineno}"
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str) -> None:
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.interval = max(settings.PROFILE_INTERVAL_MS, 1) / 1000.0
+        self.samples: Dict[str, int] = {}
+        self.sample_count = 0
+        # thread -> alvos registrados (None = thread inteira, senão a task)
+        self._targets: Dict[int, List[Optional[asyncio.Task]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.duration = 0.0
+
+    # ---- registro (chamado pela própria request) ----
+    def enter(self) -> Tuple[int, Optional[asyncio.Task]]:
+        try:
+            task: Optional[asyncio.Task] = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = (threading.get_ident(), task)
+        with self._lock:
+            self._targets.setdefault(key[0], []).append(task)
+        return key
+
+    def exit(self, key: Tuple[int, Optional[asyncio.Task]]) -> None:
+        thread_id, task = key
+        with self._lock:
+            targets = self._targets.get(thread_id)
+            if targets and task in targets:
+                targets.remove(task)
+            if not targets:
+                self._targets.pop(thread_id, None)
+
+    # ---- amostragem ----
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name=f"profiler-{self.id}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.duration = time.perf_counter() - self.started_at
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                targets = {tid: list(tasks) for tid, tasks in self._targets.items()}
+            frames = sys._current_frames()
+            for thread_id, tasks in targets.items():
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own:
+                    continue
+                stack = self._stack(frame, tasks)
+                if stack:
+                    self.samples[stack] = self.samples.get(stack, 0) + 1
+                    self.sample_count += 1
+
+    @staticmethod
+    def _stack(frame: Any, tasks: List[Optional[asyncio.Task]]) -> Optional[str]:
+        # no event loop, a amostra só conta se a task da request está na pilha
+        # (o frame da coroutine dela aparece quando ela está rodando)
+        whole_thread = any(task is None for task in tasks)
+        task_frames = set()
+        if not whole_thread:
+            for task in tasks:
+                coro_frame = getattr(task.get_coro(), "cr_frame", None)
+                if coro_frame is not None:
+                    task_frames.add(id(coro_frame))
+        labels: List[str] = []
+        matched = whole_thread
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            if not matched and id(frame) in task_frames:
+                matched = True
+            frame = frame.f_back
+        if not matched:
+            return None
+        return ";".join(reversed(labels))
+
+    # ---- saída ----
+    def folded(self) -> str:
+        return "".join(
+            f"{stack} {count}\n"
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1])
+        )
+
+    def metadata(self, status: Optional[int], reason: str) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "trigger": reason,
+            "duration_seconds": round(self.duration, 4),
+            "interval_ms": settings.PROFILE_INTERVAL_MS,
+            "samples": self.sample_count,
+            "created_at": time.time(),
+        }
+
+
+# ==========================
+# ARQUIVOS
+# ==========================
+def _profile_dir() -> Path:
+    path = Path(settings.PROFILE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def save_profile(profile: RequestProfile, status: Optional[int], reason: str) -> None:
+    directory = _profile_dir()
+    (directory / f"{profile.id}.folded").write_text(profile.folded(), encoding="utf-8")
+    (directory / f"{profile.id}.json").write_text(
+        json.dumps(profile.metadata(status, reason)), encoding="utf-8"
+    )
+    # mantém só os mais recentes
+    metas = sorted(directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for old in metas[: max(len(metas) - settings.PROFILE_MAX_FILES, 0)]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".folded").unlink(missing_ok=True)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    directory = Path(settings.PROFILE_DIR)
+    if not directory.exists():
+        return []
+    out = []
+    for meta in directory.glob("*.json"):
+        try:
+            out.append(json.loads(meta.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return sorted(out, key=lambda m: m.get("created_at", 0), reverse=True)
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    if not profile_id.isalnum():
+        return None
+    path = Path(settings.PROFILE_DIR) / f"{profile_id}.folded"
+    return path if path.exists() else None
+
+
+# ==========================
+# ROTAS SÍNCRONAS (handler inteiro no threadpool)
+# ==========================
+def _profiled_sync(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        profile = current_profile()
+        key = profile.enter() if profile is not None else None
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            if key is not None:
+                profile.exit(key)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute que registra a thread do threadpool durante todo o handler
+    síncrono, e não só dentro das etapas @timed."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _profiled_sync(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+# ==========================
+# MIDDLEWARE (ASGI puro: roda na mesma task do handler)
+# ==========================
+class ProfilingMiddleware:
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    def _trigger(self, scope: Dict[str, Any]) -> Optional[str]:
+        for name, value in scope.get("headers") or ():
+            if name == PROFILE_HEADER and value not in (b"", b"0"):
+                from starlette.datastructures import Headers
+
+                from .admin import is_admin
+
+                return "header" if is_admin(Headers(scope=scope)) else None
+        if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+            return "sample"
+        return None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        reason = self._trigger(scope) if scope["type"] == "http" else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get("method", ""), scope.get("path", ""))
+        status: Optional[int] = None
+
+        async def send_with_id(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if reason == "header":
+                    headers = list(message.get("headers") or [])
+                    headers.append((b"x-profile-id", profile.id.encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        token = _active.set(profile)
+        key = profile.enter()
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.stop()
+            profile.exit(key)
+            _active.reset(token)
+            save_profile(profile, status, reason)
@@ -0,0 +1,763 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .config import settings
+from .metrics import (
+    PROVIDER_CIRCUIT_STATE,
+    PROVIDER_ERRORS,
+    PROVIDER_HEDGES,
+    PROVIDER_IN_FLIGHT,
+    PROVIDER_RATE_LIMIT_WAIT,
+    PROVIDER_RETRIES,
+    PROVIDER_SECONDS,
+    provider_name,
+)
+from .usage import record_usage
+
+# Camada única de acesso aos provedores (Groq / OpenRouter):
+# - sessões keep-alive compartilhadas (requests para o caminho síncrono,
+#   httpx.AsyncClient para o assíncrono), sem handshake TLS a cada chamada
+# - token bucket por (endpoint, modelo), ajustado pelos headers de rate limit
+# - retry com backoff exponencial + jitter para falhas transitórias
+# - circuit breaker por (provedor, modelo): com muitos erros recentes, falha
+#   na hora (CircuitOpen) em vez de esperar timeouts; model_routing desvia
+#   para o modelo de fallback
+# - hedging nas chamadas JSON (chat, embeddings): passado o p95 observado
+#   sem resposta, manda uma cópia e fica com a primeira que voltar
+# - métricas por tentativa (latência, retries, erros, em voo; ver metrics.py)
+# - tokens de cada resposta JSON vão para o recorder ativo (ver usage.py)
+
+RETRY_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class ProviderError(Exception):
+    pass
+
+
+class BudgetExceeded(ProviderError):
+    # a chamada não terminaria dentro do orçamento de latência (`budget`)
+    pass
+
+
+class CircuitOpen(ProviderError):
+    pass
+
+
+# ==========================
+# RATE LIMIT (TOKEN BUCKET)
+# ==========================
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def _parse_reset(value: Optional[str]) -> Optional[float]:
+    # Groq: "2m59.56s" / "7.66s" / "120ms"; OpenRouter: epoch em ms
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        total = 0.0
+        for amount, unit in _DURATION_RE.findall(value):
+            total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+        return total or None
+    if number > 1e12:
+        return max(number / 1000.0 - time.time(), 0.0)
+    return number
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        # Reserva 1 token e devolve quantos segundos o chamador deve esperar.
+        # Pode deixar o saldo negativo: quem chega depois espera mais.
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate if self.rate > 0 else 1.0
+            return max(wait, self.blocked_until - now, 0.0)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        limit = headers.get("x-ratelimit-limit-requests") or headers.get(
+            "x-ratelimit-limit"
+        )
+        remaining = headers.get("x-ratelimit-remaining-requests") or headers.get(
+            "x-ratelimit-remaining"
+        )
+        reset = _parse_reset(
+            headers.get("x-ratelimit-reset-requests")
+            or headers.get("x-ratelimit-reset")
+        )
+        if limit is None or remaining is None:
+            return
+        try:
+            limit_f = float(limit)
+            remaining_f = float(remaining)
+        except ValueError:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # a capacidade (rajada) fica em PROVIDER_DEFAULT_BURST: o limite
+            # do header pode ser diário (Groq) e viraria uma rajada enorme;
+            # os headers só ajustam saldo e ritmo
+            self.tokens = min(self.tokens, remaining_f)
+            if reset:
+                # ritmo que devolve o que falta até o próximo reset
+                self.rate = max((limit_f - remaining_f) / reset, limit_f / 86400.0)
+            if remaining_f <= 0 and reset:
+                self.blocked_until = max(self.blocked_until, now + reset)
+
+    def block_for(self, seconds: float) -> None:
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def has_capacity(self) -> bool:
+        # há token sobrando agora (sem fazer ninguém esperar)?
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self.tokens >= 1 and now >= self.blocked_until
+
+
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(url: str, model: Optional[str]) -> TokenBucket:
+    key = (url, model or "")
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(
+                    rate=settings.PROVIDER_DEFAULT_RATE,
+                    capacity=settings.PROVIDER_DEFAULT_BURST,
+                )
+                _buckets[key] = bucket
+    return bucket
+
+
+# ==========================
+# CIRCUIT BREAKER
+# ==========================
+CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN = 0, 1, 2
+
+
+class CircuitBreaker:
+    """
+    Janela das últimas CIRCUIT_WINDOW tentativas. Abre com taxa de erro
+    >= CIRCUIT_ERROR_RATE (mínimo CIRCUIT_MIN_CALLS); depois de
+    CIRCUIT_OPEN_SECONDS deixa passar uma sonda (half-open): sucesso fecha,
+    falha reabre. Erro = 5xx, timeout ou conexão; 429 é rate limit, não conta.
+    """
+
+    def __init__(self, provider: str, model: str) -> None:
+        self.provider = provider
+        self.model = model
+        self.state = CIRCUIT_CLOSED
+        self.outcomes: Deque[bool] = deque(maxlen=max(settings.CIRCUIT_WINDOW, 1))
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set(self, state: int) -> None:
+        self.state = state
+        PROVIDER_CIRCUIT_STATE.labels(self.provider, self.model).set(state)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN:
+                if time.monotonic() - self.opened_at < settings.CIRCUIT_OPEN_SECONDS:
+                    return False
+                self._set(CIRCUIT_HALF_OPEN)
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def record(self, ok: Optional[bool]) -> None:
+        # ok=None: tentativa neutra (429, cancelada); só libera a sonda
+        with self._lock:
+            if self.state == CIRCUIT_HALF_OPEN:
+                self.probe_in_flight = False
+                if ok is True:
+                    self.outcomes.clear()
+                    self._set(CIRCUIT_CLOSED)
+                elif ok is False:
+                    self._open()
+                return
+            if self.state == CIRCUIT_OPEN or ok is None:
+                return
+            self.outcomes.append(ok)
+            calls = len(self.outcomes)
+            if (
+                calls >= settings.CIRCUIT_MIN_CALLS
+                and self.outcomes.count(False) / calls >= settings.CIRCUIT_ERROR_RATE
+            ):
+                self._open()
+
+    def _open(self) -> None:
+        self.opened_at = time.monotonic()
+        self._set(CIRCUIT_OPEN)
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+
+def get_breaker(provider: str, model: str) -> CircuitBreaker:
+    key = (provider, model)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _buckets_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(provider, model))
+    return breaker
+
+
+def _admit(breaker: CircuitBreaker, url: str) -> None:
+    if not settings.CIRCUIT_BREAKER or breaker.allow():
+        return
+    PROVIDER_ERRORS.labels(breaker.provider, breaker.model, "circuit_open").inc()
+    raise CircuitOpen(f"Circuito aberto para {url} ({breaker.model}).")
+
+
+def _record_outcome(breaker: CircuitBreaker, ok: Optional[bool]) -> None:
+    if settings.CIRCUIT_BREAKER:
+        breaker.record(ok)
+
+
+def _status_ok(status: int) -> Optional[bool]:
+    if status == 429:
+        return None
+    return status < 500
+
+
+# ==========================
+# HEDGING
+# ==========================
+class LatencyTracker:
+    # latência das tentativas bem-sucedidas + crédito de hedges, que limita
+    # as cópias a PROVIDER_HEDGE_MAX_RATIO das chamadas (sem amplificar
+    # carga quando o provedor inteiro está lento)
+    def __init__(self) -> None:
+        self.samples: Deque[float] = deque(maxlen=max(settings.PROVIDER_HEDGE_WINDOW, 1))
+        self.quantile: Optional[float] = None
+        self.since_update = 0
+        self.credits = 1.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+            self.since_update += 1
+            if self.since_update >= 10 or self.quantile is None:
+                ordered = sorted(self.samples)
+                index = int(settings.PROVIDER_HEDGE_QUANTILE * (len(ordered) - 1))
+                self.quantile = ordered[index]
+                self.since_update = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        with self._lock:
+            self.credits = min(self.credits + settings.PROVIDER_HEDGE_MAX_RATIO, 10.0)
+            if len(self.samples) < settings.PROVIDER_HEDGE_MIN_SAMPLES or self.quantile is None:
+                return None
+            return max(self.quantile, settings.PROVIDER_HEDGE_MIN_DELAY)
+
+    def take_hedge(self) -> bool:
+        with self._lock:
+            if self.credits < 1:
+                return False
+            self.credits -= 1
+            return True
+
+
+_trackers: Dict[Tuple[str, str], LatencyTracker] = {}
+
+
+def get_latency_tracker(url: str, model: Optional[str]) -> LatencyTracker:
+    key = (url, model or "")
+    tracker = _trackers.get(key)
+    if tracker is None:
+        with _buckets_lock:
+            tracker = _trackers.setdefault(key, LatencyTracker())
+    return tracker
+
+
+def _hedge_plan(url: str, model: Optional[str]) -> Tuple[LatencyTracker, Optional[float]]:
+    tracker = get_latency_tracker(url, model)
+    delay = tracker.hedge_delay() if settings.PROVIDER_HEDGING else None
+    return tracker, delay
+
+
+def _may_hedge(tracker: LatencyTracker, url: str, model: Optional[str]) -> bool:
+    # a cópia só vale se sair já: sem crédito ou sem token no bucket, não manda
+    return get_bucket(url, model).has_capacity() and tracker.take_hedge()
+
+
+def _observe_attempt(provider: str, model: str, outcome: str, start: float) -> None:
+    PROVIDER_SECONDS.labels(provider, model, outcome).observe(
+        time.perf_counter() - start
+    )
+
+
+def _remaining(deadline: Optional[float], url: str, model: str) -> Optional[float]:
+    if deadline is None:
+        return None
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        raise BudgetExceeded(f"Orçamento de latência esgotado em {url} ({model}).")
+    return remaining
+
+
+def _within(deadline: Optional[float], delay: float, url: str, model: str) -> float:
+    # espera (rate limit / backoff) que estouraria o orçamento: desiste já
+    remaining = _remaining(deadline, url, model)
+    if remaining is not None and delay >= remaining:
+        raise BudgetExceeded(
+            f"Espera de {delay:.1f}s excede o orçamento restante em {url} ({model})."
+        )
+    return delay
+
+
+def _backoff(attempt: int, retry_after: Optional[float]) -> float:
+    # full jitter: uniforme em [0, base * 2^attempt], respeitando Retry-After
+    cap = min(settings.PROVIDER_BACKOFF_BASE * (2 ** attempt), settings.PROVIDER_BACKOFF_MAX)
+    delay = random.uniform(0, cap)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+# ==========================
+# CLIENTE SÍNCRONO (requests)
+# ==========================
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.PROVIDER_POOL_CONNECTIONS,
+                    pool_maxsize=settings.PROVIDER_POOL_MAXSIZE,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _sleep(seconds: float, abort: Optional[threading.Event]) -> None:
+    # backoff interrompível: a outra cópia respondeu, não há o que esperar
+    if abort is None:
+        time.sleep(seconds)
+    else:
+        abort.wait(seconds)
+
+
+def post(
+    url: str,
+    *,
+    model: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    json: Optional[Any] = None,
+    data: Optional[Any] = None,
+    files: Optional[Any] = None,
+    timeout: float = 120,
+    budget: Optional[float] = None,
+    abort: Optional[threading.Event] = None,
+) -> requests.Response:
+    # budget: teto de tempo total (esperas + tentativas); estourou -> BudgetExceeded
+    # abort: sinalizado, não começa nova tentativa (cópia de hedge perdedora)
+    bucket = get_bucket(url, model)
+    session = get_session()
+    attempts = settings.PROVIDER_MAX_RETRIES + 1
+    provider, model_label = provider_name(url), model or ""
+    deadline = time.perf_counter() + budget if budget is not None else None
+    breaker = get_breaker(provider, model_label)
+
+    for attempt in range(attempts):
+        if abort is not None and abort.is_set():
+            raise ProviderError(f"Chamada a {url} abandonada (outra cópia respondeu).")
+        wait = _within(deadline, bucket.reserve(), url, model_label)
+        PROVIDER_RATE_LIMIT_WAIT.labels(provider, model_label).observe(wait)
+        if wait > 0:
+            time.sleep(wait)
+        remaining = _remaining(deadline, url, model_label)
+
+        # admissão colada no envio: daqui até o fim da tentativa o resultado
+        # sempre volta para o breaker (None = neutro), senão a sonda do
+        # half-open ficaria presa
+        _admit(breaker, url)
+        in_flight = PROVIDER_IN_FLIGHT.labels(provider)
+        in_flight.inc()
+        start = time.perf_counter()
+        resp = None
+        ok: Optional[bool] = None
+        try:
+            resp = session.post(
+                url,
+                headers=headers,
+                json=json,
+                data=data,
+                files=files,
+                timeout=min(timeout, remaining) if remaining is not None else timeout,
+            )
+            ok = _status_ok(resp.status_code)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            ok = False
+            _observe_attempt(provider, model_label, "connection_error", start)
+            if attempt == attempts - 1:
+                PROVIDER_ERRORS.labels(provider, model_label, type(e).__name__).inc()
+                raise
+            PROVIDER_RETRIES.labels(provider, model_label, "connection").inc()
+        finally:
+            in_flight.dec()
+            _record_outcome(breaker, ok)
+        if resp is None:
+            _sleep(_within(deadline, _backoff(attempt, None), url, model_label), abort)
+            continue
+
+        _observe_attempt(provider, model_label, str(resp.status_code), start)
+        if resp.status_code < 400:
+            get_latency_tracker(url, model).observe(time.perf_counter() - start)
+
+        bucket.update_from_headers(resp.headers)
+        if resp.status_code in RETRY_STATUS and attempt < attempts - 1:
+            PROVIDER_RETRIES.labels(provider, model_label, str(resp.status_code)).inc()
+            retry_after = _parse_retry_after(resp.headers.get("retry-after"))
+            if resp.status_code == 429 and retry_after:
+                bucket.block_for(retry_after)
+            _sleep(_within(deadline, _backoff(attempt, retry_after), url, model_label), abort)
+            continue
+
+        if resp.status_code >= 400:
+            PROVIDER_ERRORS.labels(provider, model_label, str(resp.status_code)).inc()
+        resp.raise_for_status()
+        return resp
+
+    raise ProviderError(f"Falha ao chamar {url} após {attempts} tentativas.")
+
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _session_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=settings.PROVIDER_HEDGE_THREADS,
+                    thread_name_prefix="provider-hedge",
+                )
+    return _hedge_executor
+
+
+class _HedgeTimer:
+    # uma thread só dispara as cópias no horário (heap); a chamada original
+    # continua na thread de quem chamou
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, List[Any]]] = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, delay: float, fn: Callable[[], None]) -> List[Any]:
+        entry: List[Any] = [fn]
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="provider-hedge-timer", daemon=True
+                )
+                self._thread.start()
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), entry))
+            self._cond.notify()
+        return entry
+
+    @staticmethod
+    def cancel(entry: List[Any]) -> None:
+        entry[0] = None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                at, _, entry = self._heap[0]
+                now = time.monotonic()
+                if at > now:
+                    self._cond.wait(at - now)
+                    continue
+                heapq.heappop(self._heap)
+            fn = entry[0]
+            if fn is not None:
+                try:
+                    fn()
+                except Exception:
+                    pass
+
+
+_hedge_timer = _HedgeTimer()
+
+
+def _hedge_attempt_timeout(delay: float, timeout: float) -> float:
+    bound = max(delay * settings.PROVIDER_HEDGE_TIMEOUT_FACTOR, settings.PROVIDER_HEDGE_MIN_TIMEOUT)
+    return min(timeout, bound)
+
+
+def _post_hedged(url: str, payload: Dict[str, Any], kwargs: Dict[str, Any]) -> requests.Response:
+    model = kwargs.get("model")
+    tracker, delay = _hedge_plan(url, model)
+    if delay is None:
+        return post(url, json=payload, **kwargs)
+
+    # a original roda aqui; só a cópia vai para o executor, disparada pelo
+    # timer se a original passar de `delay`. Cada tentativa fica limitada por
+    # _hedge_attempt_timeout, e quando uma das duas responde a outra não
+    # começa nova tentativa (abort), então a perdedora libera a thread logo
+    kwargs = {**kwargs, "timeout": _hedge_attempt_timeout(delay, kwargs.get("timeout", 120))}
+    provider, model_label = provider_name(url), model or ""
+    stop_primary, stop_hedge = threading.Event(), threading.Event()
+    hedge: List[Future] = []
+    context = contextvars.copy_context()
+
+    def hedge_done(future: Future) -> None:
+        if future.exception() is None:
+            stop_primary.set()
+
+    def send_hedge() -> None:
+        if stop_hedge.is_set() or not _may_hedge(tracker, url, model):
+            return
+        PROVIDER_HEDGES.labels(provider, model_label, "sent").inc()
+        future = _get_hedge_executor().submit(
+            context.run, post, url, json=payload, abort=stop_hedge, **kwargs
+        )
+        future.add_done_callback(hedge_done)
+        hedge.append(future)
+
+    timer = _hedge_timer.schedule(delay, send_hedge)
+    try:
+        resp = post(url, json=payload, abort=stop_primary, **kwargs)
+    except Exception:
+        _hedge_timer.cancel(timer)
+        if not hedge:
+            stop_hedge.set()
+            raise
+        # a original falhou ou foi abandonada: vale a cópia, se ela responder
+        try:
+            resp = hedge[0].result()
+        except Exception:
+            pass
+        else:
+            PROVIDER_HEDGES.labels(provider, model_label, "won").inc()
+            return resp
+        raise
+    _hedge_timer.cancel(timer)
+    stop_hedge.set()
+    if hedge:
+        PROVIDER_HEDGES.labels(provider, model_label, "lost").inc()
+    return resp
+
+
+def post_json(url: str, payload: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+    kwargs.setdefault("model", payload.get("model"))
+    data = _post_hedged(url, payload, kwargs).json()
+    record_usage(url, kwargs["model"], data.get("usage"))
+    return data
+
+
+# ==========================
+# CLIENTE ASSÍNCRONO (httpx)
+# ==========================
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=settings.PROVIDER_POOL_MAXSIZE * 4,
+                max_keepalive_connections=settings.PROVIDER_POOL_MAXSIZE,
+            ),
+        )
+    return _async_client
+
+
+async def close_async_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def post_async(
+    url: str,
+    *,
+    model: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    json: Optional[Any] = None,
+    timeout: float = 120,
+    budget: Optional[float] = None,
+) -> httpx.Response:
+    bucket = get_bucket(url, model)
+    client = get_async_client()
+    attempts = settings.PROVIDER_MAX_RETRIES + 1
+    provider, model_label = provider_name(url), model or ""
+    deadline = time.perf_counter() + budget if budget is not None else None
+    breaker = get_breaker(provider, model_label)
+
+    for attempt in range(attempts):
+        wait = _within(deadline, bucket.reserve(), url, model_label)
+        PROVIDER_RATE_LIMIT_WAIT.labels(provider, model_label).observe(wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        remaining = _remaining(deadline, url, model_label)
+
+        _admit(breaker, url)
+        in_flight = PROVIDER_IN_FLIGHT.labels(provider)
+        in_flight.inc()
+        start = time.perf_counter()
+        resp = None
+        ok: Optional[bool] = None
+        try:
+            resp = await client.post(
+                url,
+                headers=headers,
+                json=json,
+                timeout=min(timeout, remaining) if remaining is not None else timeout,
+            )
+            ok = _status_ok(resp.status_code)
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            ok = False
+            _observe_attempt(provider, model_label, "connection_error", start)
+            if attempt == attempts - 1:
+                PROVIDER_ERRORS.labels(provider, model_label, type(e).__name__).inc()
+                raise
+            PROVIDER_RETRIES.labels(provider, model_label, "connection").inc()
+        finally:
+            in_flight.dec()
+            _record_outcome(breaker, ok)
+        if resp is None:
+            await asyncio.sleep(_within(deadline, _backoff(attempt, None), url, model_label))
+            continue
+
+        _observe_attempt(provider, model_label, str(resp.status_code), start)
+        if resp.status_code < 400:
+            get_latency_tracker(url, model).observe(time.perf_counter() - start)
+
+        bucket.update_from_headers(resp.headers)
+        if resp.status_code in RETRY_STATUS and attempt < attempts - 1:
+            PROVIDER_RETRIES.labels(provider, model_label, str(resp.status_code)).inc()
+            retry_after = _parse_retry_after(resp.headers.get("retry-after"))
+            if resp.status_code == 429 and retry_after:
+                bucket.block_for(retry_after)
+            await asyncio.sleep(
+                _within(deadline, _backoff(attempt, retry_after), url, model_label)
+            )
+            continue
+
+        if resp.status_code >= 400:
+            PROVIDER_ERRORS.labels(provider, model_label, str(resp.status_code)).inc()
+        resp.raise_for_status()
+        return resp
+
+    raise ProviderError(f"Falha ao chamar {url} após {attempts} tentativas.")
+
+
+async def _post_hedged_async(
+    url: str, payload: Dict[str, Any], kwargs: Dict[str, Any]
+) -> httpx.Response:
+    model = kwargs.get("model")
+    tracker, delay = _hedge_plan(url, model)
+    if delay is None:
+        return await post_async(url, json=payload, **kwargs)
+
+    primary = asyncio.ensure_future(post_async(url, json=payload, **kwargs))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not _may_hedge(tracker, url, model):
+            return await primary
+
+        provider, model_label = provider_name(url), model or ""
+        PROVIDER_HEDGES.labels(provider, model_label, "sent").inc()
+        hedge = asyncio.ensure_future(post_async(url, json=payload, **kwargs))
+        tasks.append(hedge)
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    outcome = "won" if task is hedge else "lost"
+                    PROVIDER_HEDGES.labels(provider, model_label, outcome).inc()
+                    return task.result()
+                error = error or task.exception()
+        assert error is not None
+        raise error
+    finally:
+        # a perdedora (ou as duas, se quem chamou foi cancelado) é cancelada
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def post_json_async(
+    url: str, payload: Dict[str, Any], **kwargs: Any
+) -> Dict[str, Any]:
+    kwargs.setdefault("model", payload.get("model"))
+    resp = await _post_hedged_async(url, payload, kwargs)
+    data = resp.json()
+    record_usage(url, kwargs["model"], data.get("usage"))
+    return data
@@ -0,0 +1,329 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import asyncpg
+from psycopg2.extensions import cursor as PgCursor
+
+from .config import settings
+from .metrics import DB_SLOW_QUERIES
+
+# Instrumentação das queries (por processo):
+# - InstrumentedCursor (psycopg2, via cursor_factory) e
+#   InstrumentedConnection (asyncpg, via connection_class) medem cada
+#   statement: chamadas, tempo total/máximo e linhas
+# - statements agrupados pelo texto normalizado (literais -> ?, listas de
+#   VALUES colapsadas), então execute_values não explode o número de chaves
+# - acima de DB_SLOW_QUERY_MS, captura o plano em segundo plano (fora da
+#   request): EXPLAIN (ANALYZE, BUFFERS) para leituras, EXPLAIN simples para
+#   escritas (ANALYZE executaria a escrita de novo); no máximo um plano por
+#   statement a cada DB_EXPLAIN_INTERVAL_SECONDS
+# - /api/admin/db/statements lista o top por tempo total
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?(?:e-?\d+)?\b", re.IGNORECASE)
+_ROW = r"\((?:\s*(?:\?|%s|NULL|DEFAULT)\s*(?:::\w+(?:\[\])?)?\s*,?)+\)"
+_VALUES_RE = re.compile(rf"{_ROW}(?:\s*,\s*{_ROW})+", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_WRITE_RE = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|ALTER|DROP|TRUNCATE|VACUUM|ANALYZE|LOCK)\b"
+    r"|\bFOR\s+UPDATE\b|\bnextval\s*\(",
+    re.IGNORECASE,
+)
+
+_CALL_RE = re.compile(r"\b([a-z_][\w.]*)\s*\(", re.IGNORECASE)
+# o que pode vir antes de "(" num SELECT sem efeito colateral: palavras-chave,
+# tipos e funções puras. Qualquer outra chamada (pg_advisory_lock, nextval,
+# set_config, funções do usuário...) tira o ANALYZE do plano
+_SAFE_CALLS = frozenset(
+    """
+    all and any array as case cast exists filter from group in lateral not
+    on or over partition row select some using values when where with within
+    numeric varchar char decimal vector
+    abs array_agg array_length avg ceil coalesce count date_trunc dense_rank
+    extract floor generate_series greatest jsonb_agg jsonb_array_elements
+    jsonb_array_length jsonb_build_object jsonb_object_agg json_agg
+    json_build_object lag lead least left length lower make_interval max min
+    now nullif percentile_cont percentile_disc rank right round row_number
+    string_agg substring sum to_regclass unnest upper
+    """.split()
+)
+
+Query = Union[str, bytes]
+
+
+def _normalize(sql: str) -> str:
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _VALUES_RE.sub("(...)", sql)
+    return _SPACE_RE.sub(" ", sql).strip().rstrip(";")[:2000]
+
+
+_normalize_cached = lru_cache(maxsize=1024)(_normalize)
+
+
+def normalize_statement(query: Query) -> str:
+    # strings de template (as nossas) repetem: cache; bytes vêm de
+    # execute_values já com os valores e são sempre únicos
+    if isinstance(query, bytes):
+        return _normalize(query.decode("utf-8", errors="replace"))
+    return _normalize_cached(query)
+
+
+def is_read_only(sql: str) -> bool:
+    """True só se EXPLAIN ANALYZE (que executa a query) não tem efeito."""
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    code = _STRING_RE.sub("''", sql)
+    if head not in ("SELECT", "WITH") or _WRITE_RE.search(code):
+        return False
+    calls = {name.lower() for name in _CALL_RE.findall(code)}
+    return calls <= _SAFE_CALLS
+
+
+class StatementStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._dropped = 0
+
+    def record(self, statement: str, seconds: float, rows: int) -> bool:
+        """Registra uma execução; True se o plano deve ser capturado agora."""
+        slow = settings.DB_SLOW_QUERY_MS > 0 and seconds * 1000 >= settings.DB_SLOW_QUERY_MS
+        with self._lock:
+            item = self._stats.get(statement)
+            if item is None:
+                if len(self._stats) >= settings.DB_QUERY_STATS_MAX:
+                    self._dropped += 1
+                    return False
+                item = self._stats[statement] = {
+                    "calls": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "rows": 0,
+                    "slow_calls": 0,
+                    "plan": None,
+                    "plan_seconds": None,
+                    "plan_at": 0.0,
+                }
+            item["calls"] += 1
+            item["total_seconds"] += seconds
+            item["max_seconds"] = max(item["max_seconds"], seconds)
+            item["rows"] += max(rows, 0)
+            if not slow:
+                return False
+            item["slow_calls"] += 1
+            now = time.time()
+            if now - item["plan_at"] < settings.DB_EXPLAIN_INTERVAL_SECONDS:
+                return False
+            # reserva a captura (outras threads não repetem)
+            item["plan_at"] = now
+            item["plan_seconds"] = seconds
+            return True
+
+    def set_plan(self, statement: str, plan: str) -> None:
+        with self._lock:
+            item = self._stats.get(statement)
+            if item is not None:
+                item["plan"] = plan
+
+    def top(self, order: str = "total", limit: int = 20) -> Dict[str, Any]:
+        key = {
+            "total": lambda i: i[1]["total_seconds"],
+            "mean": lambda i: i[1]["total_seconds"] / max(i[1]["calls"], 1),
+            "max": lambda i: i[1]["max_seconds"],
+            "calls": lambda i: i[1]["calls"],
+        }.get(order)
+        if key is None:
+            raise ValueError("order inválido (use total, mean, max ou calls).")
+        with self._lock:
+            items = sorted(
+                ((s, dict(i)) for s, i in self._stats.items()), key=key, reverse=True
+            )[:limit]
+            total = sum(i["total_seconds"] for i in self._stats.values())
+            tracked, dropped = len(self._stats), self._dropped
+        return {
+            "order": order,
+            "tracked_statements": tracked,
+            "dropped_statements": dropped,
+            "slow_query_ms": settings.DB_SLOW_QUERY_MS,
+            "statements": [
+                {
+                    "statement": statement,
+                    "calls": item["calls"],
+                    "total_ms": round(item["total_seconds"] * 1000, 3),
+                    "mean_ms": round(item["total_seconds"] * 1000 / max(item["calls"], 1), 3),
+                    "max_ms": round(item["max_seconds"] * 1000, 3),
+                    "share": round(item["total_seconds"] / total, 4) if total else 0.0,
+                    "rows": item["rows"],
+                    "rows_per_call": round(item["rows"] / max(item["calls"], 1), 2),
+                    "slow_calls": item["slow_calls"],
+                    "plan": item["plan"],
+                    "plan_captured_ms": (
+                        round(item["plan_seconds"] * 1000, 3)
+                        if item["plan_seconds"] is not None
+                        else None
+                    ),
+                }
+                for statement, item in items
+            ],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._dropped = 0
+
+
+statement_stats = StatementStats()
+
+
+def _is_explain(query: Query) -> bool:
+    # os próprios EXPLAIN de captura não entram nas estatísticas
+    head = query[:8]
+    if isinstance(head, bytes):
+        head = head.decode("ascii", errors="replace")
+    return head.upper() == "EXPLAIN "
+
+
+def _explain_prefix(sql: str) -> str:
+    if is_read_only(sql):
+        return "EXPLAIN (ANALYZE, BUFFERS, FORMAT TEXT) "
+    return "EXPLAIN (FORMAT TEXT) "
+
+
+# ==========================
+# PSYCOPG2
+# ==========================
+# uma thread só: planos são raros e não devem disputar o pool com as requests
+_explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+
+
+def _explain_sync(statement: str, query: Query, params: Any) -> None:
+    from .db import pooled_connection
+
+    sql = query.decode("utf-8", errors="replace") if isinstance(query, bytes) else query
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_explain_prefix(sql) + sql, params)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+    except Exception as e:
+        plan = f"(plano indisponível: {type(e).__name__}: {e})"
+    statement_stats.set_plan(statement, plan)
+
+
+class InstrumentedCursor(PgCursor):
+    def execute(self, query: Query, vars: Any = None) -> None:
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(query, vars, time.perf_counter() - start)
+
+    def executemany(self, query: Query, vars_list: Any) -> None:
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, None, time.perf_counter() - start)
+
+    def _record(self, query: Query, vars: Any, seconds: float) -> None:
+        if not settings.DB_QUERY_STATS or _is_explain(query):
+            return
+        statement = normalize_statement(query)
+        if statement_stats.record(statement, seconds, self.rowcount):
+            DB_SLOW_QUERIES.labels("psycopg2").inc()
+            logger.warning("query lenta (%.0f ms): %s", seconds * 1000, statement[:300])
+            _explain_executor.submit(_explain_sync, statement, query, vars)
+
+
+# ==========================
+# ASYNCPG
+# ==========================
+_explain_tasks: set = set()
+
+
+async def _explain_async(statement: str, query: str, args: Sequence[Any]) -> None:
+    from .db_async import get_async_pool
+
+    try:
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(_explain_prefix(query) + query, *args)
+        plan = "\n".join(row[0] for row in rows)
+    except Exception as e:
+        plan = f"(plano indisponível: {type(e).__name__}: {e})"
+    statement_stats.set_plan(statement, plan)
+
+
+def _status_rows(status: Optional[str]) -> int:
+    # "INSERT 0 5" / "UPDATE 3" / "SELECT 10"
+    if not status:
+        return 0
+    last = status.rsplit(" ", 1)[-1]
+    return int(last) if last.isdigit() else 0
+
+
+class InstrumentedConnection(asyncpg.Connection):
+    def _record(self, query: str, args: Sequence[Any], seconds: float, rows: int) -> None:
+        if not settings.DB_QUERY_STATS or _is_explain(query):
+            return
+        statement = normalize_statement(query)
+        if statement_stats.record(statement, seconds, rows):
+            DB_SLOW_QUERIES.labels("asyncpg").inc()
+            logger.warning("query lenta (%.0f ms): %s", seconds * 1000, statement[:300])
+            task = asyncio.get_running_loop().create_task(
+                _explain_async(statement, query, list(args))
+            )
+            _explain_tasks.add(task)
+            task.add_done_callback(_explain_tasks.discard)
+
+    async def execute(self, query: str, *args: Any, **kwargs: Any) -> str:
+        start = time.perf_counter()
+        status = None
+        try:
+            status = await super().execute(query, *args, **kwargs)
+            return status
+        finally:
+            self._record(query, args, time.perf_counter() - start, _status_rows(status))
+
+    async def executemany(self, command: str, args: Any, **kwargs: Any) -> None:
+        args = list(args)
+        start = time.perf_counter()
+        try:
+            return await super().executemany(command, args, **kwargs)
+        finally:
+            # plano com a primeira linha de parâmetros
+            self._record(command, args[0] if args else (), time.perf_counter() - start, len(args))
+
+    async def fetch(self, query: str, *args: Any, **kwargs: Any) -> List[Any]:
+        start = time.perf_counter()
+        rows: List[Any] = []
+        try:
+            rows = await super().fetch(query, *args, **kwargs)
+            return rows
+        finally:
+            self._record(query, args, time.perf_counter() - start, len(rows))
+
+    async def fetchrow(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        row = None
+        try:
+            row = await super().fetchrow(query, *args, **kwargs)
+            return row
+        finally:
+            self._record(query, args, time.perf_counter() - start, int(row is not None))
+
+    async def fetchval(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await super().fetchval(query, *args, **kwargs)
+        finally:
+            self._record(query, args, time.perf_counter() - start, 1)
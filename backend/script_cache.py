@@ -0,0 +1,140 @@
+import hashlib
+import json
+import random
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from psycopg2.extensions import connection as PgConnection
+
+from .config import settings
+
+# Cache de roteiros gerados, compartilhado entre alunos.
+# Chave = subtema normalizado + nível + formato + conjunto de documentos
+# de origem + hash do conteúdo desses trechos + modelo + versão do prompt.
+# Como o hash dos trechos entra na chave, mudar o conteúdo de origem
+# invalida a entrada automaticamente (a antiga deixa de ser encontrada).
+# Observação: a justificativa individual do aluno não entra na chave;
+# quem reutiliza recebe o roteiro gerado para o mesmo subtema/nível.
+
+POLICY_ALWAYS = "always"
+POLICY_PROBABILITY = "probability"
+POLICY_OFF = "off"
+
+
+def normalize_text(value: str) -> str:
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    value = re.sub(r"[^\w\s]", " ", value.lower())
+    return re.sub(r"\s+", " ", value).strip()
+
+
+def source_hash(results: List[Dict[str, Any]]) -> str:
+    digest = hashlib.sha256()
+    for r in sorted(results, key=lambda r: r["id"]):
+        digest.update(f"{r['id']}:".encode("utf-8"))
+        digest.update((r.get("content") or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def build_cache_key(
+    subtema: str,
+    nivel: str,
+    content_type: str,
+    source_doc_ids: List[int],
+    chunks_hash: str,
+    model: str,
+    prompt_version: str,
+) -> str:
+    raw = json.dumps(
+        [
+            normalize_text(subtema),
+            normalize_text(nivel),
+            content_type,
+            sorted(source_doc_ids),
+            chunks_hash,
+            model,
+            prompt_version,
+        ]
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def should_reuse() -> bool:
+    policy = settings.SCRIPT_CACHE_POLICY
+    if policy == POLICY_ALWAYS:
+        return True
+    if policy == POLICY_PROBABILITY:
+        return random.random() < settings.SCRIPT_CACHE_REUSE_PROBABILITY
+    return False
+
+
+def get_cached_script(conn: PgConnection, cache_key: str) -> Optional[Dict[str, str]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE learning_script_cache
+            SET hits = hits + 1,
+                last_hit_at = NOW()
+            WHERE cache_key = %s
+            RETURNING title, script;
+            """,
+            (cache_key,),
+        )
+        row = cur.fetchone()
+    if not row:
+        return None
+    return {"title": row[0], "script": row[1]}
+
+
+# grava (ou renova, na política probabilística) a entrada do cache
+def store_cached_script(
+    conn: PgConnection,
+    cache_key: str,
+    subtema: str,
+    nivel: str,
+    content_type: str,
+    source_doc_ids: List[int],
+    chunks_hash: str,
+    model: str,
+    prompt_version: str,
+    title: str,
+    script: str,
+) -> None:
+    if settings.SCRIPT_CACHE_POLICY == POLICY_OFF:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO learning_script_cache (
+                cache_key,
+                subtema_norm,
+                nivel,
+                content_type,
+                source_doc_ids,
+                source_hash,
+                model,
+                prompt_version,
+                title,
+                script
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET title = EXCLUDED.title,
+                script = EXCLUDED.script,
+                created_at = NOW();
+            """,
+            (
+                cache_key,
+                normalize_text(subtema),
+                normalize_text(nivel),
+                content_type,
+                sorted(source_doc_ids),
+                chunks_hash,
+                model,
+                prompt_version,
+                title,
+                script,
+            ),
+        )
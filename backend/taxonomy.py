@@ -0,0 +1,530 @@
+import argparse
+import math
+import re
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from psycopg2.extensions import connection as PgConnection
+
+from .config import settings
+from .chunking import embedding_to_pgvector_str
+from .script_cache import normalize_text
+
+# Taxonomia de subtemas construída na ingestão:
+# - k-means (NumPy, vetorizado) sobre os embeddings de `documents`
+# - cada nó tem centróide, rótulo e chunks membros (com a distância ao
+#   centróide já calculada)
+# - documentos novos entram no nó mais próximo e o centróide é atualizado
+#   pela média acumulada; `python -m backend.taxonomy` reconstrói tudo
+# - subtemas da análise (texto livre) são mapeados para nós e o mapeamento
+#   fica salvo (subtopic_aliases), então a recuperação de contexto para a
+#   geração vira uma consulta pronta, sem embedding nem busca vetorial
+#
+# NumPy só é importado nas funções de clustering (não pesa no startup da API).
+
+# lock compartilhado entre reconstrução e atribuição incremental
+TAXONOMY_LOCK_ID = 727_310_038
+
+_STOPWORDS = set(
+    """
+    a o as os um uma uns umas de do da dos das em no na nos nas por pelo pela
+    pelos pelas para com sem sobre entre que se e ou mas como mais menos muito
+    muita muitos muitas ja nao sim ao aos sua seu suas seus este esta estes
+    estas esse essa esses essas isso isto aquele aquela ele ela eles elas ser
+    sao foi foram tem ter sendo pode podem cada outro outra outros outras
+    quando onde qual quais tambem ainda entao assim forma tipo ate apos the of
+    and to in is for on
+    """.split()
+)
+
+
+@contextmanager
+def _transaction(conn: PgConnection) -> Iterator[None]:
+    # conexões do pool são autocommit; aqui precisamos de atomicidade
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        yield
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+
+
+def _parse_vector(value: str) -> List[float]:
+    # pgvector sem adaptador: "[0.1,0.2,...]"
+    return [float(x) for x in value.strip("[]").split(",")]
+
+
+# ==========================
+# CLUSTERING (NumPy)
+# ==========================
+
+def _squared_distances(x: Any, centroids: Any) -> Any:
+    import numpy as np
+
+    # ||x||² - 2 x·c + ||c||², sem materializar n x k x dim
+    d = (
+        (x * x).sum(axis=1)[:, None]
+        - 2.0 * x @ centroids.T
+        + (centroids * centroids).sum(axis=1)[None, :]
+    )
+    return np.maximum(d, 0.0)
+
+
+def kmeans(
+    x: Any,
+    k: int,
+    max_iter: int = 50,
+    tol: float = 1e-4,
+    seed: int = 0,
+) -> Tuple[Any, Any]:
+    """
+    K-means (Lloyd) com inicialização k-means++.
+    Devolve (centróides k x dim, rótulo de cada linha de x).
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n = x.shape[0]
+    k = max(1, min(k, n))
+
+    # k-means++
+    centroids = np.empty((k, x.shape[1]), dtype=x.dtype)
+    centroids[0] = x[rng.integers(n)]
+    closest = _squared_distances(x, centroids[:1])[:, 0]
+    for i in range(1, k):
+        weights = closest.astype(np.float64)
+        total = weights.sum()
+        if total <= 0:
+            centroids[i] = x[rng.integers(n)]
+        else:
+            centroids[i] = x[rng.choice(n, p=weights / total)]
+        closest = np.minimum(closest, _squared_distances(x, centroids[i : i + 1])[:, 0])
+
+    labels = np.zeros(n, dtype=np.int64)
+    for _ in range(max_iter):
+        labels = _squared_distances(x, centroids).argmin(axis=1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        counts = np.bincount(labels, minlength=k).astype(x.dtype)
+
+        new_centroids = centroids.copy()
+        filled = counts > 0
+        new_centroids[filled] = sums[filled] / counts[filled, None]
+        # cluster vazio: reinicia no ponto mais mal atendido
+        for i in np.flatnonzero(~filled):
+            far = _squared_distances(x, new_centroids).min(axis=1).argmax()
+            new_centroids[i] = x[far]
+
+        shift = np.abs(new_centroids - centroids).max()
+        centroids = new_centroids
+        if shift < tol:
+            break
+
+    labels = _squared_distances(x, centroids).argmin(axis=1)
+    return centroids, labels
+
+
+def default_cluster_count(n_documents: int) -> int:
+    if settings.TAXONOMY_CLUSTERS > 0:
+        return settings.TAXONOMY_CLUSTERS
+    # regra de bolso: ~sqrt(n/2)
+    return max(1, int(round((n_documents / 2) ** 0.5)))
+
+
+# ==========================
+# RÓTULOS
+# ==========================
+
+def _tokens(text: str) -> List[str]:
+    return [
+        t
+        for t in re.findall(r"[a-z]{3,}", normalize_text(text))
+        if t not in _STOPWORDS
+    ]
+
+
+def keyword_labels(cluster_texts: List[List[str]], top_n: int = 3) -> List[str]:
+    # termos mais frequentes no cluster e raros nos demais (tf-idf por cluster)
+    counts = [Counter(t for text in texts for t in _tokens(text)) for texts in cluster_texts]
+    df: Counter = Counter()
+    for c in counts:
+        df.update(c.keys())
+    n_clusters = max(len(counts), 1)
+
+    labels: List[str] = []
+    for c in counts:
+        scored = sorted(
+            c.items(),
+            key=lambda kv: kv[1] * math.log(1 + n_clusters / df[kv[0]]),
+            reverse=True,
+        )
+        labels.append(" / ".join(term for term, _ in scored[:top_n]) or "geral")
+    return labels
+
+
+def llm_label(texts: List[str]) -> str:
+    from .config import build_groq_headers
+    from .providers import post_json
+
+    headers = build_groq_headers()
+    headers["Content-Type"] = "application/json"
+    excerpt = "\n\n---\n\n".join(t[:800] for t in texts)
+    payload = {
+        "model": settings.GROQ_CHAT_MODEL,
+        "temperature": 0.0,
+        "messages": [
+            {
+                "role": "system",
+                "content": (
+                    "Dê um nome curto (2 a 6 palavras, português do Brasil) para o "
+                    "subtema comum aos trechos. Retorne APENAS o nome."
+                ),
+            },
+            {"role": "user", "content": excerpt},
+        ],
+    }
+    data = post_json(
+        settings.GROQ_CHAT_COMPLETIONS_ENDPOINT, payload, headers=headers, timeout=60
+    )
+    return data["choices"][0]["message"]["content"].strip().strip('"').strip()
+
+
+# ==========================
+# CONSTRUÇÃO / ATUALIZAÇÃO
+# ==========================
+
+def _load_documents(
+    conn: PgConnection, only_unassigned: bool = False
+) -> Tuple[List[int], List[str], Any]:
+    import numpy as np
+
+    where = ""
+    if only_unassigned:
+        where = """
+            WHERE NOT EXISTS (
+                SELECT 1 FROM subtopic_members m WHERE m.document_id = d.id
+            )
+        """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT d.id, d.content, d.embedding::text
+            FROM documents d
+            {where}
+            {"AND" if where else "WHERE"} d.embedding IS NOT NULL
+            ORDER BY d.id;
+            """
+        )
+        rows = cur.fetchall()
+
+    ids = [r[0] for r in rows]
+    contents = [r[1] or "" for r in rows]
+    if not rows:
+        return ids, contents, np.zeros((0, settings.EMBEDDING_DIM), dtype=np.float32)
+    x = np.asarray([_parse_vector(r[2]) for r in rows], dtype=np.float32)
+    return ids, contents, x
+
+
+def build_taxonomy(
+    conn: PgConnection,
+    k: Optional[int] = None,
+    use_llm_labels: bool = False,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Reconstrói a taxonomia inteira a partir de `documents`.
+    Substitui nós, membros e aliases numa única transação.
+    """
+    import numpy as np
+
+    ids, contents, x = _load_documents(conn)
+    if not ids:
+        return {"clusters": 0, "documents": 0}
+
+    k = k or default_cluster_count(len(ids))
+    centroids, labels = kmeans(x, k, seed=seed)
+    distances = np.sqrt(
+        _squared_distances(x, centroids)[np.arange(len(ids)), labels]
+    )
+
+    clusters: List[Dict[str, Any]] = []
+    for c in range(centroids.shape[0]):
+        members = np.flatnonzero(labels == c)
+        if members.size == 0:
+            continue
+        # trechos mais próximos do centróide representam o cluster
+        order = members[np.argsort(distances[members])]
+        clusters.append(
+            {
+                "centroid": centroids[c],
+                "members": order,
+                "texts": [contents[i] for i in order[:20]],
+            }
+        )
+
+    if use_llm_labels:
+        names = [llm_label(c["texts"][:5]) for c in clusters]
+    else:
+        names = keyword_labels([c["texts"] for c in clusters])
+
+    with _transaction(conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (TAXONOMY_LOCK_ID,))
+            # aliases e membros caem em cascata
+            cur.execute("DELETE FROM subtopic_taxonomy;")
+            for cluster, label in zip(clusters, names):
+                cur.execute(
+                    """
+                    INSERT INTO subtopic_taxonomy (label, label_norm, centroid, size)
+                    VALUES (%s, %s, %s::vector, %s)
+                    RETURNING id;
+                    """,
+                    (
+                        label,
+                        normalize_text(label),
+                        embedding_to_pgvector_str(cluster["centroid"].tolist()),
+                        int(cluster["members"].size),
+                    ),
+                )
+                subtopic_id = cur.fetchone()[0]
+                cur.executemany(
+                    """
+                    INSERT INTO subtopic_members (document_id, subtopic_id, distance)
+                    VALUES (%s, %s, %s);
+                    """,
+                    [
+                        (ids[i], subtopic_id, float(distances[i]))
+                        for i in cluster["members"]
+                    ],
+                )
+
+    return {"clusters": len(clusters), "documents": len(ids)}
+
+
+def assign_new_documents(conn: PgConnection) -> int:
+    """
+    Atribuição incremental: documentos sem nó entram no centróide mais
+    próximo, e cada centróide afetado vira a média acumulada
+    (c * n + soma_novos) / (n + m). Sem taxonomia ainda, não faz nada.
+    Devolve quantos documentos foram atribuídos.
+    """
+    import numpy as np
+
+    with _transaction(conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (TAXONOMY_LOCK_ID,))
+            cur.execute(
+                "SELECT id, centroid::text, size FROM subtopic_taxonomy ORDER BY id;"
+            )
+            nodes = cur.fetchall()
+        if not nodes:
+            return 0
+
+        ids, _, x = _load_documents(conn, only_unassigned=True)
+        if not ids:
+            return 0
+
+        node_ids = [n[0] for n in nodes]
+        centroids = np.asarray([_parse_vector(n[1]) for n in nodes], dtype=np.float32)
+        sizes = np.asarray([n[2] for n in nodes], dtype=np.float32)
+
+        labels = _squared_distances(x, centroids).argmin(axis=1)
+        distances = np.sqrt(_squared_distances(x, centroids)[np.arange(len(ids)), labels])
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        added = np.bincount(labels, minlength=len(node_ids)).astype(np.float32)
+
+        with conn.cursor() as cur:
+            cur.executemany(
+                """
+                INSERT INTO subtopic_members (document_id, subtopic_id, distance)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (document_id) DO NOTHING;
+                """,
+                [
+                    (doc_id, node_ids[label], float(dist))
+                    for doc_id, label, dist in zip(ids, labels, distances)
+                ],
+            )
+            for c in np.flatnonzero(added > 0):
+                total = sizes[c] + added[c]
+                centroid = (centroids[c] * sizes[c] + sums[c]) / total
+                cur.execute(
+                    """
+                    UPDATE subtopic_taxonomy
+                    SET centroid = %s::vector,
+                        size = %s,
+                        updated_at = NOW()
+                    WHERE id = %s;
+                    """,
+                    (embedding_to_pgvector_str(centroid.tolist()), int(total), node_ids[c]),
+                )
+
+    return len(ids)
+
+
+# ==========================
+# CONSULTA (caminho da geração)
+# ==========================
+
+def has_taxonomy(conn: PgConnection) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM subtopic_taxonomy LIMIT 1;")
+        return cur.fetchone() is not None
+
+
+def map_subtemas_to_nodes(
+    conn: PgConnection, subtemas: Sequence[str]
+) -> Dict[str, int]:
+    """
+    Mapeia subtemas (texto livre da análise) para nós da taxonomia.
+    Ordem: alias já salvo -> rótulo igual -> centróide mais próximo do
+    embedding do subtema (um único lote de embeddings para os que faltam),
+    só se estiver a até TAXONOMY_MAX_CENTROID_DISTANCE. Subtema longe de
+    todos os nós fica fora do mapa (e sem alias): a geração cai na busca
+    vetorial. Devolve {subtema_norm: subtopic_id}; vazio sem taxonomia.
+    """
+    norms = sorted({normalize_text(s) for s in subtemas if normalize_text(s)})
+    if not norms or not has_taxonomy(conn):
+        return {}
+
+    mapping: Dict[str, int] = {}
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT subtema_norm, subtopic_id
+            FROM subtopic_aliases
+            WHERE subtema_norm = ANY(%s);
+            """,
+            (norms,),
+        )
+        mapping.update(dict(cur.fetchall()))
+
+        missing = [n for n in norms if n not in mapping]
+        if missing:
+            cur.execute(
+                """
+                SELECT DISTINCT ON (label_norm) label_norm, id
+                FROM subtopic_taxonomy
+                WHERE label_norm = ANY(%s)
+                ORDER BY label_norm, size DESC;
+                """,
+                (missing,),
+            )
+            mapping.update(dict(cur.fetchall()))
+
+    missing = [n for n in norms if n not in mapping]
+    if missing:
+        from .chunking import embed_texts
+
+        embeddings = embed_texts(missing)
+        max_distance = settings.TAXONOMY_MAX_CENTROID_DISTANCE
+        with conn.cursor() as cur:
+            for norm, emb in zip(missing, embeddings):
+                vector = embedding_to_pgvector_str(emb)
+                cur.execute(
+                    """
+                    SELECT id, centroid <-> %s::vector AS distance
+                    FROM subtopic_taxonomy
+                    ORDER BY centroid <-> %s::vector
+                    LIMIT 1;
+                    """,
+                    (vector, vector),
+                )
+                row = cur.fetchone()
+                if row is not None and (max_distance <= 0 or row[1] <= max_distance):
+                    mapping[norm] = row[0]
+
+    new_aliases = [(n, mapping[n]) for n in norms if n in mapping]
+    if new_aliases:
+        with conn.cursor() as cur:
+            cur.executemany(
+                """
+                INSERT INTO subtopic_aliases (subtema_norm, subtopic_id)
+                VALUES (%s, %s)
+                ON CONFLICT (subtema_norm) DO NOTHING;
+                """,
+                new_aliases,
+            )
+    return mapping
+
+
+def get_subtopic_documents(
+    conn: PgConnection,
+    subtopic_id: int,
+    k: int = 8,
+    document_ids: Optional[Sequence[int]] = None,
+) -> List[Dict[str, Any]]:
+    # trechos do nó mais próximos do centróide (mesmo formato de search_similar);
+    # document_ids restringe a um subconjunto (ex.: trechos já discutidos)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT d.id, d.content, d.metadata, m.distance
+            FROM subtopic_members m
+            JOIN documents d ON d.id = m.document_id
+            WHERE m.subtopic_id = %s
+              AND (%s::bigint[] IS NULL OR m.document_id = ANY(%s::bigint[]))
+            ORDER BY m.distance
+            LIMIT %s;
+            """,
+            (
+                subtopic_id,
+                list(document_ids) if document_ids is not None else None,
+                list(document_ids) if document_ids is not None else None,
+                k,
+            ),
+        )
+        rows = cur.fetchall()
+    return [
+        {
+            "id": doc_id,
+            "content": content,
+            "metadata": metadata,
+            "distance": float(distance),
+        }
+        for doc_id, content, metadata, distance in rows
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Taxonomia de subtemas (k-means).")
+    parser.add_argument("--k", type=int, default=None, help="número de clusters")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="só atribui documentos novos aos nós existentes",
+    )
+    parser.add_argument(
+        "--llm-labels", action="store_true", help="rotula os nós com o LLM"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from .db import get_connection
+
+    conn = get_connection()
+    try:
+        # clustering da base inteira pode passar do statement_timeout da API
+        with conn.cursor() as cur:
+            cur.execute("SET statement_timeout = 0;")
+        if args.incremental:
+            print(f"documentos atribuídos: {assign_new_documents(conn)}")
+            return
+        result = build_taxonomy(
+            conn, k=args.k, use_llm_labels=args.llm_labels, seed=args.seed
+        )
+        print(f"taxonomia: {result['clusters']} nós, {result['documents']} documentos")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
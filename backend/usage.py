@@ -0,0 +1,334 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import asyncpg
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.extras import execute_values
+
+from .config import settings
+from .metrics import provider_name
+
+# Contabilidade de tokens (e custo estimado) por chamada aos provedores.
+# - providers.post_json/post_json_async registram o campo `usage` de cada
+#   resposta no UsageRecorder ativo (contextvar); sem recorder, nada acontece
+# - quem abre o recorder decide a atribuição (conversa, turno, análise,
+#   conteúdos, ingestão) e grava tudo de uma vez em provider_usage
+# - ThreadPoolExecutor não propaga contextvars: use call_with_usage na
+#   thread do pool e devolva os registros para a thread dona da conexão
+# Custo = tokens x PROVIDER_PRICES (US$ por 1M tokens, por modelo), calculado
+# na leitura; modelos sem preço aparecem só com tokens.
+
+UsageRecord = Dict[str, Any]
+
+class UsageRecorder:
+    def __init__(self) -> None:
+        self._records: List[UsageRecord] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: UsageRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def extend(self, records: List[UsageRecord], **attrs: Any) -> None:
+        # atributos só preenchem o que o registro ainda não tem
+        with self._lock:
+            for record in records:
+                self._records.append(
+                    {**record, **{k: v for k, v in attrs.items() if record.get(k) is None}}
+                )
+
+    def drain(self) -> List[UsageRecord]:
+        with self._lock:
+            records, self._records = self._records, []
+        return records
+
+
+_current: contextvars.ContextVar[Optional[Tuple[UsageRecorder, Dict[str, Any]]]] = (
+    contextvars.ContextVar("usage_recorder", default=None)
+)
+
+
+@contextmanager
+def recording(
+    recorder: Optional[UsageRecorder] = None, **attrs: Any
+) -> Iterator[Optional[UsageRecorder]]:
+    """
+    Ativa um recorder (ou só refina os atributos do atual, se recorder=None)
+    para as chamadas feitas dentro do bloco.
+    """
+    current = _current.get()
+    if recorder is None:
+        if current is None:
+            yield None
+            return
+        recorder, parent_attrs = current
+        attrs = {**parent_attrs, **attrs}
+    token = _current.set((recorder, attrs))
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+def _operation(url: str) -> str:
+    path = urlparse(url).path.rstrip("/")
+    if path.endswith("/embeddings"):
+        return "embedding"
+    if path.endswith("/chat/completions"):
+        return "chat"
+    if "/audio/" in path:
+        return "transcription"
+    return path.rsplit("/", 1)[-1] or "desconhecida"
+
+
+def record_usage(url: str, model: Optional[str], usage: Optional[Dict[str, Any]]) -> None:
+    current = _current.get()
+    if current is None or not isinstance(usage, dict):
+        return
+    recorder, attrs = current
+    prompt = int(usage.get("prompt_tokens") or usage.get("input_tokens") or 0)
+    completion = int(usage.get("completion_tokens") or usage.get("output_tokens") or 0)
+    total = int(usage.get("total_tokens") or prompt + completion)
+    recorder.add(
+        {
+            **attrs,
+            "provider": provider_name(url),
+            "model": model or "",
+            "operation": _operation(url),
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": total,
+        }
+    )
+
+
+def call_with_usage(
+    fn: Callable[..., Any], *args: Any, **kwargs: Any
+) -> Tuple[Any, List[UsageRecord]]:
+    # para threads de pool: roda fn com um recorder próprio e devolve os registros
+    recorder = UsageRecorder()
+    with recording(recorder):
+        result = fn(*args, **kwargs)
+    return result, recorder.drain()
+
+
+def forward_usage(records: List[UsageRecord], **attrs: Any) -> None:
+    # repassa registros coletados em outra thread para o recorder ativo
+    current = _current.get()
+    if current is None or not records:
+        return
+    recorder, parent_attrs = current
+    recorder.extend(records, **{**parent_attrs, **attrs})
+
+
+def _rows(records: List[UsageRecord], attrs: Dict[str, Any]) -> List[Tuple[Any, ...]]:
+    rows = []
+    for record in records:
+        merged = {**attrs, **{k: v for k, v in record.items() if v is not None}}
+        content_ids = merged.get("content_ids")
+        rows.append(
+            (
+                merged.get("kind") or "outro",
+                merged.get("conversation_id"),
+                merged.get("turn_index"),
+                merged.get("analysis_id"),
+                list(content_ids) if content_ids else None,
+                merged.get("ingestion_id"),
+                merged["provider"],
+                merged["model"],
+                merged["operation"],
+                merged["prompt_tokens"],
+                merged["completion_tokens"],
+                merged["total_tokens"],
+            )
+        )
+    return rows
+
+
+_INSERT_COLUMNS = """
+    kind, conversation_id, turn_index, analysis_id, content_ids, ingestion_id,
+    provider, model, operation, prompt_tokens, completion_tokens, total_tokens
+"""
+
+
+def save_usage(conn: PgConnection, records: List[UsageRecord], **attrs: Any) -> int:
+    if not records:
+        return 0
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            f"INSERT INTO provider_usage ({_INSERT_COLUMNS}) VALUES %s;",
+            _rows(records, attrs),
+        )
+    return len(records)
+
+
+async def save_usage_async(
+    conn: asyncpg.Connection, records: List[UsageRecord], **attrs: Any
+) -> int:
+    if not records:
+        return 0
+    await conn.executemany(
+        f"""
+        INSERT INTO provider_usage ({_INSERT_COLUMNS})
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12);
+        """,
+        _rows(records, attrs),
+    )
+    return len(records)
+
+
+# ==========================
+# LEITURA
+# ==========================
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    price = settings.PROVIDER_PRICES.get(model)
+    if not price:
+        return None
+    return round(
+        (prompt_tokens * float(price.get("input", 0))
+         + completion_tokens * float(price.get("output", 0))) / 1_000_000,
+        6,
+    )
+
+
+def _summarize(rows: List[Tuple[Any, ...]], keys: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    # rows: (*keys, model, calls, prompt, completion, total)
+    out: List[Dict[str, Any]] = []
+    for row in rows:
+        *key_values, model, calls, prompt, completion, total = row
+        item = dict(zip(keys, key_values))
+        item.update(
+            {
+                "model": model,
+                "calls": calls,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "total_tokens": total,
+                "cost_usd": estimate_cost(model, prompt, completion),
+            }
+        )
+        out.append(item)
+    return out
+
+
+def _totals(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    costs = [i["cost_usd"] for i in items if i["cost_usd"] is not None]
+    return {
+        "calls": sum(i["calls"] for i in items),
+        "prompt_tokens": sum(i["prompt_tokens"] for i in items),
+        "completion_tokens": sum(i["completion_tokens"] for i in items),
+        "total_tokens": sum(i["total_tokens"] for i in items),
+        "cost_usd": round(sum(costs), 6) if costs else None,
+    }
+
+
+def get_conversation_usage(conn: PgConnection, conversation_id: int) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT kind, model, COUNT(*), SUM(prompt_tokens),
+                   SUM(completion_tokens), SUM(total_tokens)
+            FROM provider_usage
+            WHERE conversation_id = %s
+            GROUP BY kind, model
+            ORDER BY kind, model;
+            """,
+            (conversation_id,),
+        )
+        by_kind = _summarize(cur.fetchall(), ("kind",))
+
+        # prompt por turno: mostra quanto o contexto do chat cresce
+        cur.execute(
+            """
+            SELECT turn_index, model, COUNT(*), SUM(prompt_tokens),
+                   SUM(completion_tokens), SUM(total_tokens)
+            FROM provider_usage
+            WHERE conversation_id = %s
+              AND turn_index IS NOT NULL
+            GROUP BY turn_index, model
+            ORDER BY turn_index, model;
+            """,
+            (conversation_id,),
+        )
+        by_turn = _summarize(cur.fetchall(), ("turn_index",))
+
+        cur.execute(
+            """
+            SELECT analysis_id, model, COUNT(*), SUM(prompt_tokens),
+                   SUM(completion_tokens), SUM(total_tokens)
+            FROM provider_usage
+            WHERE conversation_id = %s
+              AND analysis_id IS NOT NULL
+            GROUP BY analysis_id, model
+            ORDER BY analysis_id, model;
+            """,
+            (conversation_id,),
+        )
+        by_analysis = _summarize(cur.fetchall(), ("analysis_id",))
+
+    return {
+        "conversation_id": conversation_id,
+        "totals": _totals(by_kind),
+        "by_kind": by_kind,
+        "by_turn": by_turn,
+        "by_analysis": by_analysis,
+    }
+
+
+_GROUPS = {
+    "kind": "kind",
+    "operation": "provider || ':' || operation",
+    "day": "to_char(date_trunc('day', created_at), 'YYYY-MM-DD')",
+}
+
+
+def get_usage_summary(
+    conn: PgConnection,
+    group_by: str = "kind",
+    days: int = 7,
+) -> Dict[str, Any]:
+    if group_by not in _GROUPS:
+        raise ValueError(f"group_by inválido: {group_by} (use {', '.join(_GROUPS)}).")
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT {_GROUPS[group_by]} AS grp, model, COUNT(*), SUM(prompt_tokens),
+                   SUM(completion_tokens), SUM(total_tokens)
+            FROM provider_usage
+            WHERE created_at >= NOW() - make_interval(days => %s)
+            GROUP BY grp, model
+            ORDER BY grp, model;
+            """,
+            (days,),
+        )
+        items = _summarize(cur.fetchall(), (group_by,))
+
+        # custo médio por conversa/ingestão: base para ajustar top_k,
+        # tamanho de chunk e janela de histórico
+        cur.execute(
+            """
+            SELECT
+                COUNT(DISTINCT conversation_id),
+                COUNT(DISTINCT ingestion_id),
+                COALESCE(AVG(prompt_tokens) FILTER (WHERE kind = 'chat' AND operation = 'chat'), 0)
+            FROM provider_usage
+            WHERE created_at >= NOW() - make_interval(days => %s);
+            """,
+            (days,),
+        )
+        conversations, ingestions, avg_chat_prompt = cur.fetchone()
+
+    return {
+        "days": days,
+        "group_by": group_by,
+        "totals": _totals(items),
+        "conversations": conversations,
+        "ingestions": ingestions,
+        "avg_chat_prompt_tokens": float(avg_chat_prompt),
+        "items": items,
+    }
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+
+# Aquecimento em background ao subir a API.
+# O processo começa a aceitar conexões imediatamente (liveness) e só fica
+# "pronto" (readiness) depois de migrar o schema e abrir os pools.
+# O caminho de embedding da pergunta é aquecido em paralelo, sem bloquear
+# a prontidão (queda do provedor não deve tirar a instância do balanceador).
+
+
+class StartupState:
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.ready_after_seconds: Optional[float] = None
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.embedding_warm = False
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        self.last_error = None
+        self.ready_after_seconds = round(time.monotonic() - self.started_at, 3)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "ready_after_seconds": self.ready_after_seconds,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "embedding_warm": self.embedding_warm,
+        }
+
+
+startup_state = StartupState()
+
+# referência forte às tasks em background (o loop só guarda referência fraca)
+_background_tasks: set = set()
+
+
+def _prepare_database() -> None:
+    from .db import init_db, pooled_connection
+
+    if settings.MIGRATE_ON_STARTUP:
+        # conexão avulsa e sem instrumentação: o advisory lock da migração
+        # é de sessão e não pode ficar preso numa conexão do pool
+        init_db()
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+
+
+async def _warm_embedding() -> None:
+    from .chunking import embed_texts_async
+
+    try:
+        await embed_texts_async(["aquecimento"])
+        startup_state.embedding_warm = True
+    except Exception:
+        # best-effort: a primeira pergunta real abre a conexão
+        pass
+
+
+async def warm_up() -> None:
+    if settings.WARMUP_EMBEDDING:
+        task = asyncio.create_task(_warm_embedding())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    from .db_async import get_async_pool
+
+    # banco pode ainda estar subindo (compose/k8s): tenta até conseguir
+    while True:
+        startup_state.attempts += 1
+        try:
+            await run_in_threadpool(_prepare_database)
+            await get_async_pool()
+            startup_state.mark_ready()
+            return
+        except Exception as e:
+            startup_state.last_error = f"{type(e).__name__}: {e}"
+            await asyncio.sleep(settings.WARMUP_RETRY_SECONDS)
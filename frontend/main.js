@@ -4,11 +4,15 @@
 let conversationId = null;
 let preferredFormat = null; // "video" | "audio" | "texto" | null
 
-// contador de alterações no chat
+// revisão do chat (nº de turnos no servidor)
 let chatRevision = 0;
+// último turno já renderizado no chat-box
+let renderedRevision = 0;
 // última revisão analisada/gerada
 let lastAnalyzedRevision = null;
 let lastAnalyzedConversationId = null;
+// ETag da última leitura de /contents
+let contentsEtag = null;
 
 let isAnalyzing = false; // evita flood de chamadas
 
@@ -88,6 +92,31 @@ function appendMessage(role, text) {
   bubble.textContent = text;
   chatBox.appendChild(bubble);
   chatBox.scrollTop = chatBox.scrollHeight;
+  return bubble;
+}
+
+// renderiza um turno vindo do servidor (ignora os já renderizados)
+function mergeTurn(turn) {
+  if (turn.index <= renderedRevision) return;
+  appendMessage("user", turn.pergunta);
+  appendMessage("assistant", turn.resposta);
+  renderedRevision = turn.index;
+}
+
+// busca (paginado) os turnos que ainda não estão na tela
+async function syncHistory() {
+  if (!conversationId) return;
+  let after = renderedRevision;
+  while (after !== null) {
+    const resp = await fetch(
+      `/api/conversation/${conversationId}/history?after=${after}&limit=50`
+    );
+    if (!resp.ok) throw new Error("history " + resp.status);
+    const page = await resp.json();
+    page.turns.forEach(mergeTurn);
+    chatRevision = page.revision;
+    after = page.next_after;
+  }
 }
 
 function updatePreferredFormatLabel() {
@@ -117,19 +146,44 @@ async function ensureConversationStarted() {
   });
   const data = await resp.json();
   conversationId = data.conversation_id;
+  sessionStorage.setItem("conversationId", String(conversationId));
   convLabel.textContent = "Conversa iniciada";
   // nova conversa => nenhuma análise ainda
+  chatRevision = 0;
+  renderedRevision = 0;
   lastAnalyzedRevision = null;
   lastAnalyzedConversationId = null;
+  contentsEtag = null;
 }
 
+// Recarregou a página: retoma a conversa da aba (sessionStorage)
+async function restoreConversation() {
+  const stored = sessionStorage.getItem("conversationId");
+  if (!stored) return;
+  conversationId = Number(stored);
+  try {
+    await syncHistory();
+    convLabel.textContent = "Conversa retomada";
+  } catch (err) {
+    console.error(err);
+    // conversa não existe mais -> começa do zero na próxima mensagem
+    sessionStorage.removeItem("conversationId");
+    conversationId = null;
+    chatBox.innerHTML = "";
+    chatRevision = 0;
+    renderedRevision = 0;
+  }
+}
+
+restoreConversation();
+
 chatForm.addEventListener("submit", async (e) => {
   e.preventDefault();
   const text = chatInput.value.trim();
   if (!text) return;
 
   chatStatus.textContent = "";
-  appendMessage("user", text);
+  const pendingBubble = appendMessage("user", text);
   chatInput.value = "";
   chatStatus.textContent = "Enviando...";
 
@@ -148,11 +202,20 @@ chatForm.addEventListener("submit", async (e) => {
     });
     const data = await resp.json();
     conversationId = data.conversation_id;
-    appendMessage("assistant", data.answer);
+
+    if (data.turn.index === renderedRevision + 1) {
+      // caso normal: a pergunta já está na tela, só falta a resposta
+      appendMessage("assistant", data.answer);
+      renderedRevision = data.turn.index;
+    } else {
+      // turnos feitos em outro lugar -> busca o que falta, na ordem
+      pendingBubble.remove();
+      await syncHistory();
+    }
     chatStatus.textContent = "";
 
-    // Houve uma nova interação no chat -> incrementa revisão
-    chatRevision += 1;
+    // Houve uma nova interação no chat -> revisão vem do servidor
+    chatRevision = Math.max(chatRevision, data.revision);
   } catch (err) {
     console.error(err);
     chatStatus.textContent = "Erro ao enviar mensagem.";
@@ -217,14 +280,142 @@ function shouldReanalyze() {
   return false;
 }
 
+function renderContentCard(c) {
+  const card = document.createElement("article");
+  card.className =
+    "border border-slate-200 bg-slate-50 rounded-xl p-3 flex flex-col gap-2 text-sm";
+  const badge = document.createElement("span");
+  badge.className =
+    "inline-flex items-center px-2 py-0.5 rounded-full text-[10px] font-medium bg-slate-800 text-white w-fit";
+  badge.textContent = `${c.content_type.toUpperCase()} • ${c.subtema}`;
+  const title = document.createElement("h3");
+  title.className = "font-semibold text-slate-800 text-sm";
+  title.textContent = c.title || "(sem título)";
+  const script = document.createElement("p");
+  script.className = "text-slate-700 whitespace-pre-wrap text-xs";
+  script.textContent = c.script || "";
+  card.appendChild(badge);
+  card.appendChild(title);
+  card.appendChild(script);
+  contentsBox.appendChild(card);
+}
+
+function setStudyStatus(html) {
+  let status = document.getElementById("study-status");
+  if (!status) {
+    status = document.createElement("p");
+    status.id = "study-status";
+    status.className = "text-sm text-slate-500 md:col-span-2";
+    contentsBox.prepend(status);
+  }
+  status.innerHTML = html;
+}
+
+// acompanha o job via SSE; cada conteúdo aparece assim que é salvo
+function followAnalysisJob(jobId) {
+  return new Promise((resolve, reject) => {
+    let received = 0;
+    let failed = 0;
+    const source = new EventSource(`/api/jobs/${jobId}/events`);
+
+    source.addEventListener("content", (ev) => {
+      renderContentCard(JSON.parse(ev.data));
+      received += 1;
+    });
+
+    source.addEventListener("status", (ev) => {
+      const st = JSON.parse(ev.data);
+      if (st.stage === "analyzing") {
+        setStudyStatus("Analisando a conversa...");
+      } else if (st.stage === "generating") {
+        setStudyStatus("Gerando conteúdos personalizados...");
+      }
+      failed = (st.failures || []).length;
+      if (failed) {
+        setStudyStatus(`${failed} conteúdo(s) não puderam ser gerados.`);
+      }
+    });
+
+    source.addEventListener("end", (ev) => {
+      source.close();
+      const end = JSON.parse(ev.data);
+      if (end.status === "failed") {
+        reject(new Error("job falhou"));
+        return;
+      }
+      if (!received && !failed) {
+        setStudyStatus("Nenhum conteúdo gerado.");
+      } else if (!failed) {
+        document.getElementById("study-status")?.remove();
+      }
+      resolve();
+    });
+
+    source.onerror = () => {
+      // EventSource reconecta sozinho (com Last-Event-ID); só desiste
+      // se a conexão foi fechada de vez
+      if (source.readyState === EventSource.CLOSED) {
+        reject(new Error("stream encerrado"));
+      }
+    };
+  });
+}
+
+// Conteúdos já salvos no servidor (recarregou a página / outro dispositivo).
+// Devolve o corpo de /contents, ou null se nada mudou (304).
+async function loadStoredContents() {
+  const headers = contentsEtag ? { "If-None-Match": contentsEtag } : {};
+  const resp = await fetch(`/api/conversation/${conversationId}/contents`, {
+    headers,
+  });
+  if (resp.status === 304) return null;
+  if (!resp.ok) throw new Error("contents " + resp.status);
+  contentsEtag = resp.headers.get("ETag");
+  const data = await resp.json();
+
+  chatRevision = Math.max(chatRevision, data.revision);
+  if (data.analysis_id !== null && !data.active_job) {
+    contentsBox.innerHTML = "";
+    data.contents.forEach(renderContentCard);
+    if (!data.contents.length) setStudyStatus("Nenhum conteúdo gerado.");
+    lastAnalyzedConversationId = conversationId;
+    lastAnalyzedRevision = data.analyzed_revision;
+  }
+  return data;
+}
+
 async function maybeTriggerAnalysisOnStudyTab() {
-  // Se não precisa re-analisar, só deixa os conteúdos já renderizados
+  // Sem análise conhecida nesta aba: pergunta ao servidor antes de gerar
+  if (
+    conversationId &&
+    !isAnalyzing &&
+    lastAnalyzedConversationId !== conversationId
+  ) {
+    try {
+      const stored = await loadStoredContents();
+      if (stored && stored.active_job) {
+        // já tem job rodando (outra aba/dispositivo): só acompanha
+        isAnalyzing = true;
+        contentsBox.innerHTML = "";
+        setStudyStatus("Gerando conteúdos personalizados...");
+        try {
+          await followAnalysisJob(stored.active_job.job_id);
+          lastAnalyzedConversationId = conversationId;
+          lastAnalyzedRevision = stored.revision;
+        } finally {
+          isAnalyzing = false;
+        }
+      }
+    } catch (err) {
+      console.error(err);
+    }
+  }
+
+  // Só gera de novo se houve turnos novos desde a última análise
   if (!shouldReanalyze()) {
     return;
   }
 
-  contentsBox.innerHTML = "";
-
   if (!conversationId) {
     contentsBox.innerHTML =
       '<p class="text-sm text-slate-500">Nenhuma conversa encontrada. Vá para a aba Chat, converse um pouco e volte para Estudar.</p>';
@@ -236,8 +427,9 @@ async function maybeTriggerAnalysisOnStudyTab() {
   }
 
   isAnalyzing = true;
-  contentsBox.innerHTML =
-    '<p class="text-sm text-slate-500">Gerando conteúdos personalizados...</p>';
+  const analyzedRevision = chatRevision;
+  contentsBox.innerHTML = "";
+  setStudyStatus("Gerando conteúdos personalizados...");
 
   try {
     const resp = await fetch(
@@ -250,42 +442,17 @@ async function maybeTriggerAnalysisOnStudyTab() {
         }),
       }
     );
-    const data = await resp.json();
+    if (!resp.ok) throw new Error("analyze " + resp.status);
+    const job = await resp.json();
 
-    const contents = data.contents || [];
-    if (!contents.length) {
-      contentsBox.innerHTML =
-        '<p class="text-sm text-slate-500">Nenhum conteúdo gerado.</p>';
-    } else {
-      contentsBox.innerHTML = "";
-      for (const c of contents) {
-        const card = document.createElement("article");
-        card.className =
-          "border border-slate-200 bg-slate-50 rounded-xl p-3 flex flex-col gap-2 text-sm";
-        const badge = document.createElement("span");
-        badge.className =
-          "inline-flex items-center px-2 py-0.5 rounded-full text-[10px] font-medium bg-slate-800 text-white w-fit";
-        badge.textContent = `${c.content_type.toUpperCase()} • ${c.subtema}`;
-        const title = document.createElement("h3");
-        title.className = "font-semibold text-slate-800 text-sm";
-        title.textContent = c.title || "(sem título)";
-        const script = document.createElement("p");
-        script.className = "text-slate-700 whitespace-pre-wrap text-xs";
-        script.textContent = c.script || "";
-        card.appendChild(badge);
-        card.appendChild(title);
-        card.appendChild(script);
-        contentsBox.appendChild(card);
-      }
-    }
+    await followAnalysisJob(job.job_id);
 
     // Marca que essa conversa + revisão já foi analisada
     lastAnalyzedConversationId = conversationId;
-    lastAnalyzedRevision = chatRevision;
+    lastAnalyzedRevision = analyzedRevision;
   } catch (err) {
     console.error(err);
-    contentsBox.innerHTML =
-      '<p class="text-sm text-red-500">Erro ao gerar conteúdos.</p>';
+    setStudyStatus('<span class="text-red-500">Erro ao gerar conteúdos.</span>');
   } finally {
     isAnalyzing = false;
   }
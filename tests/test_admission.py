@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from backend import admission
+from backend.admission import Limiter, Overloaded
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(monkeypatch):
+    monkeypatch.setattr(admission, "_waiters", admission.deque())
+    monkeypatch.setattr(admission, "LIMITERS", {})
+
+
+def test_timeout_after_wake_releases_reserved_slot(monkeypatch):
+    limiter = Limiter("ingest", limit=1, max_queue=1, wait_seconds=1)
+    admission.LIMITERS["ingest"] = limiter
+
+    async def scenario():
+        limiter._start()  # vaga ocupada: a próxima request entra na fila
+        real_wait_for = asyncio.wait_for
+
+        async def wake_then_time_out(future, timeout):
+            # a vaga é liberada e reservada para a request na fila, mas o
+            # prazo estoura antes de ela retomar
+            limiter.release(1.0)
+            assert future.done() and not future.cancelled()
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(admission.asyncio, "wait_for", wake_then_time_out)
+        try:
+            with pytest.raises(Overloaded) as error:
+                await limiter.acquire()
+        finally:
+            monkeypatch.setattr(admission.asyncio, "wait_for", real_wait_for)
+        assert error.value.reason == "timeout"
+
+    asyncio.run(scenario())
+    assert limiter.in_flight == 0
+    assert limiter.waiting == 0
+
+
+def test_timeout_in_queue_rejects_with_503():
+    limiter = Limiter("analyze", limit=1, max_queue=1, wait_seconds=0.01)
+    admission.LIMITERS["analyze"] = limiter
+
+    async def scenario():
+        limiter._start()
+        with pytest.raises(Overloaded) as error:
+            await limiter.acquire()
+        assert error.value.status_code == 503
+        limiter.release(0)
+
+    asyncio.run(scenario())
+    assert limiter.in_flight == 0
+    assert limiter.waiting == 0
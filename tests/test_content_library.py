@@ -0,0 +1,45 @@
+from backend import content_generation, content_library
+from backend.config import settings
+
+ITEM = {
+    "subtopic_id": 3,
+    "subtema": "derivadas",
+    "nivel": "básico",
+    "content_types": ["video", "audio", "texto"],
+    "context": "trechos",
+}
+
+
+def script(content_type: str) -> dict:
+    return {"title": content_type, "script": f"roteiro {content_type}"}
+
+
+def test_generate_item_reports_mode_per_format(monkeypatch):
+    monkeypatch.setattr(settings, "CONTENT_MULTI_FORMAT", True)
+    # a chamada multi-formato só devolve parte dos formatos
+    monkeypatch.setattr(
+        content_generation,
+        "generate_multi_format_scripts_with_groq",
+        lambda content_types, **kw: {ct: script(ct) for ct in content_types[:2]},
+    )
+    monkeypatch.setattr(
+        content_generation,
+        "generate_learning_script_with_groq",
+        lambda content_type, **kw: script(content_type),
+    )
+
+    scripts, modes = content_library._generate_item(ITEM)
+    assert set(scripts) == {"video", "audio", "texto"}
+    assert modes == {"video": "multi", "audio": "multi", "texto": "single"}
+
+
+def test_generate_item_single_when_multi_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "CONTENT_MULTI_FORMAT", False)
+    monkeypatch.setattr(
+        content_generation,
+        "generate_learning_script_with_groq",
+        lambda content_type, **kw: script(content_type),
+    )
+
+    _, modes = content_library._generate_item(ITEM)
+    assert set(modes.values()) == {"single"}
@@ -0,0 +1,66 @@
+import asyncio
+
+from backend import conversation_memory
+from backend.config import settings
+
+TURNS = [{"pergunta": f"p{i}", "resposta": f"r{i}"} for i in range(6)]
+
+
+class FakeConnection:
+    def __init__(self, db: dict) -> None:
+        self.db = db
+
+    async def execute(self, sql: str, summary, summarized, conversation_id, previous):
+        if self.db["summarized_turns"] != previous:
+            return "UPDATE 0"
+        self.db.update(summary=summary, summarized_turns=summarized)
+        return "UPDATE 1"
+
+
+class FakePool:
+    def __init__(self, db: dict) -> None:
+        self.db = db
+
+    def acquire(self) -> "FakePool":
+        return self
+
+    async def __aenter__(self) -> FakeConnection:
+        return FakeConnection(self.db)
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+
+def test_slower_fold_does_not_roll_back_summary(monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_RECENT_TURNS", 2)
+    monkeypatch.setattr(settings, "MEMORY_SUMMARY_BATCH", 1)
+
+    async def summarize(previous_summary, turns, start_index):
+        return f"resumo até {start_index + len(turns) - 1}"
+
+    monkeypatch.setattr(conversation_memory, "summarize_turns_with_groq", summarize)
+    # outro turno já dobrou até o turno 5
+    db = {"summary": "resumo até 5", "summarized_turns": 5}
+
+    # este turno leu summarized_turns = 0 antes da outra gravação
+    result = asyncio.run(
+        conversation_memory.update_conversation_memory(FakePool(db), 1, TURNS, "", 0)
+    )
+    assert result == ("", 0)
+    assert db == {"summary": "resumo até 5", "summarized_turns": 5}
+
+
+def test_fold_saves_when_unchanged(monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_RECENT_TURNS", 2)
+    monkeypatch.setattr(settings, "MEMORY_SUMMARY_BATCH", 1)
+
+    async def summarize(previous_summary, turns, start_index):
+        return "novo"
+
+    monkeypatch.setattr(conversation_memory, "summarize_turns_with_groq", summarize)
+    db = {"summary": "", "summarized_turns": 0}
+    result = asyncio.run(
+        conversation_memory.update_conversation_memory(FakePool(db), 1, TURNS, "", 0)
+    )
+    assert result == ("novo", 4)
+    assert db == {"summary": "novo", "summarized_turns": 4}
@@ -0,0 +1,106 @@
+import time
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+from backend import db
+from backend.config import settings
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection") -> None:
+        self.conn = conn
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, sql: str) -> None:
+        self.conn.pings += 1
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.closed = 0
+        self.broken = False
+        self.pings = 0
+        self.autocommit = False
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def close(self) -> None:
+        self.closed = 1
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    conns = []
+
+    def connect(*args, **kwargs):
+        conn = FakeConnection()
+        conns.append(conn)
+        return conn
+
+    monkeypatch.setattr(psycopg2.pool.psycopg2, "connect", connect)
+    monkeypatch.setattr(settings, "DB_POOL_CHECK_IDLE_SECONDS", 30)
+    monkeypatch.setattr(settings, "DB_POOL_TIMEOUT", 1)
+    return conns
+
+
+def age(pool: db.ConnectionPool, conn: FakeConnection) -> None:
+    pool._last_used[id(conn)] = time.monotonic() - 60
+
+
+def test_fresh_connection_is_not_pinged(opened):
+    pool = db.ConnectionPool(1, 3)
+    conn = pool.getconn()
+    assert conn is opened[0]
+    assert conn.pings == 0
+    pool.putconn(conn)
+
+
+def test_broken_replacement_is_checked_too(opened):
+    pool = db.ConnectionPool(2, 3)
+    for conn in opened:
+        conn.broken = True
+        age(pool, conn)
+
+    conn = pool.getconn()
+    # as duas ociosas quebradas foram descartadas; a nova não leva ping
+    assert conn is opened[2]
+    assert all(old.closed for old in opened[:2])
+    assert conn.pings == 0
+    assert pool.stats()["broken_replaced"] == 2
+    pool.putconn(conn)
+    assert pool.stats()["in_use"] == 0
+
+
+def test_idle_connection_is_pinged(opened):
+    pool = db.ConnectionPool(1, 3)
+    age(pool, opened[0])
+    conn = pool.getconn()
+    assert conn is opened[0]
+    assert conn.pings == 1
+    pool.putconn(conn)
+
+
+def test_returned_connections_stay_idle_up_to_max(opened):
+    pool = db.ConnectionPool(1, 3)
+    first = pool.getconn()
+    second = pool.getconn()
+    assert len(opened) == 2
+    pool.putconn(first)
+    pool.putconn(second)
+    assert not first.closed and not second.closed
+
+    again = {id(pool.getconn()), id(pool.getconn())}
+    assert again == {id(first), id(second)}
+    assert len(opened) == 2
@@ -0,0 +1,47 @@
+from backend import jobs
+from backend.jobs import JOB_FAILED, JOB_RUNNING, STALE_JOB_ERROR
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection") -> None:
+        self.conn = conn
+        self.rowcount = 0
+
+    def __enter__(self) -> "FakeCursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, sql: str, params=None) -> None:
+        self.conn.statements.append(sql)
+        if sql.lstrip().startswith("UPDATE"):
+            self.rowcount = 1 if self.conn.stale else 0
+
+    def fetchone(self):
+        return (7, JOB_RUNNING, "generating", None, None, None, self.conn.stale)
+
+
+class FakeConnection:
+    def __init__(self, stale: bool) -> None:
+        self.stale = stale
+        self.statements = []
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+
+def test_stale_running_job_is_failed_on_read():
+    conn = FakeConnection(stale=True)
+    job = jobs.get_analysis_job(conn, 1)
+    assert job["status"] == JOB_FAILED
+    assert job["error"] == STALE_JOB_ERROR
+    assert any(sql.lstrip().startswith("UPDATE") for sql in conn.statements)
+
+
+def test_live_job_is_read_without_writing():
+    conn = FakeConnection(stale=False)
+    job = jobs.get_analysis_job(conn, 1)
+    assert job["status"] == JOB_RUNNING
+    assert job["error"] is None
+    assert len(conn.statements) == 1
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.config import settings
+from backend.profiling import ProfiledRoute, ProfilingMiddleware, profile_path
+
+ADMIN = "segredo"
+
+
+def busy_sync_work(seconds: float) -> int:
+    total = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        total += 1
+    return total
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", ADMIN)
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "PROFILE_INTERVAL_MS", 2)
+
+    app = FastAPI()
+    app.router.route_class = ProfiledRoute
+    app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/sync")
+    def sync_route(seconds: float = 0.2):
+        return {"total": busy_sync_work(seconds)}
+
+    return TestClient(app)
+
+
+def test_sync_route_is_sampled_in_threadpool(client):
+    response = client.get(
+        "/sync", headers={"X-Profile": "1", "Authorization": f"Bearer {ADMIN}"}
+    )
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+
+    folded = profile_path(profile_id).read_text(encoding="utf-8")
+    assert "busy_sync_work" in folded
+    assert "sync_route" in folded
+
+
+def test_sync_route_keeps_query_params(client):
+    # o wrapper preserva a assinatura que o FastAPI inspeciona
+    response = client.get("/sync", params={"seconds": 0})
+    assert response.status_code == 200
+    assert response.headers.get("x-profile-id") is None
@@ -0,0 +1,249 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from backend import providers
+from backend.config import settings
+from backend.providers import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    BudgetExceeded,
+    CircuitBreaker,
+    CircuitOpen,
+)
+
+URL = "http://mock.local/openai/v1/chat/completions"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(settings, "CIRCUIT_BREAKER", True)
+    monkeypatch.setattr(settings, "CIRCUIT_WINDOW", 10)
+    monkeypatch.setattr(settings, "CIRCUIT_MIN_CALLS", 4)
+    monkeypatch.setattr(settings, "CIRCUIT_ERROR_RATE", 0.5)
+    monkeypatch.setattr(settings, "CIRCUIT_OPEN_SECONDS", 30)
+    monkeypatch.setattr(settings, "PROVIDER_MAX_RETRIES", 0)
+    monkeypatch.setattr(providers, "_breakers", {})
+    monkeypatch.setattr(providers, "_buckets", {})
+    monkeypatch.setattr(providers, "_trackers", {})
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(settings.CIRCUIT_MIN_CALLS):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == CIRCUIT_OPEN
+
+
+def expire(breaker: CircuitBreaker) -> None:
+    breaker.opened_at = time.monotonic() - settings.CIRCUIT_OPEN_SECONDS - 1
+
+
+# ==========================
+# CIRCUIT BREAKER
+# ==========================
+def test_opens_at_error_rate_after_min_calls():
+    breaker = CircuitBreaker("groq", "m")
+    breaker.record(False)
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == CIRCUIT_CLOSED  # 3 chamadas < CIRCUIT_MIN_CALLS
+    breaker.record(False)
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+
+
+def test_rate_limit_is_neutral():
+    breaker = CircuitBreaker("groq", "m")
+    for _ in range(10):
+        breaker.record(None)
+    assert breaker.state == CIRCUIT_CLOSED
+    assert len(breaker.outcomes) == 0
+
+
+def test_half_open_single_probe_then_close():
+    breaker = CircuitBreaker("groq", "m")
+    open_breaker(breaker)
+    expire(breaker)
+    assert breaker.allow()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert not breaker.allow()  # só uma sonda por vez
+    breaker.record(True)
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = CircuitBreaker("groq", "m")
+    open_breaker(breaker)
+    expire(breaker)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+
+
+def test_neutral_probe_releases_slot():
+    breaker = CircuitBreaker("groq", "m")
+    open_breaker(breaker)
+    expire(breaker)
+    assert breaker.allow()
+    breaker.record(None)
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert breaker.allow()
+
+
+# ==========================
+# TOKEN BUCKET
+# ==========================
+def test_daily_limit_header_does_not_grow_burst():
+    bucket = providers.TokenBucket(rate=5, capacity=10)
+    bucket.update_from_headers(
+        {
+            "x-ratelimit-limit-requests": "14400",
+            "x-ratelimit-remaining-requests": "14399",
+            "x-ratelimit-reset-requests": "6s",
+        }
+    )
+    assert bucket.capacity == 10
+    assert bucket.tokens <= 10
+    assert bucket.rate == pytest.approx(14400 / 86400.0)
+
+
+def test_exhausted_header_blocks_until_reset():
+    bucket = providers.TokenBucket(rate=5, capacity=10)
+    bucket.update_from_headers(
+        {
+            "x-ratelimit-limit-requests": "30",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "2s",
+        }
+    )
+    assert bucket.capacity == 10
+    assert not bucket.has_capacity()
+    assert bucket.reserve() >= 1.5
+
+
+# ==========================
+# post(): sonda nunca fica presa
+# ==========================
+class FakeResponse:
+    def __init__(self, status: int = 200) -> None:
+        self.status_code = status
+        self.headers = {}
+
+    def json(self):
+        return {"choices": [], "usage": None}
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+
+class FakeSession:
+    def __init__(self, handler) -> None:
+        self.handler = handler
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        return self.handler(self.calls, kwargs)
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = providers.get_breaker("mock.local", "m")
+    open_breaker(breaker)
+    expire(breaker)
+    return breaker
+
+
+def test_budget_exceeded_before_send_does_not_take_probe(monkeypatch):
+    breaker = half_open_breaker()
+    session = FakeSession(lambda n, kw: FakeResponse(200))
+    monkeypatch.setattr(providers, "get_session", lambda: session)
+    # espera de rate limit maior que o orçamento
+    monkeypatch.setattr(providers.TokenBucket, "reserve", lambda self: 5.0)
+
+    with pytest.raises(BudgetExceeded):
+        providers.post(URL, model="m", json={}, budget=1.0)
+    assert session.calls == 0
+    assert not breaker.probe_in_flight
+
+    monkeypatch.setattr(providers.TokenBucket, "reserve", lambda self: 0.0)
+    providers.post(URL, model="m", json={})
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_unexpected_error_during_send_releases_probe(monkeypatch):
+    breaker = half_open_breaker()
+
+    def boom(n, kw):
+        raise RuntimeError("falha fora do HTTP")
+
+    monkeypatch.setattr(providers, "get_session", lambda: FakeSession(boom))
+    with pytest.raises(RuntimeError):
+        providers.post(URL, model="m", json={})
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert not breaker.probe_in_flight
+
+
+def test_circuit_open_fails_fast(monkeypatch):
+    breaker = providers.get_breaker("mock.local", "m")
+    open_breaker(breaker)
+    session = FakeSession(lambda n, kw: FakeResponse(200))
+    monkeypatch.setattr(providers, "get_session", lambda: session)
+    with pytest.raises(CircuitOpen):
+        providers.post(URL, model="m", json={})
+    assert session.calls == 0
+
+
+# ==========================
+# HEDGING (caminho síncrono)
+# ==========================
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_HEDGING", True)
+    monkeypatch.setattr(settings, "PROVIDER_HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(settings, "PROVIDER_HEDGE_MAX_RATIO", 1.0)
+    tracker = providers.get_latency_tracker(URL, "m")
+    tracker.observe(0.05)
+    return tracker
+
+
+def test_primary_runs_on_calling_thread_without_hedge(monkeypatch, hedging):
+    threads = []
+
+    def handler(n, kw):
+        threads.append(threading.current_thread())
+        return FakeResponse(200)
+
+    monkeypatch.setattr(providers, "get_session", lambda: FakeSession(handler))
+    providers.post_json(URL, {"model": "m"})
+    assert threads == [threading.current_thread()]
+
+
+def test_stalled_primary_is_bounded_and_hedge_answers(monkeypatch, hedging):
+    monkeypatch.setattr(settings, "PROVIDER_HEDGE_MIN_TIMEOUT", 0.3)
+    monkeypatch.setattr(settings, "PROVIDER_MAX_RETRIES", 2)
+    primary_thread = threading.current_thread()
+    timeouts = []
+
+    def handler(n, kw):
+        timeouts.append(kw["timeout"])
+        if threading.current_thread() is primary_thread:
+            time.sleep(kw["timeout"])
+            raise requests.Timeout("travada")
+        return FakeResponse(200)
+
+    monkeypatch.setattr(providers, "get_session", lambda: FakeSession(handler))
+    start = time.perf_counter()
+    data = providers.post_json(URL, {"model": "m"}, timeout=600)
+    elapsed = time.perf_counter() - start
+
+    assert data == {"choices": [], "usage": None}
+    assert all(t <= 0.3 for t in timeouts)
+    # a cópia respondeu: a original não tentou de novo
+    assert elapsed < 1.0
@@ -0,0 +1,47 @@
+import pytest
+
+from backend.query_stats import is_read_only, normalize_statement
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT id, content FROM documents WHERE id = ANY(%s)",
+        "select count(*) from conversation_turns where conversation_id = %s",
+        "WITH recent AS (SELECT * FROM analysis_jobs) SELECT max(id) FROM recent",
+        "SELECT coalesce(sum(cost_usd), 0) FROM usage_records "
+        "WHERE created_at > now() - make_interval(days => %s)",
+        "SELECT to_regclass('public.documents')",
+        "SELECT 'nextval(x)' AS texto",
+    ],
+)
+def test_reads(sql):
+    assert is_read_only(sql)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT pg_advisory_lock(727310031);",
+        "SELECT pg_advisory_xact_lock(%s)",
+        "SELECT pg_try_advisory_lock(1)",
+        "SELECT nextval('documents_id_seq')",
+        "SELECT set_config('statement_timeout', '0', false)",
+        "SELECT minha_funcao(%s)",
+        "SELECT * FROM jobs FOR UPDATE",
+        "WITH moved AS (DELETE FROM jobs RETURNING *) SELECT * FROM moved",
+        "INSERT INTO documents (content) VALUES (%s)",
+        "UPDATE analysis_jobs SET status = %s",
+        "",
+    ],
+)
+def test_not_reads(sql):
+    assert not is_read_only(sql)
+
+
+def test_normalize_collapses_literals_and_values():
+    a = normalize_statement("SELECT * FROM t WHERE id = 1 AND name = 'a'")
+    b = normalize_statement("SELECT * FROM t WHERE id = 22 AND name = 'bb'")
+    assert a == b == "SELECT * FROM t WHERE id = ? AND name = ?"
+    rows = normalize_statement(b"INSERT INTO t (a, b) VALUES (1, 'x'), (2, 'y'), (3, 'z')")
+    assert rows == "INSERT INTO t (a, b) VALUES (...)"